@@ -1,14 +1,21 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import datetime
-from io import BytesIO
-
-# PDF (ReportLab)
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
+import html
+import json
+import os
+import db
+from db import (DB, init_db, add_client, update_client, delete_client,
+                add_hearing, add_payment, df_clients,
+                balance_for, df_outstanding, upcoming_hearings, upcoming_counts, hearings_page, payments_page, count_hearings, count_payments,
+                search_clients, client_index)
+import archive
+import backup
+import bulk_import
+import diagnostics
+import jobs
+import pdf_export
+import reports
 
 # ---------------- Page & Style ----------------
 st.set_page_config(page_title="Advocate Client Desk", layout="centered")
@@ -80,126 +87,16 @@ st.markdown(APP_CSS, unsafe_allow_html=True)
 
 
 # ---------------- Database ----------------
-DB = "advocate_clients.db"
-
-def conn_cur():
-    c = sqlite3.connect(DB, check_same_thread=False)
-    c.execute("PRAGMA foreign_keys = ON")
-    return c, c.cursor()
-
-def table_columns(conn, table):
-    cur = conn.execute(f"PRAGMA table_info({table})")
-    return [r[1] for r in cur.fetchall()]
-
-def safe_alter(conn, table, col, coltype):
-    cols = table_columns(conn, table)
-    if col not in cols:
-        conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {coltype}")
-
-def init_db():
-    con, cur = conn_cur()
-    # base tables
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS clients (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            case_details TEXT,
-            contact TEXT
-        )
-    """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS hearings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            client_id INTEGER NOT NULL,
-            hearing_date DATE NOT NULL,
-            note TEXT,
-            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
-        )
-    """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            client_id INTEGER NOT NULL,
-            pay_date DATE NOT NULL,
-            amount REAL NOT NULL,
-            mode TEXT,
-            note TEXT,
-            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
-        )
-    """)
-    # migrate: add new columns if missing
-    safe_alter(con, "clients", "agreed_fee", "REAL DEFAULT 0")
-    safe_alter(con, "clients", "payment_status", "TEXT DEFAULT 'Unpaid'")
-    safe_alter(con, "clients", "commitment_date", "DATE")
-    safe_alter(con, "clients", "first_visit_date", "DATE")
-    con.commit(); con.close()
-
-def add_client(name, case_details, contact, agreed_fee, status, commitment_date, first_visit_date):
-    con, cur = conn_cur()
-    cur.execute("""INSERT INTO clients (name, case_details, contact, agreed_fee, payment_status, commitment_date, first_visit_date)
-                   VALUES (?,?,?,?,?,?,?)""",
-                (name, case_details, contact, agreed_fee, status, str(commitment_date) if commitment_date else None,
-                 str(first_visit_date) if first_visit_date else None))
-    con.commit(); con.close()
-
-def update_client(cid, name, case_details, contact, agreed_fee, status, commitment_date, first_visit_date):
-    con, cur = conn_cur()
-    cur.execute("""UPDATE clients SET name=?, case_details=?, contact=?, agreed_fee=?, payment_status=?, commitment_date=?, first_visit_date=?
-                   WHERE id=?""",
-                (name, case_details, contact, agreed_fee, status,
-                 str(commitment_date) if commitment_date else None,
-                 str(first_visit_date) if first_visit_date else None, cid))
-    con.commit(); con.close()
-
-def delete_client(cid):
-    con, cur = conn_cur()
-    cur.execute("DELETE FROM clients WHERE id=?", (cid,))
-    con.commit(); con.close()
-
-def add_hearing(cid, hearing_date, note):
-    con, cur = conn_cur()
-    cur.execute("INSERT INTO hearings (client_id, hearing_date, note) VALUES (?,?,?)",
-                (cid, str(hearing_date), note))
-    con.commit(); con.close()
-
-def add_payment(cid, pay_date, amount, mode, note):
-    con, cur = conn_cur()
-    cur.execute("INSERT INTO payments (client_id, pay_date, amount, mode, note) VALUES (?,?,?,?,?)",
-                (cid, str(pay_date), amount, mode, note))
-    con.commit(); con.close()
-
-def df_clients():
-    con, cur = conn_cur()
-    df = pd.read_sql_query("SELECT * FROM clients ORDER BY name COLLATE NOCASE", con)
-    con.close(); return df
-
-def df_hearings():
-    con, cur = conn_cur()
-    df = pd.read_sql_query("""SELECT h.id, h.client_id, c.name, h.hearing_date, h.note
-                              FROM hearings h JOIN clients c ON c.id=h.client_id
-                              ORDER BY h.hearing_date ASC, c.name""", con)
-    con.close(); return df
-
-def df_payments():
-    con, cur = conn_cur()
-    df = pd.read_sql_query("""SELECT p.id, p.client_id, c.name, p.pay_date, p.amount, p.mode, p.note
-                              FROM payments p JOIN clients c ON c.id=p.client_id
-                              ORDER BY p.pay_date DESC""", con)
-    con.close(); return df
-
-def total_paid_for(cid):
-    con, cur = conn_cur()
-    cur.execute("SELECT COALESCE(SUM(amount),0) FROM payments WHERE client_id=?", (cid,))
-    val = cur.fetchone()[0] or 0
-    con.close(); return float(val)
-
 init_db()
+db.manager().pin_data_version()   # one cross-process change check per rerun
+backup.scheduler(DB)   # snapshots every BACKUP_INTERVAL_MIN minutes on a background thread
 
 # ---------------- Session: Login ----------------
 if "logged_in" not in st.session_state:
     st.session_state.logged_in = False
 
 USER, PASS = "amol", "amolsanap"
+ADMINS = {USER}   # may open the archive, backup and diagnostics panels
 
 if not st.session_state.logged_in:
     with st.container():
@@ -211,6 +108,7 @@ if not st.session_state.logged_in:
         if st.button("Login", key="login_btn"):
             if u == USER and p == PASS:
                 st.session_state.logged_in = True
+                st.session_state.user = u
                 st.rerun()
             else:
                 st.error("Invalid username or password")
@@ -219,39 +117,116 @@ if not st.session_state.logged_in:
 
 # ---------------- Main UI ----------------
 st.title("⚖️ Advocate Client Desk")
+diagnostics.start_rerun(st.session_state, st.session_state.get("user"))
+diagnostics.section("load")
 
 clients = df_clients()
-hearings = df_hearings()
-payments = df_payments()
+idx = client_index()
 
 today = datetime.date.today()
 tomorrow = today + datetime.timedelta(days=1)
 
+PAY_MODES = ["Cash","UPI","Bank","Cheque","Other"]
+
+def day_str(col, fmt="%d-%b-%Y"):
+    # datetime64 column from db -> display text, one vectorized pass
+    return col.dt.strftime(fmt).fillna("")
+PICKER_LIMIT = 50
+
+# --- Type-ahead client picker (ids, not names; only matches go to the browser) ---
+def client_picker(label, key, allow_all=False):
+    q = st.text_input(label, key=f"{key}_q", placeholder="Type a name, case or phone…")
+    ids, total = idx.prefix(q, PICKER_LIMIT)
+    if q.strip() and len(ids) < PICKER_LIMIT:
+        # fall back to word/case/contact matches from the search index
+        more = [i for i in search_clients(q, PICKER_LIMIT)['id'].tolist() if i in idx and i not in ids]
+        ids += more[:PICKER_LIMIT - len(ids)]
+        total += len(more)
+    options = ([None] if allow_all else []) + ids
+    if not options:
+        st.caption("No matching client.")
+        return None
+    cid = st.selectbox(label, options, key=key, label_visibility="collapsed",
+                       format_func=lambda i: "All clients" if i is None else idx.label(i))
+    if total > PICKER_LIMIT:
+        st.caption(f"Showing {PICKER_LIMIT} of {total:,} — keep typing to narrow")
+    return cid
+
+# --- Paged history helpers (filters + keyset cursor kept in session) ---
+def history_filters(key, modes=None):
+    cols = st.columns(4 if modes else 3)
+    with cols[0]:
+        cid = client_picker("Filter client", f"{key}_f_client", allow_all=True)
+    with cols[1]:
+        since = st.date_input("From", value=None, key=f"{key}_f_from")
+    with cols[2]:
+        until = st.date_input("To", value=None, key=f"{key}_f_to")
+    filters = (cid, since, until)
+    if modes:
+        with cols[3]:
+            mode = st.selectbox("Mode", ["All"] + modes, key=f"{key}_f_mode")
+        filters += (None if mode == "All" else mode,)
+    # archived rows are read (UNION ALL) only when asked for
+    filters += (st.checkbox("Include archive", key=f"{key}_f_arch") if archive.exists(DB) else False,)
+    return filters
+
+def history_pager(key, filters):
+    # stack of cursors: the last one fetches the current page
+    pager = st.session_state.setdefault(f"{key}_pager", {"filters": None, "stack": [None]})
+    if pager["filters"] != filters:
+        pager["filters"], pager["stack"] = filters, [None]
+    return pager
+
+def history_nav(key, pager, nxt, total, extra=""):
+    page_no = len(pager["stack"])
+    pages = max(1, -(-total // db.PAGE_SIZE))
+    n1, n2, n3 = st.columns([1,2,1])
+    with n1:
+        if st.button("◀ Prev", key=f"{key}_prev", disabled=page_no == 1):
+            pager["stack"].pop()
+            st.rerun()
+    with n2:
+        st.caption(f"Page {page_no} of {pages} · {total:,} records{extra}")
+    with n3:
+        if st.button("Next ▶", key=f"{key}_next", disabled=nxt is None):
+            pager["stack"].append(nxt)
+            st.rerun()
+
 # --- Top Alerts: Upcoming hearings in date order ---
-if not hearings.empty:
-    hearings['hearing_date'] = pd.to_datetime(hearings['hearing_date'], errors='coerce').dt.date
-    upcoming = hearings[hearings['hearing_date'] >= today].sort_values(['hearing_date','name'])
-    if not upcoming.empty:
-        chips = []
-        for _, r in upcoming.iterrows():
-            d = r['hearing_date']
-            if d == today:
-                badge = '<span class="badge badge-today">Today</span>'
-            elif d == tomorrow:
-                badge = '<span class="badge badge-tomorrow">Tomorrow</span>'
-            else:
-                badge = f'<span class="badge">{d.strftime("%d-%b-%Y")}</span>'
-            chips.append(
-                f'''<span class="alert-chip">
-                        {badge}
-                        <span>{r["name"]}</span>
-                        <span style="color:#666">— {(r["note"] or "").strip()[:40]}</span>
-                    </span>'''
-            )
-        html = '<div class="alerts-stick">📅 Upcoming Hearings: ' + "".join(chips[:30]) + "</div>"
-        st.markdown(html, unsafe_allow_html=True)
+def upcoming_chips(up):
+    # a handful of rows; built column-wise rather than with iterrows()
+    d = up['hearing_date']
+    badge = ('<span class="badge">' + day_str(d) + '</span>').where(d != pd.Timestamp(tomorrow), '<span class="badge badge-tomorrow">Tomorrow</span>')
+    badge = badge.where(d != pd.Timestamp(today), '<span class="badge badge-today">Today</span>')
+    names = up['name'].fillna("").map(html.escape)
+    notes = up['note'].fillna("").str.strip().str[:40].map(html.escape)
+    return ('<span class="alert-chip">' + badge + '<span>' + names + '</span>'
+            '<span style="color:#666">— ' + notes + '</span></span>')
+
+diagnostics.section("alerts")
+counts = upcoming_counts(today)
+if counts["any"]:
+    chips = upcoming_chips(upcoming_hearings(today))
+    summary = f'Today {counts["today"]} · Tomorrow {counts["tomorrow"]} · This week {counts["week"]}'
+    html_ = ('<div class="alerts-stick">📅 Upcoming Hearings '
+             f'<span style="color:#666">({summary})</span>: ' + "".join(chips) + "</div>")
+    st.markdown(html_, unsafe_allow_html=True)
+
+# ---- Search (FTS5 over names, case details, contacts and notes) ----
+diagnostics.section("search")
+query = st.text_input("🔎 Search clients, cases, contacts, hearing & payment notes",
+                      key="search_q", placeholder="e.g. sharma high court, 98765, cheque")
+if query.strip():
+    found = search_clients(query)
+    if found.empty:
+        st.caption("No matches.")
+    else:
+        st.dataframe(found.rename(columns={'id':'ID','name':'Client','case_details':'Case','contact':'Contact',
+                                           'kind':'Matched in','match':'Match','hits':'Hits'}),
+                     use_container_width=True, hide_index=True)
 
 # ---- Add Client ----
+diagnostics.section("add")
 with st.container():
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.markdown("### 👤 Add New Client")
@@ -274,86 +249,111 @@ with st.container():
             st.error("Please fill Name and Case Details.")
     st.markdown('</div>', unsafe_allow_html=True)
 
+# ---- Bulk Import (CSV / Excel) ----
+diagnostics.section("import")
+with st.expander("📥 Bulk Import (CSV / Excel)"):
+    bi_kind = st.selectbox("Import", ["clients", "hearings", "payments"], key="bi_kind",
+                           format_func=str.title)
+    st.caption("Columns: " + ", ".join(bulk_import.REQUIRED[bi_kind]) + " (required) · "
+               "hearings/payments match clients by name or client_id")
+    bi_file = st.file_uploader("File", type=["csv", "xlsx"], key="bi_file")
+    bi_dry = st.checkbox("Dry run (validate only)", value=True, key="bi_dry")
+    if bi_file is not None and st.button("Run Import", key="bi_run"):
+        bar = st.progress(0.0, text="Importing…")
+        size = max(1, bi_file.size)
+        rep = bulk_import.import_file(bi_kind, bi_file, dry_run=bi_dry, filename=bi_file.name,
+                                      progress=lambda r: bar.progress(min(1.0, bi_file.tell() / size),
+                                                                      text=f"{r.rows:,} rows read"))
+        bar.empty()
+        res = rep.as_dict()
+        verb = "validated" if bi_dry else "imported"
+        st.success(f"{res['loaded']:,} of {res['rows']:,} rows {verb} · {res['rejected']:,} rejected · "
+                   f"{res['rows_per_s'] or 0:,} rows/s")
+        if rep.errors:
+            errs = pd.DataFrame(rep.errors, columns=["Line", "Column", "Value", "Error"])
+            st.dataframe(errs.head(500), use_container_width=True)
+            st.download_button("⬇️ Error report (CSV)", errs.to_csv(index=False).encode("utf-8"),
+                               file_name=f"import_errors_{bi_kind}.csv", mime="text/csv")
+
 # ---- Modify Client ----
+diagnostics.section("modify")
 if not clients.empty:
     with st.container():
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.markdown("### ✏️ Modify Client")
-        sel_name = st.selectbox("Select Client", options=clients['name'].tolist(), key="mod_select")
-        row = clients[clients['name'] == sel_name].iloc[0]
-        def safe_iso(d):
-            try:
-                return datetime.date.fromisoformat(d) if d else None
-            except Exception:
-                return None
+        mod_cid = client_picker("Select Client", "mod_select")
+        row = idx.get(mod_cid) or {}
         m1, m2 = st.columns(2)
         with m1:
             e_name = st.text_input("Client Name", value=row.get('name') or "", key="edit_name")
             e_contact = st.text_input("Contact", value=row.get('contact') or "", key="edit_contact")
             e_fee = st.number_input("Agreed Fee (₹)", min_value=0.0, step=500.0, value=float(row.get('agreed_fee') or 0), key="edit_fee")
-            e_first = st.date_input("First Visit Date", value=safe_iso(row.get('first_visit_date')) or today, key="edit_first")
+            e_first = st.date_input("First Visit Date", value=db.as_date(row.get('first_visit_date')) or today, key="edit_first")
         with m2:
             e_case = st.text_input("Case Details", value=row.get('case_details') or "", key="edit_case")
             e_status = st.selectbox("Payment Status", ["Unpaid","Paid"], index=0 if (row.get('payment_status') or "Unpaid")=="Unpaid" else 1, key="edit_status")
-            e_commit = st.date_input("Payment Commitment Date", value=safe_iso(row.get('commitment_date')) or today, key="edit_commit")
+            e_commit = st.date_input("Payment Commitment Date", value=db.as_date(row.get('commitment_date')) or today, key="edit_commit")
         colb1, colb2 = st.columns([1,1])
         with colb1:
-            if st.button("💾 Save Changes", key="save_client"):
+            if st.button("💾 Save Changes", key="save_client", disabled=not row):
                 update_client(int(row['id']), e_name, e_case, e_contact, e_fee, e_status, e_commit, e_first)
                 st.success("Updated successfully.")
                 st.rerun()
         with colb2:
-            if st.button("🗑 Delete Client", key="del_client"):
+            if st.button("🗑 Delete Client", key="del_client", disabled=not row):
                 delete_client(int(row['id']))
                 st.success("Client deleted.")
                 st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
 
 # ---- Hearings: Add + History ----
+diagnostics.section("hearings")
 if not clients.empty:
     with st.container():
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.markdown("### 🧾 Hearings")
-        h_client = st.selectbox("Client", options=clients['name'].tolist(), key="hear_client")
-        h_cid = int(clients[clients['name']==h_client]['id'].iloc[0])
+        h_cid = client_picker("Client", "hear_client")
         hc1, hc2 = st.columns(2)
         with hc1:
             h_date = st.date_input("Hearing Date", key="hear_date")
         with hc2:
             h_note = st.text_input("Note (Court/Stage/etc.)", key="hear_note")
-        if st.button("➕ Add Hearing", key="add_hear_btn"):
+        if st.button("➕ Add Hearing", key="add_hear_btn", disabled=h_cid is None):
             add_hearing(h_cid, h_date, h_note)
             st.success("Hearing added.")
             st.rerun()
 
-        # Hearing history
-        hdf = df_hearings()
-        if not hdf.empty:
-            st.markdown("**Hearing History (all clients)**")
-            hd = hdf.copy()
-            hd['hearing_date'] = pd.to_datetime(hd['hearing_date'], errors='coerce').dt.strftime("%d-%b-%Y")
+        # Hearing history (one page at a time)
+        st.markdown("**Hearing History**")
+        h_filters = history_filters("hist_h")
+        h_total = count_hearings(*h_filters)
+        if h_total:
+            h_pager = history_pager("hist_h", h_filters)
+            hd, h_next = hearings_page(*h_filters, h_pager["stack"][-1])
+            hd['hearing_date'] = day_str(hd['hearing_date'])
             st.dataframe(hd[['name','hearing_date','note']].rename(columns={'name':'Client','hearing_date':'Date','note':'Note'}), use_container_width=True)
+            history_nav("hist_h", h_pager, h_next, h_total)
         else:
-            st.info("No hearings recorded yet.")
+            st.info("No hearings recorded yet." if not any(h_filters) else "No hearings match these filters.")
         st.markdown('</div>', unsafe_allow_html=True)
 
 # ---- Payments: Part Payments + Summary ----
+diagnostics.section("payments")
 if not clients.empty:
     with st.container():
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.markdown("### 💸 Payments")
-        p_client = st.selectbox("Client", options=clients['name'].tolist(), key="pay_client")
-        p_cid = int(clients[clients['name']==p_client]['id'].iloc[0])
+        p_cid = client_picker("Client", "pay_client")
         pc1, pc2, pc3 = st.columns(3)
         with pc1:
             p_date = st.date_input("Payment Date", key="pay_date", value= today)
         with pc2:
             p_amount = st.number_input("Amount (₹)", min_value=0.0, step=500.0, key="pay_amount")
         with pc3:
-            p_mode = st.selectbox("Mode", ["Cash","UPI","Bank","Cheque","Other"], key="pay_mode")
+            p_mode = st.selectbox("Mode", PAY_MODES, key="pay_mode")
         p_note = st.text_input("Note (optional)", key="pay_note")
 
-        if st.button("➕ Add Part Payment", key="add_pay_btn"):
+        if st.button("➕ Add Part Payment", key="add_pay_btn", disabled=p_cid is None):
             if p_amount > 0:
                 add_payment(p_cid, p_date, p_amount, p_mode, p_note)
                 st.success("Payment added.")
@@ -361,158 +361,358 @@ if not clients.empty:
             else:
                 st.error("Amount must be greater than 0.")
 
-        pays = df_payments()
-        if not pays.empty:
-            st.markdown("**Payment History (all clients)**")
-            pdv = pays.copy()
-            pdv['pay_date'] = pd.to_datetime(pdv['pay_date'], errors='coerce').dt.strftime("%d-%b-%Y")
+        # Payment history (one page at a time)
+        st.markdown("**Payment History**")
+        p_filters = history_filters("hist_p", PAY_MODES)
+        p_total, p_sum = count_payments(*p_filters)
+        if p_total:
+            p_pager = history_pager("hist_p", p_filters)
+            pdv, p_next = payments_page(*p_filters, p_pager["stack"][-1])
+            pdv['pay_date'] = day_str(pdv['pay_date'])
             st.dataframe(
                 pdv[['name','pay_date','amount','mode','note']].rename(
                     columns={'name':'Client','pay_date':'Date','amount':'Amount (₹)','mode':'Mode','note':'Note'}
                 ),
                 use_container_width=True
             )
+            history_nav("hist_p", p_pager, p_next, p_total, f" · ₹{p_sum:,.0f}")
         else:
-            st.info("No payments recorded yet.")
+            st.info("No payments recorded yet." if not any(p_filters) else "No payments match these filters.")
 
         # Summary for selected client
-        sel_row = clients[clients['name']==p_client].iloc[0]
-        agreed = float(sel_row.get('agreed_fee') or 0)
-        paid = total_paid_for(int(sel_row['id']))
-        pending = max(0.0, agreed - paid)
-        b1, b2, b3 = st.columns(3)
-        with b1: st.markdown(f"**Agreed Fee:** ₹{agreed:,.0f}")
-        with b2: st.markdown(f"**Total Paid:** ₹{paid:,.0f}")
-        with b3: st.markdown(f"**Pending:** ₹{pending:,.0f}")
+        if p_cid is not None:
+            agreed = float(idx.get(p_cid).get('agreed_fee') or 0)
+            bal = balance_for(p_cid)
+            b1, b2, b3 = st.columns(3)
+            with b1: st.markdown(f"**Agreed Fee:** ₹{agreed:,.0f}")
+            with b2: st.markdown(f"**Total Paid:** ₹{bal['total_paid']:,.0f}")
+            with b3: st.markdown(f"**Pending:** ₹{bal['pending']:,.0f}")
+            if bal['payment_count']:
+                st.caption(f"{bal['payment_count']} payment(s), last on {bal['last_payment_date']:%d-%b-%Y}")
         st.markdown('</div>', unsafe_allow_html=True)
 
+# ---- Outstanding Dues (ledger, largest first) ----
+diagnostics.section("dues")
+dues = df_outstanding()
+if not dues.empty:
+    with st.container():
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown("### 💰 Outstanding Dues")
+        st.dataframe(
+            dues.assign(last_payment_date=day_str(dues['last_payment_date'], "%Y-%m-%d"),
+                        commitment_date=day_str(dues['commitment_date'], "%Y-%m-%d"))
+                [['name','contact','agreed_fee','total_paid','pending','last_payment_date','commitment_date']].rename(
+                columns={'name':'Client','contact':'Contact','agreed_fee':'Agreed Fee (₹)','total_paid':'Paid (₹)',
+                         'pending':'Pending (₹)','last_payment_date':'Last Payment','commitment_date':'Commitment'}
+            ),
+            use_container_width=True
+        )
+        st.markdown('</div>', unsafe_allow_html=True)
+
+# ---- Reports: dues aging, collections, hearing load ----
+diagnostics.section("reports")
+with st.container():
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.markdown("### 📊 Reports")
+    r1, r2, r3 = st.columns(3)
+    with r1:
+        rep_as_of = st.date_input("As of", value=datetime.date.today(), key="rep_as_of")
+    with r2:
+        rep_months = int(st.number_input("Months of collections", min_value=1, max_value=60,
+                                         value=reports.MONTHS, step=1, key="rep_months"))
+    with r3:
+        rep_archived = archive.exists(DB) and st.checkbox("Include archived history", value=False, key="rep_archived")
+    rep = reports.build(rep_as_of, rep_months, archived=bool(rep_archived))
+    aging = rep["aging"]
+    for col, r in zip(st.columns(len(aging)), aging.itertuples()):
+        col.metric(r.bucket, f"₹{r.pending:,.0f}", f"{r.clients} client(s)", delta_color="off")
+    t_aging, t_coll, t_load = st.tabs(["Dues aging", "Collections", "Hearing load"])
+    with t_aging:
+        st.bar_chart(aging, x="bucket", y="pending", x_label="", y_label="Pending (₹)", sort=False)
+        st.dataframe(rep["debtors"][['bucket','name','contact','pending','commitment_date','days_overdue','last_payment_date']]
+                     .rename(columns={'bucket':'Bucket','name':'Client','contact':'Contact','pending':'Pending (₹)',
+                                      'commitment_date':'Commitment','days_overdue':'Days overdue',
+                                      'last_payment_date':'Last Payment'}),
+                     use_container_width=True, hide_index=True)
+    with t_coll:
+        coll = rep["collections"]
+        lo, hi = rep["periods"]["collections"]
+        st.caption(f"{lo:%d-%b-%Y} to {hi:%d-%b-%Y} · ₹{coll['amount'].sum():,.0f} in {coll['payments'].sum():,} payment(s)")
+        if not coll.empty:
+            st.bar_chart(coll, x="month", y="amount", color="mode", x_label="", y_label="Received (₹)")
+            st.dataframe(coll.pivot_table(index="month", columns="mode", values="amount", aggfunc="sum", observed=True)
+                         .assign(Total=lambda t: t.sum(axis=1)), use_container_width=True)
+    with t_load:
+        lo, hi = rep["periods"]["hearings"]
+        st.caption(f"Weeks of {lo:%d-%b-%Y} to {hi:%d-%b-%Y}")
+        st.bar_chart(rep["hearings_by_week"], x="week", y="hearings", x_label="Week of", y_label="Hearings")
+        st.dataframe(rep["hearings_by_court"].rename(
+                         columns={'court':'Court','hearings':'Hearings','clients':'Clients','first_date':'First',
+                                  'last_date':'Last','share':'Share','rank':'Rank'}),
+                     column_config={"Share": st.column_config.ProgressColumn(format="percent", min_value=0, max_value=1)},
+                     use_container_width=True, hide_index=True)
+    st.download_button("⬇️ Export report (Excel)", data=lambda: reports.to_excel(rep),
+                       file_name=f"report_{rep_as_of}.xlsx", key="rep_export",
+                       mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    st.markdown('</div>', unsafe_allow_html=True)
+
 # ---- Clients Master Table ----
+diagnostics.section("clients")
 if not clients.empty:
     with st.container():
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.markdown("### 📋 Clients")
         show = clients.copy()
         show['Agreed Fee (₹)'] = show['agreed_fee']
-        show['Commitment'] = show['commitment_date']
+        show['Paid (₹)'] = show['total_paid']
+        show['Pending (₹)'] = show['pending']
+        show['Commitment'] = day_str(show['commitment_date'], "%Y-%m-%d")
         show['Status'] = show['payment_status']
-        show['First Visit'] = show['first_visit_date']
-        show = show[['name','case_details','contact','First Visit','Agreed Fee (₹)','Status','Commitment']].rename(
+        show['First Visit'] = day_str(show['first_visit_date'], "%Y-%m-%d")
+        show = show[['name','case_details','contact','First Visit','Agreed Fee (₹)','Paid (₹)','Pending (₹)','Status','Commitment']].rename(
             columns={'name':'Client','case_details':'Case','contact':'Contact'}
         )
         st.dataframe(show, use_container_width=True)
         st.markdown('</div>', unsafe_allow_html=True)
 
 # ---- PDF Export (well-arranged client database) ----
-def build_pdf():
-    # gather fresh data
-    cdf = df_clients()
-    hdf = df_hearings()
-    pdf = BytesIO()
-    doc = SimpleDocTemplate(pdf, pagesize=A4, leftMargin=24, rightMargin=24, topMargin=36, bottomMargin=24)
-    styles = getSampleStyleSheet()
-    Story = []
-
-    # Title
-    Story.append(Paragraph("Advocate Client Database", styles['Title']))
-    Story.append(Paragraph(f"Generated: {datetime.datetime.now().strftime('%d-%b-%Y %H:%M')}", styles['Normal']))
-    Story.append(Spacer(1, 12))
-
-    # Overall table (brief)
-    if not cdf.empty:
-        brief = [["Client","Case","Contact","First Visit","Agreed Fee","Status","Commitment"]]
-        for _, r in cdf.sort_values("name").iterrows():
-            brief.append([
-                r.get("name",""),
-                r.get("case_details",""),
-                r.get("contact",""),
-                (r.get("first_visit_date") or "")[:10],
-                f"₹{float(r.get('agreed_fee') or 0):,.0f}",
-                r.get("payment_status",""),
-                (r.get("commitment_date") or "")[:10],
-            ])
-        t = Table(brief, repeatRows=1)
-        t.setStyle(TableStyle([
-            ('BACKGROUND',(0,0),(-1,0),colors.lightblue),
-            ('TEXTCOLOR',(0,0),(-1,0),colors.white),
-            ('FONTNAME',(0,0),(-1,0),'Helvetica-Bold'),
-            ('GRID',(0,0),(-1,-1),0.25,colors.grey),
-            ('ROWBACKGROUNDS',(0,1),(-1,-1),[colors.whitesmoke, colors.lightgrey]),
-        ]))
-        Story.append(t)
-        Story.append(PageBreak())
-
-    # Per-client sections
-    for _, r in cdf.sort_values("name").iterrows():
-        cid = int(r["id"])
-        Story.append(Paragraph(f"Client: {r.get('name','')}", styles['Heading2']))
-        Story.append(Paragraph(f"Case: {r.get('case_details','')}", styles['Normal']))
-        Story.append(Paragraph(f"Contact: {r.get('contact','')}", styles['Normal']))
-        Story.append(Paragraph(f"First Visit: {(r.get('first_visit_date') or '')[:10]}", styles['Normal']))
-        Story.append(Paragraph(f"Agreed Fee: ₹{float(r.get('agreed_fee') or 0):,.0f} | Status: {r.get('payment_status','')} | Commitment: {(r.get('commitment_date') or '')[:10]}", styles['Normal']))
-        Story.append(Spacer(1, 8))
-
-        # Hearings for this client
-        ch = hdf[hdf["client_id"]==cid].copy()
-        Story.append(Paragraph("Hearings", styles['Heading3']))
-        if ch.empty:
-            Story.append(Paragraph("— No hearings recorded —", styles['Italic']))
-        else:
-            ch['hearing_date'] = pd.to_datetime(ch['hearing_date'], errors='coerce').dt.strftime("%d-%b-%Y")
-            htbl = [["Date","Note"]]+ ch[['hearing_date','note']].fillna("").values.tolist()
-            t2 = Table(htbl, repeatRows=1, colWidths=[90, 380])
-            t2.setStyle(TableStyle([
-                ('BACKGROUND',(0,0),(-1,0),colors.lightgrey),
-                ('FONTNAME',(0,0),(-1,0),'Helvetica-Bold'),
-                ('GRID',(0,0),(-1,-1),0.25,colors.grey),
-            ]))
-            Story.append(t2)
-
-        Story.append(Spacer(1, 8))
-
-        # Payments for this client
-        con, cur = conn_cur()
-        pdf_pay = pd.read_sql_query("""SELECT pay_date, amount, mode, note
-                                       FROM payments WHERE client_id=?
-                                       ORDER BY pay_date DESC""", con, params=(cid,))
-        con.close()
-        Story.append(Paragraph("Payments", styles['Heading3']))
-        if pdf_pay.empty:
-            Story.append(Paragraph("— No payments recorded —", styles['Italic']))
-        else:
-            pdf_pay['pay_date'] = pd.to_datetime(pdf_pay['pay_date'], errors='coerce').dt.strftime("%d-%b-%Y")
-            ptab = [["Date","Amount","Mode","Note"]] + [
-                [d, f"₹{float(a):,.0f}", m or "", n or ""] for d,a,m,n in pdf_pay.values
-            ]
-            t3 = Table(ptab, repeatRows=1, colWidths=[90, 80, 80, 220])
-            t3.setStyle(TableStyle([
-                ('BACKGROUND',(0,0),(-1,0),colors.lightgrey),
-                ('FONTNAME',(0,0),(-1,0),'Helvetica-Bold'),
-                ('GRID',(0,0),(-1,-1),0.25,colors.grey),
-            ]))
-            Story.append(t3)
-
-        Story.append(Spacer(1, 16))
-        Story.append(PageBreak())
-
-    doc.build(Story)
-    pdf.seek(0)
-    return pdf
-
+diagnostics.section("export")
 st.markdown('<div class="card">', unsafe_allow_html=True)
 st.markdown("### 🖨️ Export")
+max_workers = os.cpu_count() or 1
+pdf_workers = st.number_input("Render processes (1 = serial)", min_value=1, max_value=max_workers,
+                              value=min(pdf_export.WORKERS, max_workers), step=1, key="pdf_workers")
+pdf_incremental = st.checkbox("Reuse unchanged client sections", value=False, key="pdf_incremental",
+                              help="Faster repeat exports, but the merged PDF is held in memory while it is written.")
+pdf_archived = archive.exists(DB) and st.checkbox("Include archived clients", value=False, key="pdf_archived")
 if st.button("Generate PDF (All Clients)", key="gen_pdf"):
-    pdf_bytes = build_pdf().read()
-    st.download_button(
-        label="⬇️ Download Client Database PDF",
-        data=pdf_bytes,
-        file_name=f"client_database_{datetime.date.today().isoformat()}.pdf",
-        mime="application/pdf",
-    )
+    # runs in the background; identical requests share one job
+    st.session_state.pdf_job = jobs.runner(DB).submit(
+        "pdf_export", workers=int(pdf_workers), incremental=bool(pdf_incremental), archived=bool(pdf_archived))
+
+def export_status(job_id, polling):
+    job = jobs.runner(DB).get(job_id)
+    if job is None:
+        return
+    if polling and job["status"] not in jobs.ACTIVE:
+        st.rerun()  # finished: redraw once without polling
+    if job["status"] in jobs.ACTIVE:
+        st.progress(job["progress"], text=f"Export {job['status']}… {job['progress']:.0%}")
+        if st.button("✖ Cancel export", key="cancel_pdf"):
+            jobs.runner(DB).cancel(job_id)
+    elif job["status"] == "done" and job["artifact"] and os.path.exists(job["artifact"]):
+        if job["message"]:
+            st.caption(job["message"])
+        with open(job["artifact"], "rb") as f:
+            st.download_button(
+                label="⬇️ Download Client Database PDF",
+                data=f.read(),
+                file_name=f"client_database_{job['created_at'][:10]}.pdf",
+                mime="application/pdf",
+            )
+    elif job["status"] == "cancelled":
+        st.info("Export cancelled.")
+    else:
+        st.error(f"Export failed: {(job['error'] or 'artifact missing').splitlines()[0]}")
+
+pdf_job = st.session_state.get("pdf_job")
+if pdf_job:
+    job = jobs.runner(DB).get(pdf_job)
+    polling = bool(job) and job["status"] in jobs.ACTIVE
+    st.fragment(export_status, run_every=2 if polling else None)(pdf_job, polling)
 st.markdown('</div>', unsafe_allow_html=True)
 
+# ---- Query cache stats ----
+diagnostics.section("admin")
+with st.expander("⚙️ Query cache"):
+    cs = db.manager(DB).cache.stats()
+    st.caption(
+        f"Hits {cs['hits']} · Misses {cs['misses']} · Hit rate {cs['hit_rate']:.0%} · "
+        f"Entries {cs['entries']} · {cs['bytes']/2**20:.1f} / {cs['max_bytes']/2**20:.0f} MiB · "
+        f"Evictions {cs['evictions']} · Data generation {cs['generation']}"
+    )
+
+# ---- Archive (admins only) ----
+def job_status(job_id, polling, verb):
+    job = jobs.runner(DB).get(job_id)
+    if job is None:
+        return
+    if polling and job["status"] not in jobs.ACTIVE:
+        st.rerun()
+    if job["status"] in jobs.ACTIVE:
+        st.progress(job["progress"], text=f"{verb}… {job['progress']:.0%}")
+    elif job["status"] == "done":
+        st.caption(job["message"] or "Finished.")
+    elif job["status"] == "cancelled":
+        st.info(f"{verb} stopped.")
+    else:
+        st.error(f"{verb} failed: {(job['error'] or '').splitlines()[0]}")
+
+if st.session_state.get("user") in ADMINS:
+    with st.expander("🗄️ Archive"):
+        ar = archive.stats(DB)
+        st.caption(f"Archive: {ar['clients']:,} clients · {ar['hearings']:,} hearings · {ar['payments']:,} payments · "
+                   f"{ar['bytes']/2**20:.1f} MiB")
+        a1, a2 = st.columns([2, 1])
+        with a1:
+            horizon = int(st.number_input("Archive history older than (days)", min_value=30, step=30,
+                                          value=archive.HORIZON_DAYS, key="arch_days"))
+        with a2:
+            if st.button("Preview", key="arch_preview"):
+                st.session_state.arch_plan = (horizon, archive.preview(horizon, DB))
+        plan = st.session_state.get("arch_plan")
+        if plan and plan[0] == horizon:
+            n = plan[1]
+            st.caption(f"Would move {n['clients']:,} closed, fully paid clients and "
+                       f"{n['hearings']:,} hearings / {n['payments']:,} payments older than {horizon} days.")
+        if st.button("Archive now", key="arch_run"):
+            st.session_state.arch_job = jobs.runner(DB).submit("archive", horizon_days=horizon)
+            st.session_state.pop("arch_plan", None)
+        arch_job = st.session_state.get("arch_job")
+        if arch_job:
+            job = jobs.runner(DB).get(arch_job)
+            polling = bool(job) and job["status"] in jobs.ACTIVE
+            st.fragment(job_status, run_every=2 if polling else None)(arch_job, polling, "Archiving")
+
+        st.markdown("**Restore a client**")
+        found = archive.archived_clients(st.text_input("Archived client name", key="arch_find"), path=DB)
+        if not found.empty:
+            labels = {int(r.id): f"{r.name} — {r.case_details or ''} (archived {r.archived_on:%d-%b-%Y})"
+                      for r in found.itertuples()}
+            r_cid = st.selectbox("Client", list(labels), format_func=labels.get, key="arch_restore_client")
+            if st.button("↩️ Restore to active", key="arch_restore_btn"):
+                got = archive.restore(r_cid, DB)
+                st.success(f"Restored with {got['hearings']} hearing(s) and {got['payments']} payment(s).")
+                st.rerun()
+        elif ar['clients']:
+            st.caption("No archived client matches that name.")
+
+# ---- Unreadable legacy dates (admins only) ----
+if st.session_state.get("user") in ADMINS:
+    rejects = db.date_rejects()
+    if not rejects.empty:
+        with st.expander(f"📅 Unreadable dates ({len(rejects)})"):
+            st.caption("Dates the upgrade could not read. Held hearings and payments stay out of history, "
+                       "reports, dues and the archive until they get a date.")
+            st.dataframe(rejects, use_container_width=True, hide_index=True)
+            labels = {(r.table_name, int(r.row_id), r.column_name):
+                      f"{r.table_name} #{r.row_id} · {r.name or 'deleted client'} · {r.column_name} was {r.original!r}"
+                      for r in rejects.itertuples()}
+            dr_key = st.selectbox("Row", list(labels), format_func=labels.get, key="dr_pick")
+            dr1, dr2, dr3 = st.columns([2, 1, 1])
+            with dr1:
+                dr_day = st.date_input("Correct date", key="dr_day")
+            with dr2:
+                if st.button("Save date", key="dr_fix"):
+                    try:
+                        db.fix_date_reject(*dr_key, dr_day)
+                        st.rerun()
+                    except KeyError as e:
+                        st.error(e.args[0])
+            with dr3:
+                if st.button("Discard", key="dr_drop"):
+                    db.discard_date_reject(*dr_key)
+                    st.rerun()
+
+# ---- Backups (admins only) ----
+if st.session_state.get("user") in ADMINS:
+    with st.expander("💾 Backups"):
+        sched = backup.scheduler(DB)
+        if sched is None:
+            st.caption("Scheduled backups are off (BACKUP_INTERVAL_MIN=0).")
+        else:
+            note = f"Every {sched.interval.total_seconds() / 60:.0f} min · next at {sched.next_due():%d-%b %H:%M}"
+            if isinstance(sched.last, dict) and sched.last.get("error"):
+                note += f" · last run failed: {sched.last['error']}"
+            st.caption(note)
+        if st.button("Back up now", key="bk_now"):
+            st.session_state.bk_job = jobs.runner(DB).submit("backup")
+        bk_job = st.session_state.get("bk_job")
+        if bk_job:
+            job = jobs.runner(DB).get(bk_job)
+            polling = bool(job) and job["status"] in jobs.ACTIVE
+            st.fragment(job_status, run_every=2 if polling else None)(bk_job, polling, "Backing up")
+
+        snaps = backup.list_snapshots(DB)
+        if snaps:
+            st.dataframe(pd.DataFrame([{"Snapshot": s["name"], "Taken": s["taken"], "MiB": round(s["bytes"] / 2**20, 2),
+                                        "Integrity": s.get("integrity") or "?",
+                                        "Clients": (s.get("counts") or {}).get("clients")} for s in snaps]),
+                         use_container_width=True, hide_index=True)
+            b1, b2 = st.columns([3, 1])
+            with b1:
+                pick = st.selectbox("Snapshot", [s["name"] for s in snaps], key="bk_pick")
+            with b2:
+                if st.button("Inspect", key="bk_inspect"):
+                    st.session_state.bk_seen = backup.inspect(pick, DB)
+            seen = st.session_state.get("bk_seen")
+            if seen and seen["name"] == pick:
+                st.caption(f"Integrity {seen['integrity']} · schema v{seen['user_version']} · "
+                           + " · ".join(f"{v:,} {k}" for k, v in seen["counts"].items()))
+                gone = seen["deleted_clients"]
+                if not gone.empty:
+                    labels = {int(r.id): f"{r.name} — {r.case_details or ''}" for r in gone.itertuples()}
+                    g_cid = st.selectbox(f"Clients deleted since ({seen['deleted_count']})", list(labels),
+                                         format_func=labels.get, key="bk_client")
+                    if st.button("↩️ Recover client", key="bk_recover"):
+                        got = backup.recover_client(pick, g_cid, DB)
+                        st.success(f"Recovered with {got['hearings']} hearing(s) and {got['payments']} payment(s).")
+                        st.session_state.pop("bk_seen", None)
+                        st.rerun()
+        else:
+            st.caption(f"No snapshots yet in {backup.backup_dir(DB)}.")
+
+# ---- Diagnostics (admins only) ----
+if st.session_state.get("user") in ADMINS:
+    with st.expander("🩺 Diagnostics"):
+        d1, d2 = st.columns(2)
+        with d1:
+            want = st.checkbox("Profile queries and reruns", value=diagnostics.enabled(), key="diag_on")
+        with d2:
+            want_log = st.checkbox("Append reruns to JSON log", value=bool(diagnostics.profiler().log_path),
+                                   key="diag_log", disabled=not want)
+        if want != diagnostics.enabled() or (want and want_log != bool(diagnostics.profiler().log_path)):
+            if want:
+                diagnostics.enable(diagnostics.log_path(DB) if want_log else None)
+            else:
+                diagnostics.disable()
+            st.rerun()
+        if want_log and diagnostics.profiler().log_path:
+            st.caption(f"Logging to {diagnostics.profiler().log_path}")
+        snap = diagnostics.profiler().snapshot()
+        last = st.session_state.get("_diag_last")
+        if last is not None:
+            lr = last.as_dict()
+            st.markdown(f"**Previous rerun:** {lr['total_ms']:,.0f} ms · SQL {lr['sql_ms']:,.0f} ms "
+                        f"in {lr['queries']} statements" + (" · interrupted" if lr['interrupted'] else ""))
+            st.dataframe(pd.DataFrame.from_dict(lr['sections'], orient='index')
+                         .rename(columns={'ms':'Wall ms','sql_ms':'SQL ms','queries':'Statements','other_ms':'Python/render ms'}),
+                         use_container_width=True)
+        if snap['slowest_reruns']:
+            st.markdown("**Slowest reruns**")
+            st.dataframe(pd.DataFrame([{'Started': r['started'], 'Total ms': r['total_ms'], 'SQL ms': r['sql_ms'],
+                                        'Statements': r['queries'],
+                                        'Slowest section': max(r['sections'], key=lambda k: r['sections'][k]['ms'], default='')}
+                                       for r in snap['slowest_reruns']]), use_container_width=True, hide_index=True)
+        if snap['slowest_queries']:
+            st.markdown(f"**Slowest statements** ({snap['statements']:,} traced)")
+            st.dataframe(pd.DataFrame(snap['slowest_queries'])[['ms','ops','section','thread','sql','at']],
+                         use_container_width=True, hide_index=True)
+        g1, g2 = st.columns(2)
+        with g1:
+            st.download_button("⬇️ Snapshot (JSON)", json.dumps(snap, default=str, indent=1).encode("utf-8"),
+                               file_name="diagnostics.json", mime="application/json", key="diag_dl")
+        with g2:
+            if st.button("Reset", key="diag_reset"):
+                diagnostics.profiler().reset()
+                st.rerun()
+
 # ---- Logout ----
 if st.button("🚪 Logout", key="logout"):
     st.session_state.logged_in = False
+    st.session_state.pop("user", None)
     st.rerun()
 
+diagnostics.finish_rerun(st.session_state)
+
 
@@ -0,0 +1,384 @@
+"""Archive tier: closed matters and old history in a separate SQLite file.
+
+The archive sits next to the client database (advocate_clients_archive.db)
+and is ATTACHed as schema "archive" only when something asks for it. run()
+moves, in batches:
+
+  * closed clients -- fully paid (ledger pending 0) with no hearing,
+    payment, first visit or commitment on or after the horizon -- together
+    with all of their hearings and payments;
+  * hearings and payments older than the horizon of every other client.
+
+Payments moved for a client who stays active are carried forward in
+archived_payment_totals (migration 8), so the balance ledger still counts
+them. Live views read only the hot database; history pages and the PDF
+export UNION ALL the archive when asked, and restore() moves a client with
+all of its archived rows back.
+
+Rows keep their ids. A batch is copied to the archive in one transaction
+and deleted from the hot file in a second one; the deletes only take rows
+whose copy exists, and reconcile() drops archive copies of rows that are
+(still or again) hot, so an interrupted batch is simply redone. Both
+transactions run under lock, which backup.snapshot() also holds while it
+copies the pair of files, so a backup never sees a batch half moved.
+
+    python archive.py [db-path]                          # print status
+    python archive.py [db-path] --apply [--days N]       # archive what is older than N days
+    python archive.py [db-path] --restore CLIENT_ID
+"""
+import datetime
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+import db
+import migrations
+
+ALIAS = "archive"
+HORIZON_DAYS = int(os.environ.get("ARCHIVE_HORIZON_DAYS", "730"))
+CLIENT_BATCH = 200        # closed clients per batch, moved with all their rows
+ROW_BATCH = 2000          # old hearings/payments per batch
+IN_CHUNK = 500            # ids per IN (...) list
+
+lock = threading.RLock()  # held across both transactions of a move or restore
+
+CLIENT_COLS = "id, name, case_details, contact, agreed_fee, payment_status, commitment_date, first_visit_date"
+BALANCE_COLS = "total_paid, pending, last_payment_date, payment_count"
+TABLES = {                # table -> (columns, date column)
+    "hearings": (db.HISTORY_COLUMNS["hearings"], "hearing_date"),
+    "payments": (db.HISTORY_COLUMNS["payments"], "pay_date"),
+}
+
+# Same columns (and day-number dates) as the hot tables; clients keep the
+# ledger balance they had when they were moved.
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS clients (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        case_details TEXT,
+        contact TEXT,
+        agreed_fee REAL,
+        payment_status TEXT,
+        commitment_date DATE,
+        first_visit_date DATE,
+        total_paid REAL NOT NULL DEFAULT 0,
+        pending REAL NOT NULL DEFAULT 0,
+        last_payment_date DATE,
+        payment_count INTEGER NOT NULL DEFAULT 0,
+        archived_on DATE NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS hearings (
+        id INTEGER PRIMARY KEY,
+        client_id INTEGER NOT NULL,
+        hearing_date DATE NOT NULL,
+        note TEXT,
+        archived_on DATE NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER PRIMARY KEY,
+        client_id INTEGER NOT NULL,
+        pay_date DATE NOT NULL,
+        amount REAL NOT NULL,
+        mode TEXT,
+        note TEXT,
+        archived_on DATE NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_clients_name ON clients(name COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS ix_hearings_client_date ON hearings(client_id, hearing_date)",
+    "CREATE INDEX IF NOT EXISTS ix_hearings_date_id ON hearings(hearing_date)",
+    "CREATE INDEX IF NOT EXISTS ix_payments_client_date ON payments(client_id, pay_date, amount)",
+    "CREATE INDEX IF NOT EXISTS ix_payments_date_id ON payments(pay_date)",
+]
+
+# fully paid and nothing on or after the cutoff
+CLOSED_SQL = """
+    SELECT c.id FROM main.clients c JOIN main.client_balances b ON b.client_id = c.id
+    WHERE b.pending <= 0 AND c.id > :after
+      AND COALESCE(c.first_visit_date, :cutoff - 1) < :cutoff
+      AND COALESCE(c.commitment_date, :cutoff - 1) < :cutoff
+      AND NOT EXISTS (SELECT 1 FROM main.hearings h WHERE h.client_id = c.id AND h.hearing_date >= :cutoff)
+      AND NOT EXISTS (SELECT 1 FROM main.payments p WHERE p.client_id = c.id AND p.pay_date >= :cutoff)
+    ORDER BY c.id
+"""
+# the archive copy a still matches main.clients row by row
+UNCHANGED_SQL = " AND ".join(f"a.{col} IS clients.{col}" for col in CLIENT_COLS.split(", "))
+
+
+def archive_path(path=None):
+    return db.sibling_path("_archive.db", path)
+
+def exists(path=None):
+    return os.path.exists(archive_path(path))
+
+def attachments(path=None):
+    """{alias: file} for ConnectionManager.snapshot(); empty without an archive."""
+    return {ALIAS: archive_path(path)} if exists(path) else {}
+
+def union(table, cols):
+    """FROM-clause subquery over the hot and the archived rows of table."""
+    return f"(SELECT {cols} FROM main.{table} UNION ALL SELECT {cols} FROM {ALIAS}.{table})"
+
+def reader(path=None):
+    """The pooled read connection with the archive attached; None without an archive."""
+    target = archive_path(path)
+    if not os.path.exists(target):
+        return None
+    return db.attach_to(db.manager(path).reader(), ALIAS, target)
+
+def cutoff(horizon_days=None, today=None):
+    """First day number that stays hot."""
+    horizon_days = HORIZON_DAYS if horizon_days is None else int(horizon_days)
+    return db.to_days(today or datetime.date.today()) - horizon_days
+
+def _create(target):
+    # build the schema in a side file and link it into place, so a reader
+    # never attaches an archive without tables
+    if os.path.exists(target):
+        return
+    tmp = f"{target}.{os.getpid()}.tmp"
+    con = sqlite3.connect(tmp, isolation_level=None)
+    try:
+        con.execute("PRAGMA journal_mode=WAL")
+        for sql in SCHEMA:
+            con.execute(sql)
+    finally:
+        con.close()
+    try:
+        os.link(tmp, target)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp)
+
+@contextmanager
+def _writable(path):
+    # the writer with the archive attached; migration 8 holds the payment carry
+    path = path or db.DB
+    migrations.ensure_current(path)
+    target = archive_path(path)
+    _create(target)
+    mgr = db.manager(path)
+    with mgr.attached(ALIAS, target):
+        yield mgr
+
+def _chunks(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), IN_CHUNK):
+        yield ids[i:i + IN_CHUNK]
+
+def rebalance(con, client_ids):
+    # the payment triggers took moved amounts off the ledger; recompute
+    # those clients with the archived carry included
+    for chunk in _chunks(client_ids):
+        marks = ",".join("?" * len(chunk))
+        con.execute(f"DELETE FROM main.client_balances WHERE client_id IN ({marks})", chunk)
+        con.execute(f"INSERT INTO main.client_balances {migrations.LEDGER_SQL} WHERE c.id IN ({marks}) GROUP BY c.id",
+                    chunk)
+
+def _copied(table):
+    return f"EXISTS (SELECT 1 FROM {ALIAS}.{table} a WHERE a.id = {table}.id)"
+
+
+# ---------------- Moving rows ----------------
+def reconcile(con):
+    """Drop archive copies of rows that are hot, and archived rows whose client is gone."""
+    n = 0
+    for table in ("clients", *TABLES):
+        n += con.execute(f"DELETE FROM {ALIAS}.{table} WHERE id IN (SELECT id FROM main.{table})").rowcount
+    for table in TABLES:
+        n += con.execute(f"""DELETE FROM {ALIAS}.{table}
+                             WHERE client_id NOT IN (SELECT id FROM main.clients)
+                               AND client_id NOT IN (SELECT id FROM {ALIAS}.clients)""").rowcount
+    return n
+
+def _move(mgr, stamp, rows, clients=()):
+    """Copy one batch to the archive, then delete what was copied from the hot file.
+
+    rows maps table -> (where, params) over main.<table>; clients are ids
+    of closed clients whose rows are all in rows. Returns rows moved.
+    """
+    with lock:
+        marks = ",".join("?" * len(clients))
+        with mgr.writer() as con:
+            if clients:
+                con.execute(f"""INSERT OR REPLACE INTO {ALIAS}.clients ({CLIENT_COLS}, {BALANCE_COLS}, archived_on)
+                                SELECT {', '.join('c.' + col for col in CLIENT_COLS.split(', '))},
+                                       COALESCE(b.total_paid, 0), COALESCE(b.pending, 0),
+                                       b.last_payment_date, COALESCE(b.payment_count, 0), ?
+                                FROM main.clients c LEFT JOIN main.client_balances b ON b.client_id = c.id
+                                WHERE c.id IN ({marks})""", (stamp, *clients))
+            for table, (where, params) in rows.items():
+                cols = TABLES[table][0]
+                con.execute(f"""INSERT OR REPLACE INTO {ALIAS}.{table} ({cols}, archived_on)
+                                SELECT {cols}, ? FROM main.{table} WHERE {where}""", (stamp, *params))
+        moved = {"clients": 0, "hearings": 0, "payments": 0}
+        touched = set(clients)
+        with mgr.writer() as con:
+            if "payments" in rows:
+                where, params = rows["payments"]
+                where = f"({where}) AND {_copied('payments')}"
+                touched.update(r[0] for r in con.execute(
+                    f"SELECT DISTINCT client_id FROM main.payments WHERE {where}", params))
+                con.execute(f"""INSERT INTO main.archived_payment_totals (client_id, total_paid, payment_count, last_payment_date)
+                                SELECT client_id, SUM(amount), COUNT(*), MAX(pay_date) FROM main.payments
+                                WHERE {where} GROUP BY client_id
+                                ON CONFLICT (client_id) DO UPDATE SET
+                                    total_paid = total_paid + excluded.total_paid,
+                                    payment_count = payment_count + excluded.payment_count,
+                                    last_payment_date = MAX(COALESCE(last_payment_date, excluded.last_payment_date),
+                                                            excluded.last_payment_date)""", params)
+                moved["payments"] = con.execute(f"DELETE FROM main.payments WHERE {where}", params).rowcount
+            if "hearings" in rows:
+                where, params = rows["hearings"]
+                moved["hearings"] = con.execute(f"DELETE FROM main.hearings WHERE ({where}) AND {_copied('hearings')}",
+                                                params).rowcount
+            rebalance(con, touched)
+            if clients:
+                # a client edited or given new rows since the copy stays hot, and so does
+                # one who owes money again; reconcile() drops the stale copy
+                moved["clients"] = con.execute(
+                    f"""DELETE FROM main.clients WHERE id IN ({marks})
+                        AND EXISTS (SELECT 1 FROM {ALIAS}.clients a JOIN main.client_balances b ON b.client_id = a.id
+                                    WHERE a.id = clients.id AND {UNCHANGED_SQL}
+                                      AND b.pending <= 0 AND ABS(a.total_paid - b.total_paid) < 0.005
+                                      AND a.payment_count = b.payment_count)
+                        AND NOT EXISTS (SELECT 1 FROM main.hearings h WHERE h.client_id = clients.id)
+                        AND NOT EXISTS (SELECT 1 FROM main.payments p WHERE p.client_id = clients.id)""",
+                    clients).rowcount
+    return moved
+
+def preview(horizon_days=None, path=None, today=None):
+    """What run() would move now: {"clients": n, "hearings": n, "payments": n}.
+
+    A closed client's rows are all older than the cutoff, so the row counts
+    cover both kinds of move.
+    """
+    con = db.manager(path).reader()
+    params = {"cutoff": cutoff(horizon_days, today), "after": 0}
+    out = {"clients": con.execute(f"SELECT COUNT(*) FROM ({CLOSED_SQL})", params).fetchone()[0]}
+    for table, (_, date_col) in TABLES.items():
+        out[table] = con.execute(f"SELECT COUNT(*) FROM main.{table} WHERE {date_col} < :cutoff",
+                                 params).fetchone()[0]
+    return out
+
+def run(horizon_days=None, path=None, today=None, progress=None):
+    """Move closed clients and old hearings/payments to the archive.
+
+    Returns the rows moved per table. progress(done, total) is called after
+    every batch and may raise to stop between batches.
+    """
+    plan = preview(horizon_days, path, today)
+    total = plan["clients"] + plan["hearings"] + plan["payments"]
+    limit = cutoff(horizon_days, today)
+    stamp = db.to_days(today or datetime.date.today())
+    moved = dict.fromkeys(plan, 0)
+
+    def report(batch):
+        for k, v in batch.items():
+            moved[k] += v
+        if progress is not None:
+            progress(min(sum(moved.values()), total), total)
+
+    with _writable(path) as mgr:
+        with mgr.writer() as con:
+            reconcile(con)
+        rd = mgr.reader()
+        after = 0
+        while True:
+            ids = [r[0] for r in rd.execute(CLOSED_SQL + " LIMIT :n",
+                                            {"cutoff": limit, "after": after, "n": CLIENT_BATCH})]
+            if not ids:
+                break
+            after = ids[-1]
+            marks = ",".join("?" * len(ids))
+            report(_move(mgr, stamp, {t: (f"client_id IN ({marks})", ids) for t in TABLES}, ids))
+        for table, (_, date_col) in TABLES.items():
+            after = 0
+            while True:
+                ids = [r[0] for r in rd.execute(f"""SELECT id FROM main.{table} WHERE {date_col} < ? AND id > ?
+                                                    ORDER BY id LIMIT ?""", (limit, after, ROW_BATCH))]
+                if not ids:
+                    break
+                where = (f"{date_col} < ? AND id > ? AND id <= ?", [limit, after, ids[-1]])
+                after = ids[-1]
+                report(_move(mgr, stamp, {table: where}))
+    return moved
+
+def restore(client_id, path=None):
+    """Move a client and all of its archived hearings and payments back to the hot file.
+
+    Works for archived clients and for active clients with archived
+    history; returns the rows restored per table. A client that is still
+    closed goes back on the next run() unless it gets new activity.
+    """
+    cid = int(client_id)
+    restored = {}
+    with _writable(path) as mgr, lock:
+        with mgr.writer() as con:
+            restored["clients"] = con.execute(
+                f"""INSERT INTO main.clients ({CLIENT_COLS}) SELECT {CLIENT_COLS} FROM {ALIAS}.clients
+                    WHERE id = ? AND id NOT IN (SELECT id FROM main.clients)""", (cid,)).rowcount
+            if con.execute("SELECT 1 FROM main.clients WHERE id = ?", (cid,)).fetchone() is None:
+                raise KeyError(f"client {cid} is neither live nor archived")
+            for table, (cols, _) in TABLES.items():
+                restored[table] = con.execute(
+                    f"""INSERT INTO main.{table} ({cols}) SELECT {cols} FROM {ALIAS}.{table} a
+                        WHERE client_id = ? AND NOT EXISTS (SELECT 1 FROM main.{table} h WHERE h.id = a.id)""",
+                    (cid,)).rowcount
+            con.execute("DELETE FROM main.archived_payment_totals WHERE client_id = ?", (cid,))
+            rebalance(con, [cid])
+        with mgr.writer() as con:
+            con.execute(f"DELETE FROM {ALIAS}.clients WHERE id = ?", (cid,))
+            for table in TABLES:
+                con.execute(f"""DELETE FROM {ALIAS}.{table} WHERE client_id = ?
+                                AND id IN (SELECT id FROM main.{table} WHERE client_id = ?)""", (cid, cid))
+    return restored
+
+
+# ---------------- Reads ----------------
+def stats(path=None):
+    out = {"path": archive_path(path), "exists": exists(path), "bytes": 0,
+           "clients": 0, "hearings": 0, "payments": 0}
+    con = reader(path)
+    if con is not None:
+        out["bytes"] = os.path.getsize(out["path"])
+        for table in ("clients", *TABLES):
+            out[table] = con.execute(f"SELECT COUNT(*) FROM {ALIAS}.{table}").fetchone()[0]
+    return out
+
+def archived_clients(text="", limit=50, path=None):
+    """Archived clients whose name contains text, by name."""
+    cols = ["id", "name", "case_details", "contact", "total_paid", "archived_on"]
+    con = reader(path)
+    if con is None:
+        return pd.DataFrame(columns=cols)
+    return pd.read_sql_query(f"""SELECT {', '.join(cols)} FROM {ALIAS}.clients
+                                 WHERE name LIKE ? ORDER BY name COLLATE NOCASE, id LIMIT ?""",
+                             con, params=(f"%{text.strip()}%", int(limit)), parse_dates={"archived_on": {"unit": "D"}})
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    opts = {}
+    for flag in ("--days", "--restore"):
+        if flag in args:
+            i = args.index(flag)
+            opts[flag] = int(args[i + 1])
+            del args[i:i + 2]
+    args = [a for a in args if not a.startswith("--")]
+    path = args[0] if args else db.DB
+    db.DB = path
+    db.init_db()
+    if "--restore" in opts:
+        print("restored:", restore(opts["--restore"], path))
+    elif "--apply" in sys.argv:
+        print("moved:", run(opts.get("--days"), path))
+    else:
+        print(f"would move (horizon {opts.get('--days', HORIZON_DAYS)} days):", preview(opts.get("--days"), path))
+    st = stats(path)
+    print(f"{st['path']}: {st['clients']} clients, {st['hearings']} hearings, {st['payments']} payments "
+          f"({st['bytes'] / 2**20:.1f} MiB)")
@@ -0,0 +1,420 @@
+"""Online backups: rotated, verified, compressed snapshots of the client database.
+
+snapshot() copies the live database with SQLite's online backup API,
+PAGES_PER_STEP pages at a time with STEP_SLEEP seconds between steps.
+Each step is a short read transaction, so under WAL the UI writer never
+waits on a backup. A write from another connection makes SQLite restart
+the copy; after MAX_RESTARTS restarts the rest is copied in one step
+(still only a read transaction). The copy is switched to rollback
+journaling, checked with PRAGMA integrity_check and gzipped into
+<db>_backups/ next to a small JSON manifest; a copy that fails the check
+is not kept. The archive file (archive.py) is backed up alongside under
+the same timestamp, with archive moves held off until both are copied.
+
+prune() keeps the newest KEEP_LAST snapshots plus the newest one of each
+of the last KEEP_DAILY days and KEEP_WEEKLY ISO weeks. scheduler() runs
+snapshot() and prune() every BACKUP_INTERVAL_MIN minutes on a daemon
+thread, the first time one interval after it starts at the earliest, so a
+process start (or a test run) never triggers a snapshot by itself.
+
+Snapshots are only ever opened read-only: opened() and inspect() look
+inside one, extract() writes it out as a standalone database file, and
+recover_client() copies a client deleted since the snapshot (with its
+hearings and payments) back into the live database.
+
+    python backup.py [--db PATH] now | list | prune
+    python backup.py [--db PATH] inspect SNAPSHOT
+    python backup.py [--db PATH] extract SNAPSHOT OUT.db
+    python backup.py [--db PATH] recover SNAPSHOT CLIENT_ID
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+import db
+
+PAGES_PER_STEP = int(os.environ.get("BACKUP_PAGES_PER_STEP", "256"))
+STEP_SLEEP = 0.005        # seconds between steps
+MAX_RESTARTS = 3
+INTERVAL_MIN = int(os.environ.get("BACKUP_INTERVAL_MIN", "60"))    # 0 disables the schedule
+KEEP_LAST = int(os.environ.get("BACKUP_KEEP_LAST", "8"))
+KEEP_DAILY = int(os.environ.get("BACKUP_KEEP_DAILY", "14"))
+KEEP_WEEKLY = int(os.environ.get("BACKUP_KEEP_WEEKLY", "8"))
+
+STAMP = "%Y%m%d-%H%M%S"
+NAME_RE = re.compile(r"^(?P<base>.+)\.(?P<stamp>\d{8}-\d{6})\.db\.gz$")
+COUNTED = ("clients", "hearings", "payments")
+HISTORY = {"hearings": db.HISTORY_COLUMNS["hearings"], "payments": db.HISTORY_COLUMNS["payments"]}
+
+_lock = threading.Lock()      # one snapshot at a time per process
+
+
+def backup_dir(path=None):
+    d = db.sibling_path("_backups", path)
+    os.makedirs(d, exist_ok=True)
+    return d
+
+def _sources(path):
+    import archive
+    files = [path]
+    if archive.exists(path):
+        files.append(archive.archive_path(path))
+    return files
+
+def _base(path):
+    return os.path.splitext(os.path.basename(os.path.abspath(path or db.DB)))[0]
+
+def _snapshot_path(name, path):
+    if os.path.dirname(name):
+        return name
+    return os.path.join(backup_dir(path), name)
+
+
+# ---------------- Taking snapshots ----------------
+class _Restarted(Exception):
+    pass
+
+def _copy(src_path, dst_path, progress=None):
+    """Online backup of src_path into dst_path; returns the restarts seen."""
+    src = sqlite3.connect(src_path, isolation_level=None)
+    dst = sqlite3.connect(dst_path, isolation_level=None)
+    state = {"left": None, "restarts": 0}
+
+    def step(status, remaining, total):
+        if state["left"] is not None and remaining > state["left"]:
+            state["restarts"] += 1
+            if state["restarts"] > MAX_RESTARTS:
+                raise _Restarted()
+        state["left"] = remaining
+        if progress:
+            progress(total - remaining, total)
+
+    try:
+        src.execute("PRAGMA query_only=ON")
+        src.execute(f"PRAGMA busy_timeout={db.PRAGMAS['busy_timeout']}")
+        try:
+            src.backup(dst, pages=PAGES_PER_STEP, progress=step, sleep=STEP_SLEEP)
+        except _Restarted:
+            src.backup(dst, pages=-1)
+        # snapshots are opened read-only later: no -wal/-shm files
+        dst.execute("PRAGMA journal_mode=DELETE")
+        return state["restarts"]
+    finally:
+        dst.close()
+        src.close()
+
+def _examine(con):
+    checked = [r[0] for r in con.execute("PRAGMA integrity_check")]
+    tables = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    return {
+        "integrity": "ok" if checked == ["ok"] else "; ".join(checked[:5]),
+        "user_version": con.execute("PRAGMA user_version").fetchone()[0],
+        "counts": {t: con.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in COUNTED if t in tables},
+    }
+
+def _gzip(src, target):
+    part = target + ".part"
+    try:
+        with open(src, "rb") as f, gzip.open(part, "wb", compresslevel=6) as gz:
+            shutil.copyfileobj(f, gz, 1 << 20)
+        os.replace(part, target)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+
+def snapshot(path=None, progress=None, now=None):
+    """Back up the database and its archive file; returns one manifest per file.
+
+    progress(done, total) counts pages over all files. Raises RuntimeError
+    when a copy fails its integrity check; nothing of that copy is kept.
+    """
+    import archive
+
+    path = os.path.abspath(path or db.DB)
+    directory = backup_dir(path)
+    # archive.lock keeps a move or restore from landing between the two copies
+    with _lock, archive.lock:
+        stamp = (now or datetime.datetime.now()).strftime(STAMP)
+        sources = _sources(path)
+        made = []
+        for i, src in enumerate(sources):
+            name = f"{_base(src)}.{stamp}.db.gz"
+            target = os.path.join(directory, name)
+            fd, tmp = tempfile.mkstemp(suffix=".db", dir=directory)
+            os.close(fd)
+            t0 = time.perf_counter()
+            try:
+                report = None
+                if progress:
+                    report = lambda done, total, i=i: progress(i * total + done, len(sources) * total)
+                restarts = _copy(src, tmp, report)
+                con = sqlite3.connect(f"file:{tmp}?mode=ro", uri=True)
+                try:
+                    found = _examine(con)
+                finally:
+                    con.close()
+                if found["integrity"] != "ok":
+                    raise RuntimeError(f"{name}: integrity check failed: {found['integrity']}")
+                size = os.path.getsize(tmp)
+                _gzip(tmp, target)
+            finally:
+                os.remove(tmp)
+            manifest = {"name": name, "source": src, "created": stamp, "db_bytes": size,
+                        "bytes": os.path.getsize(target), "restarts": restarts,
+                        "seconds": round(time.perf_counter() - t0, 2), **found}
+            with open(target[:-len(".db.gz")] + ".json", "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=1)
+            made.append(manifest)
+    return made
+
+
+# ---------------- Rotation ----------------
+def list_snapshots(path=None):
+    """Manifests of the stored snapshots, newest first."""
+    directory = backup_dir(path)
+    out = []
+    for fname in os.listdir(directory):
+        m = NAME_RE.match(fname)
+        if not m:
+            continue
+        full = os.path.join(directory, fname)
+        info = {"name": fname, "created": m["stamp"], "bytes": os.path.getsize(full)}
+        try:
+            with open(full[:-len(".db.gz")] + ".json", encoding="utf-8") as f:
+                info = {**json.load(f), **info}
+        except (OSError, ValueError):
+            info["integrity"] = None      # manifest lost; inspect() re-checks
+        info["base"] = m["base"]
+        info["taken"] = datetime.datetime.strptime(m["stamp"], STAMP)
+        out.append(info)
+    out.sort(key=lambda s: s["name"])
+    out.sort(key=lambda s: s["created"], reverse=True)   # the database before its archive
+    return out
+
+def _kept(stamps, now, keep_last, keep_daily, keep_weekly):
+    # stamps newest first
+    keep, days, weeks = set(stamps[:keep_last]), {}, {}
+    today = now.date()
+    for stamp in stamps:
+        day = datetime.datetime.strptime(stamp, STAMP).date()
+        if (today - day).days < keep_daily:
+            days.setdefault(day, stamp)
+        if (today - day).days < 7 * keep_weekly:
+            weeks.setdefault(day.isocalendar()[:2], stamp)
+    return keep | set(days.values()) | set(weeks.values())
+
+def prune(path=None, keep_last=KEEP_LAST, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY, now=None):
+    """Delete snapshots outside the retention policy; returns the names removed."""
+    snaps = list_snapshots(path)
+    stamps = sorted({s["created"] for s in snaps}, reverse=True)
+    keep = _kept(stamps, now or datetime.datetime.now(), keep_last, keep_daily, keep_weekly)
+    removed = []
+    for s in snaps:
+        if s["created"] not in keep:
+            full = _snapshot_path(s["name"], path)
+            for f in (full, full[:-len(".db.gz")] + ".json"):
+                if os.path.exists(f):
+                    os.remove(f)
+            removed.append(s["name"])
+    return removed
+
+
+# ---------------- Schedule ----------------
+class Scheduler:
+    """Daemon thread taking a snapshot every interval_min minutes, then pruning."""
+
+    def __init__(self, path, interval_min=INTERVAL_MIN):
+        self.path = os.path.abspath(path)
+        self.interval = datetime.timedelta(minutes=interval_min)
+        self.last = None          # manifests of the last run, or {"error": ...}
+        self.last_run = None
+        self.started = datetime.datetime.now()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="backup-scheduler", daemon=True)
+        self._thread.start()
+
+    def next_due(self):
+        if self.last_run is not None:
+            return self.last_run + self.interval
+        own = [s["taken"] for s in list_snapshots(self.path) if s["base"] == _base(self.path)]
+        return max([*own, self.started]) + self.interval
+
+    def _loop(self):
+        while not self._stop.wait(max(0.0, (self.next_due() - datetime.datetime.now()).total_seconds())):
+            self.last_run = datetime.datetime.now()
+            try:
+                self.last = snapshot(self.path)
+                prune(self.path)
+            except Exception as e:
+                self.last = {"error": f"{type(e).__name__}: {e}"}
+
+    def stop(self):
+        self._stop.set()
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def scheduler(path=None, interval_min=None):
+    """The process-wide backup scheduler for this database; None when disabled."""
+    interval_min = INTERVAL_MIN if interval_min is None else int(interval_min)
+    if interval_min <= 0:
+        return None
+    key = os.path.abspath(path or db.DB)
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = Scheduler(key, interval_min)
+        return _schedulers[key]
+
+
+# ---------------- Reading snapshots ----------------
+@contextmanager
+def _extracted(name, path=None):
+    # a private uncompressed copy, removed afterwards
+    source = _snapshot_path(name, path)
+    fd, tmp = tempfile.mkstemp(suffix=".db", dir=backup_dir(path))
+    try:
+        with os.fdopen(fd, "wb") as f, gzip.open(source, "rb") as gz:
+            shutil.copyfileobj(gz, f, 1 << 20)
+        yield tmp
+    finally:
+        os.remove(tmp)
+
+@contextmanager
+def opened(name, path=None):
+    """A read-only connection to a snapshot (by file name or path)."""
+    with _extracted(name, path) as tmp:
+        con = sqlite3.connect(f"file:{tmp}?mode=ro", uri=True)
+        try:
+            yield con
+        finally:
+            con.close()
+
+def _live_ids(path):
+    import archive
+    ids = {r[0] for r in db.manager(path).reader().execute("SELECT id FROM main.clients")}
+    con = archive.reader(path)
+    if con is not None:
+        ids |= {r[0] for r in con.execute(f"SELECT id FROM {archive.ALIAS}.clients")}
+    return ids
+
+def inspect(name, path=None, limit=200):
+    """Integrity, schema version and counts of a snapshot, plus the clients
+    it holds that are no longer in the database (live or archived)."""
+    with opened(name, path) as con:
+        out = {"name": os.path.basename(name), **_examine(con), "deleted_clients": pd.DataFrame()}
+        if "clients" in out["counts"] and _base(path) == NAME_RE.match(out["name"])["base"]:
+            clients = pd.read_sql_query("SELECT id, name, case_details, contact FROM clients "
+                                        "ORDER BY name COLLATE NOCASE, id", con)
+            gone = clients[~clients["id"].isin(_live_ids(path))]
+            out["deleted_clients"] = gone.head(limit).reset_index(drop=True)
+            out["deleted_count"] = len(gone)
+    return out
+
+def extract(name, out, path=None):
+    """Write a snapshot out as a standalone database file (never over an existing one)."""
+    if os.path.exists(out):
+        raise FileExistsError(out)
+    with gzip.open(_snapshot_path(name, path), "rb") as gz, open(out, "xb") as f:
+        shutil.copyfileobj(gz, f, 1 << 20)
+    return out
+
+def recover_client(name, client_id, path=None):
+    """Copy a client deleted since the snapshot back, with its hearings and payments.
+
+    The snapshot must have the live schema version. Rows whose ids are in
+    use (live or archived) are skipped; archived payments still on file
+    are carried into the ledger again. Returns rows copied per table.
+    """
+    import archive
+    cid = int(client_id)
+    path = os.path.abspath(path or db.DB)
+    if cid in _live_ids(path):
+        raise ValueError(f"client {cid} still exists")
+    mgr = db.manager(path)
+    archived = archive.exists(path)
+    got = {}
+    with _extracted(name, path) as tmp, mgr.attached("snap", tmp), \
+            (mgr.attached(archive.ALIAS, archive.archive_path(path)) if archived else nullcontext()), \
+            mgr.writer() as con:
+        have, want = (con.execute(f"PRAGMA {s}.user_version").fetchone()[0] for s in ("snap", "main"))
+        if have != want:
+            raise ValueError(f"snapshot has schema version {have}, the database {want}")
+        got["clients"] = con.execute(f"""INSERT INTO main.clients ({archive.CLIENT_COLS})
+                                         SELECT {archive.CLIENT_COLS} FROM snap.clients WHERE id = ?""",
+                                     (cid,)).rowcount
+        if not got["clients"]:
+            raise KeyError(f"client {cid} is not in {os.path.basename(name)}")
+        for table, cols in HISTORY.items():
+            skip = f"AND id NOT IN (SELECT id FROM {archive.ALIAS}.{table})" if archived else ""
+            got[table] = con.execute(f"""INSERT INTO main.{table} ({cols}) SELECT {cols} FROM snap.{table}
+                                         WHERE client_id = ? AND id NOT IN (SELECT id FROM main.{table}) {skip}""",
+                                     (cid,)).rowcount
+        if archived:
+            # archived payments of the client that are still on file count again
+            con.execute(f"""INSERT INTO main.archived_payment_totals
+                                (client_id, total_paid, payment_count, last_payment_date)
+                            SELECT client_id, SUM(amount), COUNT(*), MAX(pay_date)
+                            FROM {archive.ALIAS}.payments WHERE client_id = ? GROUP BY client_id""", (cid,))
+        archive.rebalance(con, [cid])
+    return got
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Online backups of the client database.")
+    ap.add_argument("--db", default=db.DB, help="database path (default: %(default)s)")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("now", help="take a snapshot, then prune")
+    sub.add_parser("list", help="stored snapshots, newest first")
+    sub.add_parser("prune", help="apply the retention policy")
+    p = sub.add_parser("inspect", help="open a snapshot read-only and check it")
+    p.add_argument("snapshot")
+    p = sub.add_parser("extract", help="write a snapshot out as a database file")
+    p.add_argument("snapshot")
+    p.add_argument("out")
+    p = sub.add_parser("recover", help="copy a deleted client back from a snapshot")
+    p.add_argument("snapshot")
+    p.add_argument("client_id", type=int)
+
+    a = ap.parse_args(argv)
+    db.DB = a.db
+    if a.command == "now":
+        for m in snapshot(a.db):
+            print(f"{m['name']}: {m['db_bytes'] / 2**20:.1f} MiB -> {m['bytes'] / 2**20:.1f} MiB "
+                  f"in {m['seconds']}s, integrity {m['integrity']}")
+        for name in prune(a.db):
+            print("pruned", name)
+    elif a.command == "list":
+        for s in list_snapshots(a.db):
+            counts = ", ".join(f"{v} {k}" for k, v in (s.get("counts") or {}).items())
+            print(f"{s['name']}  {s['bytes'] / 2**20:8.1f} MiB  {s.get('integrity') or '?':>3}  {counts}")
+    elif a.command == "prune":
+        for name in prune(a.db):
+            print("pruned", name)
+    elif a.command == "inspect":
+        got = inspect(a.snapshot, a.db)
+        print(f"{got['name']}: integrity {got['integrity']}, schema v{got['user_version']}, {got['counts']}")
+        if got.get("deleted_count"):
+            print(f"{got['deleted_count']} client(s) no longer in the database:")
+            print(got["deleted_clients"].to_string(index=False))
+    elif a.command == "extract":
+        print(extract(a.snapshot, a.out, a.db))
+    else:
+        db.init_db()
+        print("recovered:", recover_client(a.snapshot, a.client_id, a.db))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""Headless benchmarks on a reproducible synthetic client database.
+
+Generates bench_data/bench_<clients>_<min>-<max>_s<seed>.db once (same
+seed -> same rows), then times the data layer, the hearing banner, the PDF
+export and optionally full UI reruns (streamlit AppTest, no browser).
+Each case reports latency percentiles, Python peak memory (tracemalloc,
+measured on a separate run so it does not skew the timings) and output
+size, and the whole run is written as JSON for comparing versions.
+
+    python benchmark.py --clients 10000 [--events 10 50] [--seed 42] [--repeat 5]
+                        [--only df_clients,build_pdf] [--rerun] [--out result.json]
+    python benchmark.py --compare old.json new.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import db
+import migrations
+
+BENCH_DIR = "bench_data"
+ANCHOR = datetime.date(2025, 1, 6)   # synthetic "today"; keeps data and banner reproducible
+GEN_BATCH = 2000                     # clients per generation transaction
+SAMPLE_IDS = 200                     # per-client lookups timed individually
+
+FIRST = ["Aarav", "Vivaan", "Aditya", "Vihaan", "Arjun", "Sai", "Reyansh", "Krishna", "Ishaan", "Shaurya",
+         "Ananya", "Diya", "Saanvi", "Aadhya", "Pari", "Anika", "Navya", "Myra", "Sara", "Kiara",
+         "Rohan", "Rahul", "Amit", "Sunil", "Sanjay", "Priya", "Neha", "Pooja", "Kavita", "Meena"]
+LAST = ["Sharma", "Patil", "Deshmukh", "Kulkarni", "Joshi", "Pawar", "Jadhav", "Shinde", "More", "Gaikwad",
+        "Chavan", "Kale", "Sawant", "Bhosale", "Mehta", "Shah", "Iyer", "Nair", "Reddy", "Khan"]
+CASES = ["Property dispute", "Bail application", "Divorce petition", "Cheque bounce (NI Act 138)",
+         "Motor accident claim", "Consumer complaint", "Land acquisition", "Succession certificate",
+         "Rent control", "Labour dispute"]
+COURTS = ["High Court", "District Court", "Family Court", "Sessions Court", "JMFC Court", "Consumer Forum"]
+STAGES = ["filing", "evidence", "arguments", "cross-examination", "order", "adjourned", "mediation"]
+MODES = ["Cash", "UPI", "Bank", "Cheque", "Other"]
+
+
+# ---------------- Data generation ----------------
+def bench_path(clients, events, seed):
+    return os.path.join(BENCH_DIR, f"bench_{clients}_{events[0]}-{events[1]}_s{seed}.db")
+
+def _day(rng, lo, hi):
+    return db.to_days(ANCHOR) + rng.randint(lo, hi)
+
+def _batch(rng, first_id, n, events):
+    clients, hearings, payments = [], [], []
+    for cid in range(first_id, first_id + n):
+        fee = rng.choice([0, 5000, 10000, 25000, 50000, 100000, 250000])
+        clients.append((cid, f"{rng.choice(FIRST)} {rng.choice('ABCDEFGHIJKLMNOPRSTUVW')}. {rng.choice(LAST)}",
+                        f"{rng.choice(CASES)} no. {rng.randint(1, 9999)}/{rng.randint(2015, 2024)}",
+                        f"9{rng.randint(100000000, 999999999)}", fee,
+                        "Paid" if rng.random() < 0.3 else "Unpaid",
+                        _day(rng, -30, 120) if rng.random() < 0.5 else None, _day(rng, -1500, -30)))
+        for _ in range(rng.randint(*events)):
+            hearings.append((cid, _day(rng, -730, 180), f"{rng.choice(COURTS)} - {rng.choice(STAGES)}"))
+        for _ in range(rng.randint(*events)):
+            payments.append((cid, _day(rng, -730, 0), round(fee / 20 + rng.randint(0, 40) * 100, 2),
+                             rng.choice(MODES), rng.choice(["", "", "", "advance", "part payment", "cheque cleared"])))
+    return clients, hearings, payments
+
+def generate(path, clients=1000, events=(10, 50), seed=42, progress=None):
+    """Create a synthetic database at path (replacing any existing file)."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    migrations.ensure_current(path)
+    mgr = db.manager(path)
+    rng = random.Random(seed)
+    t0 = time.perf_counter()
+    for first in range(1, clients + 1, GEN_BATCH):
+        cs, hs, ps = _batch(rng, first, min(GEN_BATCH, clients + 1 - first), events)
+        with mgr.writer() as con:
+            con.executemany("""INSERT INTO clients (id, name, case_details, contact, agreed_fee, payment_status,
+                                                    commitment_date, first_visit_date) VALUES (?,?,?,?,?,?,?,?)""", cs)
+            con.executemany("INSERT INTO hearings (client_id, hearing_date, note) VALUES (?,?,?)", hs)
+            con.executemany("INSERT INTO payments (client_id, pay_date, amount, mode, note) VALUES (?,?,?,?,?)", ps)
+        if progress:
+            progress(min(clients, first + GEN_BATCH - 1), clients)
+    with mgr.writer(bump=False) as con:
+        con.execute("ANALYZE")
+    return time.perf_counter() - t0
+
+def table_counts(path):
+    con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return {t: con.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("clients", "hearings", "payments")}
+    finally:
+        con.close()
+
+
+# ---------------- Measurement ----------------
+def _size(out):
+    if isinstance(out, pd.DataFrame):
+        return {"rows": len(out), "bytes": int(out.memory_usage(index=True, deep=True).sum())}
+    if isinstance(out, tuple):
+        parts = [_size(o) for o in out]
+        return {k: sum(p.get(k, 0) for p in parts) for k in ("rows", "bytes")}
+    if isinstance(out, str) and os.path.exists(out):
+        return {"bytes": os.path.getsize(out)}
+    return {}
+
+def measure(fn, repeat, memory=True, setup=None):
+    """Time fn(i) for i in range(repeat); fn's result describes the output size."""
+    samples, out = [], None
+    for i in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        out = fn(i)
+        samples.append(time.perf_counter() - t0)
+    result = {"n": repeat, **_percentiles(samples), **_size(out)}
+    if memory:
+        if setup:
+            setup()
+        tracemalloc.start()
+        try:
+            fn(0)
+            result["peak_mem_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+def _percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {"min_ms": round(float(ms.min()), 3), "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p90_ms": round(float(np.percentile(ms, 90)), 3), "p99_ms": round(float(np.percentile(ms, 99)), 3),
+            "max_ms": round(float(ms.max()), 3), "mean_ms": round(float(ms.mean()), 3)}
+
+def _cold_init(path):
+    def reset():
+        db.close_all()
+        migrations._current.discard(path)
+    return reset
+
+
+# ---------------- Cases ----------------
+def cases(path, repeat, tmpdir, pdf_workers=1):
+    """name -> (fn(i), repeat, setup) for every benchmark case."""
+    rng = random.Random(0)
+    n_clients = table_counts(path)["clients"]
+    ids = [rng.randint(1, max(1, n_clients)) for _ in range(SAMPLE_IDS)]
+    pdf_out = os.path.join(tmpdir, "export.pdf")
+    return {
+        "init_db": (lambda i: db.init_db(), repeat, _cold_init(path)),
+        "df_clients": (lambda i: db.df_clients.uncached(), repeat, None),
+        "df_clients[cached]": (lambda i: db.df_clients(), repeat, None),
+        "df_hearings": (lambda i: db.df_hearings.uncached(), repeat, None),
+        "df_payments": (lambda i: db.df_payments.uncached(), repeat, None),
+        "total_paid_for": (lambda i: db.total_paid_for.uncached(ids[i % len(ids)]), len(ids), None),
+        "alert_banner": (lambda i: (db.upcoming_counts.uncached(ANCHOR), db.upcoming_hearings.uncached(ANCHOR)),
+                         repeat, None),
+        "build_pdf": (lambda i: _pdf(pdf_out, path, pdf_workers), max(1, repeat // 5), None),
+    }
+
+def _pdf(out, path, workers):
+    import pdf_export
+    pdf_export.build_pdf(out, path, workers=workers)
+    return out
+
+def rerun_case(repeat):
+    """Full script reruns of amol.py through streamlit's headless AppTest."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "amol.py"),
+                           default_timeout=600)
+    at.session_state["logged_in"] = True
+    at.run()    # first run imports and warms the query cache
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    cold = lambda: db.manager().invalidate()
+    return {"ui_rerun[cold cache]": (lambda i: at.run(), repeat, cold),
+            "ui_rerun[warm cache]": (lambda i: at.run(), repeat, None)}
+
+
+def run(clients=1000, events=(10, 50), seed=42, repeat=5, only=None, rerun=False, memory=True,
+        pdf_workers=1, path=None, regenerate=False, log=print):
+    path = path or bench_path(clients, events, seed)
+    meta = {"clients": clients, "events": list(events), "seed": seed, "repeat": repeat, "db": path}
+    if regenerate or not os.path.exists(path):
+        log(f"generating {path} ...")
+        meta["generate_s"] = round(generate(path, clients, events, seed,
+                                            progress=lambda d, t: log(f"  {d:,}/{t:,} clients")), 2)
+    meta["rows"] = table_counts(path)
+    meta["db_bytes"] = os.path.getsize(path)
+    db.DB = path    # every helper (and amol.py under AppTest) now uses the synthetic DB
+    db.close_all()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        table = cases(path, repeat, tmpdir, pdf_workers)
+        if rerun:
+            table.update(rerun_case(repeat))
+        for name, (fn, n, setup) in table.items():
+            if only and name.split("[")[0] not in only:
+                continue
+            log(f"{name} x{n} ...")
+            results[name] = measure(fn, n, memory=memory, setup=setup)
+            log(f"  p50 {results[name]['p50_ms']} ms, p90 {results[name]['p90_ms']} ms")
+    return {"meta": {**meta, **environment()}, "results": results}
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"commit": commit, "when": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "pandas": pd.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count()}
+
+def compare(old, new):
+    """Per-case p50/p90 ratios (new / old); > 1 means slower."""
+    rows = []
+    for name, cur in new["results"].items():
+        prev = old["results"].get(name)
+        if prev:
+            rows.append({"case": name,
+                         "p50_old_ms": prev["p50_ms"], "p50_new_ms": cur["p50_ms"],
+                         "p50_ratio": round(cur["p50_ms"] / prev["p50_ms"], 2) if prev["p50_ms"] else None,
+                         "p90_ratio": round(cur["p90_ms"] / prev["p90_ms"], 2) if prev["p90_ms"] else None})
+    return rows
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark the client desk on synthetic data.")
+    ap.add_argument("--clients", type=int, default=1000)
+    ap.add_argument("--events", type=int, nargs=2, default=(10, 50), metavar=("MIN", "MAX"),
+                    help="hearings and payments per client")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--only", help="comma-separated case names")
+    ap.add_argument("--rerun", action="store_true", help="also time full amol.py reruns (needs streamlit)")
+    ap.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    ap.add_argument("--pdf-workers", type=int, default=1)
+    ap.add_argument("--db", help="benchmark this database instead of a generated one")
+    ap.add_argument("--regenerate", action="store_true")
+    ap.add_argument("--out", help="write JSON here (default: stdout)")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    a = ap.parse_args()
+    if a.compare:
+        with open(a.compare[0]) as f1, open(a.compare[1]) as f2:
+            print(json.dumps(compare(json.load(f1), json.load(f2)), indent=2))
+        sys.exit(0)
+    res = run(a.clients, tuple(a.events), a.seed, a.repeat, a.only and set(a.only.split(",")), a.rerun,
+              not a.no_memory, a.pdf_workers, a.db, a.regenerate, log=lambda m: print(m, file=sys.stderr))
+    text = json.dumps(res, indent=2)
+    if a.out:
+        with open(a.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
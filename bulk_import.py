@@ -0,0 +1,286 @@
+"""Bulk import of clients, hearings and payments from CSV or Excel.
+
+Files are parsed in chunks of CHUNK_ROWS rows. Dates and amounts are
+validated column-wise, client names resolve to ids through the shared
+db.client_index(), and valid rows are loaded with executemany in
+BATCH_ROWS-row writer transactions. Every rejected row is reported with
+its file line number; dry_run validates without writing.
+
+    python bulk_import.py clients|hearings|payments FILE [--dry-run] [--errors out.csv]
+"""
+import csv
+import os
+import sys
+import time
+
+import pandas as pd
+
+import db
+import migrations
+
+CHUNK_ROWS = 10000
+BATCH_ROWS = 50000
+
+# target columns per kind, and the header aliases accepted for them
+COLUMNS = {
+    "clients": ["name", "case_details", "contact", "agreed_fee", "payment_status",
+                "commitment_date", "first_visit_date"],
+    "hearings": ["client_id", "hearing_date", "note"],
+    "payments": ["client_id", "pay_date", "amount", "mode", "note"],
+}
+REQUIRED = {
+    "clients": ["name"],
+    "hearings": ["client", "hearing_date"],
+    "payments": ["client", "pay_date", "amount"],
+}
+ALIASES = {
+    "client": "client", "client name": "client", "client_name": "client", "name": "client",
+    "client id": "client_id", "client_id": "client_id",
+    "case": "case_details", "case details": "case_details",
+    "phone": "contact", "mobile": "contact",
+    "fee": "agreed_fee", "agreed fee": "agreed_fee",
+    "status": "payment_status", "payment status": "payment_status",
+    "commitment": "commitment_date", "commitment date": "commitment_date",
+    "first visit": "first_visit_date", "first visit date": "first_visit_date",
+    "date": "date", "hearing date": "hearing_date", "payment date": "pay_date",
+    "court": "note", "stage": "note", "notes": "note", "remarks": "note",
+}
+DATE_COLUMNS = {
+    "clients": ["commitment_date", "first_visit_date"],
+    "hearings": ["hearing_date"],
+    "payments": ["pay_date"],
+}
+EPOCH = pd.Timestamp("1970-01-01")
+PAY_MODES = {"cash": "Cash", "upi": "UPI", "bank": "Bank", "cheque": "Cheque", "check": "Cheque", "other": "Other"}
+
+
+class ImportReport:
+    def __init__(self, kind, dry_run):
+        self.kind = kind
+        self.dry_run = dry_run
+        self.rows = 0
+        self.loaded = 0
+        self.errors = []            # (line, column, value, message)
+        self.parse_s = 0.0
+        self.load_s = 0.0
+
+    @property
+    def rejected(self):
+        return len({e[0] for e in self.errors})
+
+    def as_dict(self):
+        total = self.parse_s + self.load_s
+        return {
+            "kind": self.kind, "dry_run": self.dry_run, "rows": self.rows,
+            "loaded": self.loaded, "rejected": self.rejected,
+            "parse_s": round(self.parse_s, 3), "load_s": round(self.load_s, 3),
+            "rows_per_s": round(self.rows / total) if total else None,
+        }
+
+    def write_errors(self, path):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["line", "column", "value", "error"])
+            w.writerows(self.errors)
+
+
+# ---------------- Reading ----------------
+def _norm(header):
+    h = str(header).strip().lower().replace("_", " ")
+    return ALIASES.get(h, h.replace(" ", "_"))
+
+def read_chunks(source, chunk_rows=CHUNK_ROWS, filename=None):
+    """Yield (first_line_number, DataFrame of str) chunks from a CSV/XLSX path or file."""
+    name = (filename or getattr(source, "name", None) or str(source)).lower()
+    if name.endswith((".xlsx", ".xlsm")):
+        yield from _excel_chunks(source, chunk_rows)
+        return
+    line = 2  # line 1 is the header
+    for chunk in pd.read_csv(source, dtype=str, keep_default_na=False, chunksize=chunk_rows,
+                             skipinitialspace=True, encoding_errors="replace"):
+        chunk.columns = [_norm(c) for c in chunk.columns]
+        yield line, chunk
+        line += len(chunk)
+
+def _excel_chunks(source, chunk_rows):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [_norm(h) for h in next(rows, [])]
+        buf, line = [], 2
+        for r in rows:
+            buf.append(["" if v is None else (v.date().isoformat() if hasattr(v, "date") else str(v)) for v in r])
+            if len(buf) == chunk_rows:
+                yield line, pd.DataFrame(buf, columns=header)
+                line += len(buf)
+                buf = []
+        if buf:
+            yield line, pd.DataFrame(buf, columns=header)
+    finally:
+        wb.close()
+
+
+# ---------------- Validation ----------------
+def _day_first(text):
+    ts = pd.to_datetime(text, dayfirst=True, errors="coerce")
+    return pd.NaT if pd.isna(ts) else ts.tz_localize(None) if ts.tzinfo else ts
+
+def parse_dates(col):
+    """ISO dates first, then day-first formats (dd-mm-yyyy, 05 Jan 2024...).
+
+    The date is kept as written: a time part or UTC offset never moves it
+    (as in migration 7), so tz-aware and mixed-offset files parse too.
+    """
+    col = col.str.strip()
+    iso = col.str.fullmatch(migrations.ISO_DATE_RE.pattern)
+    out = pd.to_datetime(col.str[:10].where(iso), format="%Y-%m-%d", errors="coerce")
+    basic = col.str.fullmatch(r"\d{8}")             # 20240301
+    out[basic] = pd.to_datetime(col[basic], format="%Y%m%d", errors="coerce")
+    iso |= basic
+    retry = out.isna() & ~iso & (col != "")
+    if retry.any():
+        try:
+            day_first = pd.to_datetime(col[retry], dayfirst=True, format="mixed", errors="coerce")
+        except ValueError:      # mixed UTC offsets
+            day_first = col[retry].map(_day_first)
+        if isinstance(day_first.dtype, pd.DatetimeTZDtype):
+            day_first = day_first.dt.tz_localize(None)
+        out[retry] = pd.to_datetime(day_first)
+    return out
+
+def parse_amounts(col):
+    return pd.to_numeric(col.str.replace(r"[₹,\s]|Rs\.?", "", regex=True), errors="coerce")
+
+def _key(names):
+    return names.str.strip().str.casefold()
+
+def _validate(kind, chunk, first_line, index, report):
+    if kind == "clients" and "name" not in chunk and "client" in chunk:
+        chunk = chunk.rename(columns={"client": "name"})
+    if kind != "clients" and "date" in chunk and DATE_COLUMNS[kind][0] not in chunk:
+        chunk = chunk.rename(columns={"date": DATE_COLUMNS[kind][0]})
+    bad = pd.Series(False, index=chunk.index)
+
+    def reject(mask, column, message):
+        nonlocal bad
+        for i in chunk.index[mask & ~bad]:
+            report.errors.append((first_line + i - chunk.index[0], column,
+                                  chunk.at[i, column] if column in chunk else "", message))
+        bad |= mask
+
+    for col in REQUIRED[kind]:
+        if col == "client" and "client_id" in chunk and "client" not in chunk:
+            continue
+        if col not in chunk:
+            reject(pd.Series(True, index=chunk.index), col, f"missing column '{col}'")
+            return None
+        reject(chunk[col].str.strip() == "", col, "required")
+
+    out = pd.DataFrame(index=chunk.index)
+    for col in COLUMNS[kind]:
+        if col in chunk:
+            out[col] = chunk[col].str.strip().replace("", None)
+        else:
+            out[col] = None
+
+    if kind != "clients":
+        if "client" in chunk:
+            keys = _key(chunk["client"])
+            reject(keys.isin(index.ambiguous), "client", "ambiguous client name (use client_id)")
+            ids = keys.map(index.unique)
+            reject(ids.isna(), "client", "unknown client")
+        else:
+            ids = pd.to_numeric(chunk["client_id"], errors="coerce")
+            reject(~ids.isin(list(index.rows)), "client_id", "unknown client id")
+        out["client_id"] = ids
+
+    for col in DATE_COLUMNS[kind]:
+        if col not in chunk:
+            continue
+        parsed = parse_dates(chunk[col])
+        reject(parsed.isna() & (chunk[col].str.strip() != ""), col, "invalid date")
+        out[col] = (parsed.dt.normalize() - EPOCH).dt.days.astype("Int64")   # db day numbers
+
+    money = {"clients": "agreed_fee", "payments": "amount"}.get(kind)
+    if money and money in chunk:
+        amounts = parse_amounts(chunk[money])
+        given = chunk[money].str.strip() != ""
+        reject(given & amounts.isna(), money, "not a number")
+        if kind == "payments":
+            reject(amounts <= 0, money, "amount must be greater than 0")
+        else:
+            reject(amounts < 0, money, "fee cannot be negative")
+            amounts = amounts.fillna(0)
+        out[money] = amounts
+
+    if kind == "payments" and "mode" in chunk:
+        modes = chunk["mode"].str.strip().str.lower()
+        mapped = modes.map(PAY_MODES)
+        reject(mapped.isna() & (modes != ""), "mode", f"mode must be one of {', '.join(sorted(set(PAY_MODES.values())))}")
+        out["mode"] = mapped.where(modes != "", None)
+    if kind == "clients":
+        status = chunk["payment_status"].str.strip().str.title() if "payment_status" in chunk else None
+        out["payment_status"] = "Unpaid" if status is None else status.where(status != "", "Unpaid")
+
+    good = out[~bad]
+    if kind != "clients":
+        good = good.astype({"client_id": "int64"})
+    return good
+
+
+# ---------------- Loading ----------------
+def _insert_sql(kind):
+    cols = COLUMNS[kind]
+    return f"INSERT INTO {kind} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+
+def import_file(kind, source, dry_run=False, filename=None, progress=None):
+    """Validate and load one file; returns an ImportReport."""
+    if kind not in COLUMNS:
+        raise ValueError(f"kind must be one of {', '.join(COLUMNS)}")
+    report = ImportReport(kind, dry_run)
+    index = db.client_index() if kind != "clients" else None
+    sql = _insert_sql(kind)
+    pending = []
+
+    def flush():
+        t0 = time.perf_counter()
+        if pending and not dry_run:
+            with db.writer() as con:
+                con.executemany(sql, pending)
+        report.loaded += len(pending)
+        pending.clear()
+        report.load_s += time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for first_line, chunk in read_chunks(source, filename=filename):
+        report.rows += len(chunk)
+        good = _validate(kind, chunk, first_line, index, report)
+        if good is not None:
+            pending.extend(good[COLUMNS[kind]].astype(object).where(good[COLUMNS[kind]].notna(), None)
+                           .itertuples(index=False, name=None))
+        report.parse_s += time.perf_counter() - t0
+        if len(pending) >= BATCH_ROWS:
+            flush()
+        if progress:
+            progress(report)
+        t0 = time.perf_counter()
+    flush()
+    return report
+
+
+if __name__ == "__main__":
+    import json
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if len(args) < 2:
+        sys.exit(__doc__)
+    kind, path = args[0], args[1]
+    db.init_db()
+    rep = import_file(kind, path, dry_run="--dry-run" in sys.argv, filename=os.path.basename(path))
+    print(json.dumps(rep.as_dict(), indent=2))
+    if "--errors" in sys.argv and rep.errors:
+        rep.write_errors(sys.argv[sys.argv.index("--errors") + 1])
+    for line, col, val, msg in rep.errors[:20]:
+        print(f"  line {line}: {col}={val!r}: {msg}")
@@ -0,0 +1,180 @@
+"""Headless batch exports for cron jobs: no Streamlit in the process.
+
+    python cli.py pdf [--out FILE] [--workers N] [--incremental] [--with-archive]
+    python cli.py csv [--out-dir DIR] [--tables clients,hearings,payments]
+    python cli.py cause-list [--date YYYY-MM-DD|today|tomorrow] [--format pdf|csv|txt] [--out FILE]
+    python cli.py report [--as-of YYYY-MM-DD] [--months N] [--format xlsx|csv] [--with-archive]
+
+Every command takes --db PATH (default: advocate_clients.db), migrates the
+database if needed and prints the files it wrote. Dated default file names
+(client_database_2025-01-06.pdf, hearings_2025-01-06.csv, ...) let nightly
+runs accumulate in one directory.
+"""
+import argparse
+import csv
+import datetime
+import os
+import sys
+import time
+
+import db
+
+_iso = db.sql_iso   # dates are stored as day numbers; CSV gets YYYY-MM-DD
+CSV_QUERIES = {
+    "clients": f"""SELECT c.id, c.name, c.case_details, c.contact, c.agreed_fee, c.payment_status,
+                          {_iso('c.commitment_date')} AS commitment_date, {_iso('c.first_visit_date')} AS first_visit_date,
+                          COALESCE(b.total_paid, 0) AS total_paid, COALESCE(b.pending, 0) AS pending,
+                          {_iso('b.last_payment_date')} AS last_payment_date,
+                          COALESCE(b.payment_count, 0) AS payment_count
+                   FROM clients c LEFT JOIN client_balances b ON b.client_id=c.id
+                   ORDER BY c.name COLLATE NOCASE, c.id""",
+    "hearings": f"""SELECT h.id, h.client_id, c.name, {_iso('h.hearing_date')} AS hearing_date, h.note
+                    FROM hearings h JOIN clients c ON c.id=h.client_id
+                    ORDER BY h.hearing_date, h.id""",
+    "payments": f"""SELECT p.id, p.client_id, c.name, {_iso('p.pay_date')} AS pay_date, p.amount, p.mode, p.note
+                    FROM payments p JOIN clients c ON c.id=p.client_id
+                    ORDER BY p.pay_date, p.id""",
+}
+
+
+def _day(text):
+    today = datetime.date.today()
+    if text in (None, "today"):
+        return today
+    if text == "tomorrow":
+        return today + datetime.timedelta(days=1)
+    return datetime.date.fromisoformat(text)
+
+def _target(out, out_dir, default):
+    return out or os.path.join(out_dir or ".", default)
+
+
+# ---------------- Commands ----------------
+def export_pdf(out=None, out_dir=None, workers=None, incremental=False, archived=False):
+    import pdf_export
+
+    target = _target(out, out_dir, f"client_database_{datetime.date.today()}.pdf")
+    cache = pdf_export.SectionCache(pdf_export.section_cache_dir(db.DB)) if incremental else None
+    try:
+        pdf_export.build_pdf(target, db.DB, workers=workers, cache=cache, archived=archived)
+    finally:
+        if cache is not None:
+            cache.close()
+    return [target]
+
+def export_csv(out_dir=None, tables=tuple(CSV_QUERIES)):
+    """Stream each table to CSV from one consistent read snapshot."""
+    written = []
+    stamp = datetime.date.today()
+    with db.manager().snapshot() as con:
+        for table in tables:
+            target = _target(None, out_dir, f"{table}_{stamp}.csv")
+            cur = con.execute(CSV_QUERIES[table])
+            with open(target, "w", newline="", encoding="utf-8") as f:
+                w = csv.writer(f)
+                w.writerow([d[0] for d in cur.description])
+                while True:
+                    rows = cur.fetchmany(5000)
+                    if not rows:
+                        break
+                    w.writerows(rows)
+            written.append(target)
+    return written
+
+def cause_list(day, fmt="pdf", out=None, out_dir=None):
+    rows = db.cause_list(day).to_dict("records")
+    target = _target(out, out_dir, f"cause_list_{day}.{fmt}")
+    if fmt == "pdf":
+        import pdf_export
+        pdf_export.build_cause_list(target, day, rows)
+    elif fmt == "csv":
+        with open(target, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["court", "client", "case_details", "contact", "client_id"])
+            w.writerows([r["note"] or "", r["name"], r["case_details"] or "", r["contact"] or "", r["client_id"]]
+                        for r in rows)
+    else:
+        lines, court = [f"Cause list for {day:%d-%b-%Y} ({len(rows)} matters)"], None
+        for r in rows:
+            if (r["note"] or "") != court:
+                court = r["note"] or ""
+                lines += ["", court or "(no court noted)"]
+            lines.append(f"  {r['name']} — {r['case_details'] or ''} {('· ' + r['contact']) if r['contact'] else ''}".rstrip())
+        with open(target, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    return [target]
+
+def report(as_of, months=None, fmt="xlsx", out=None, out_dir=None, archived=False):
+    import reports
+
+    got = reports.build(as_of, months or reports.MONTHS, archived=archived)
+    if fmt == "csv":
+        return reports.write_csv(got, out_dir)
+    target = _target(out, out_dir, f"report_{as_of}.xlsx")
+    reports.to_excel(got, target)
+    return [target]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Batch exports for the Advocate Client Desk.")
+    ap.add_argument("--db", default=db.DB, help="database path (default: %(default)s)")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("pdf", help="full client database PDF")
+    p.add_argument("--out")
+    p.add_argument("--out-dir")
+    p.add_argument("--workers", type=int, help="render processes (default: PDF_WORKERS or 1)")
+    p.add_argument("--incremental", action="store_true",
+                   help="reuse cached client sections (merges the whole document in memory)")
+    p.add_argument("--with-archive", action="store_true", help="include archived clients and history")
+
+    c = sub.add_parser("csv", help="clients/hearings/payments as CSV")
+    c.add_argument("--out-dir")
+    c.add_argument("--tables", default=",".join(CSV_QUERIES))
+
+    cl = sub.add_parser("cause-list", help="hearings listed on one day, by court")
+    cl.add_argument("--date", help="YYYY-MM-DD, today (default) or tomorrow")
+    cl.add_argument("--format", choices=["pdf", "csv", "txt"], default="pdf")
+    cl.add_argument("--out")
+    cl.add_argument("--out-dir")
+
+    r = sub.add_parser("report", help="dues aging, collections and hearing load")
+    r.add_argument("--as-of", help="YYYY-MM-DD or today (default)")
+    r.add_argument("--months", type=int, help="months of collections (default: REPORT_MONTHS or 12)")
+    r.add_argument("--format", choices=["xlsx", "csv"], default="xlsx")
+    r.add_argument("--out")
+    r.add_argument("--out-dir")
+    r.add_argument("--with-archive", action="store_true", help="include archived payments and hearings")
+
+    a = ap.parse_args(argv)
+    db.DB = a.db
+    db.init_db()
+    t0 = time.perf_counter()
+    if a.command == "pdf":
+        files = export_pdf(a.out, a.out_dir, a.workers, a.incremental, a.with_archive)
+    elif a.command == "csv":
+        tables = [t.strip() for t in a.tables.split(",") if t.strip()]
+        unknown = set(tables) - set(CSV_QUERIES)
+        if unknown:
+            ap.error(f"unknown table(s): {', '.join(sorted(unknown))}")
+        files = export_csv(a.out_dir, tables)
+    elif a.command == "report":
+        try:
+            day = _day(a.as_of)
+        except ValueError:
+            ap.error(f"bad --as-of {a.as_of!r}")
+        files = report(day, a.months, a.format, a.out, a.out_dir, a.with_archive)
+    else:
+        try:
+            day = _day(a.date)
+        except ValueError:
+            ap.error(f"bad --date {a.date!r}")
+        files = cause_list(day, a.format, a.out, a.out_dir)
+    for f in files:
+        print(f)
+    print(f"done in {time.perf_counter() - t0:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,960 @@
+"""Shared SQLite connection layer for the Advocate Client Desk.
+
+One ConnectionManager per database file is kept for the whole process, so
+every Streamlit session and rerun reuses the same connections instead of
+doing a connect/PRAGMA/close cycle per helper call.
+"""
+import bisect
+import datetime
+import functools
+import json
+import numbers
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pandas as pd
+
+DB = "advocate_clients.db"
+
+PAGE_SIZE = 50
+
+PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -20000,        # ~20 MB page cache per connection
+    "mmap_size": 268435456,      # 256 MB memory-mapped reads
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+    "foreign_keys": "ON",
+}
+
+BUSY_RETRIES = 8
+BUSY_BACKOFF = 0.05  # seconds, doubled per retry
+
+# callables run on every new connection (see diagnostics.enable)
+CONNECT_HOOKS = []
+
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_MAX_ENTRIES = 256
+
+
+def _is_busy(exc):
+    msg = str(exc).lower()
+    return "locked" in msg or "busy" in msg
+
+def sibling_path(suffix, path=None):
+    """A file or directory kept next to the database: advocate_clients<suffix>."""
+    return os.path.splitext(os.path.abspath(path or DB))[0] + suffix
+
+
+# ---------------- Dates ----------------
+# Dates are stored as INTEGER days since 1970-01-01 (migration 7): a few
+# bytes per value, ordered and range-filtered as plain integers, and turned
+# into datetime64 by pandas without any string parsing.
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+def to_days(value):
+    """date/datetime/Timestamp/ISO string -> day number; None/''/NaT -> None.
+
+    Raises ValueError for strings that are not ISO dates.
+    """
+    if value is None or isinstance(value, str) and not value.strip():
+        return None
+    if isinstance(value, numbers.Integral) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value.strip()[:10])
+    elif pd.isna(value):
+        return None
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return value.toordinal() - EPOCH_ORDINAL
+    raise TypeError(f"not a date: {value!r}")
+
+def from_days(days):
+    """Day number -> datetime.date (None stays None)."""
+    if days is None or isinstance(days, float) and days != days:
+        return None
+    return datetime.date.fromordinal(int(days) + EPOCH_ORDINAL)
+
+def as_date(value):
+    """Any stored or read-back date value (day number, Timestamp, NaT, ISO) -> date or None."""
+    days = to_days(value)
+    return None if days is None else from_days(days)
+
+def sql_iso(expr):
+    """SQL expression rendering a day-number column as 'YYYY-MM-DD'."""
+    return f"date({expr} + 2440587.5)"
+
+def _dates(*cols):
+    # read_sql_query(parse_dates=...) for day-number columns -> datetime64
+    return {c: {"unit": "D"} for c in cols}
+
+
+def _sizeof(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, tuple):
+        # (frame, cursor) pages and (frame, frame) reports
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    """LRU cache of query results keyed on (query, args, data generation).
+
+    Entries from older generations can never be hit again and are dropped
+    as soon as the generation moves on; the rest are evicted least recently
+    used first once max_bytes or max_entries is exceeded.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_entries=CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (value, size)
+        self._bytes = 0
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, generation):
+        with self._lock:
+            hit = self._entries.get((generation,) + key) if generation == self._generation else None
+            if hit is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((generation,) + key)
+            self.hits += 1
+            return hit[0]
+
+    def put(self, key, generation, value):
+        size = _sizeof(value)
+        with self._lock:
+            if generation != self._generation:
+                if self._generation is not None and generation < self._generation:
+                    return  # computed before a concurrent write; don't keep it
+                self._drop_all()
+                self._generation = generation
+            if size > self.max_bytes:
+                return
+            full = (generation,) + key
+            old = self._entries.pop(full, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[full] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._bytes -= dropped
+                self.evictions += 1
+
+    def _drop_all(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def clear(self):
+        with self._lock:
+            self._drop_all()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "generation": self._generation,
+            }
+
+
+class ConnectionManager:
+    """Per-thread read connections plus a single serialized writer.
+
+    WAL journaling lets readers run while the writer commits; all writes go
+    through writer(), which holds a process-wide lock and retries on
+    SQLITE_BUSY (another process holding the write lock).
+    """
+
+    def __init__(self, path=DB, retries=BUSY_RETRIES, backoff=BUSY_BACKOFF):
+        self.path = path
+        self.retries = retries
+        self.backoff = backoff
+        self._local = threading.local()
+        self._readers = {}              # thread ident -> (thread, connection)
+        self._readers_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._writer = None
+        self._depth = 0
+        self._bump = True
+        self._closed = False
+        self._attached = {}             # alias -> users of the writer's attachment
+        # bumped after every committed write transaction; readers cache on it
+        self.generation = 0
+        self._data_version = 0
+        self.cache = QueryCache()
+        with self._write_lock:
+            con = self._open()
+            con.execute("PRAGMA journal_mode=WAL")
+            self._writer = con
+
+    def _open(self):
+        con = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        for name, value in PRAGMAS.items():
+            con.execute(f"PRAGMA {name}={value}")
+        for hook in CONNECT_HOOKS:
+            hook(con)
+        return con
+
+    def connections(self):
+        """The writer and the live per-thread readers (not snapshots)."""
+        with self._readers_lock:
+            self._reap()
+            cons = [con for _, con in self._readers.values()]
+        return cons + ([self._writer] if self._writer is not None else [])
+
+    # ---- reads ----
+    def reader(self):
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            return con
+        if self._closed:
+            raise sqlite3.ProgrammingError("connection manager is closed")
+        con = self._open()
+        con.execute("PRAGMA query_only=ON")
+        self._local.con = con
+        me = threading.current_thread()
+        with self._readers_lock:
+            self._reap()
+            self._readers[me.ident] = (me, con)
+        return con
+
+    def _reap(self):
+        # Streamlit runs each rerun on a fresh script thread; close the read
+        # connections of threads that have finished.
+        for ident, (thread, con) in list(self._readers.items()):
+            if not thread.is_alive():
+                con.close()
+                del self._readers[ident]
+
+    @contextmanager
+    def snapshot(self, attach=None):
+        """Private read-only connection holding one consistent read transaction.
+
+        For long multi-cursor reads (exports) that must not interleave with
+        the pooled per-thread reader. attach maps schema alias -> file.
+        """
+        con = self._open()
+        con.execute("PRAGMA query_only=ON")
+        for alias, path in (attach or {}).items():
+            attach_to(con, alias, path)
+        con.execute("BEGIN")
+        try:
+            yield con
+        finally:
+            if con.in_transaction:
+                con.execute("COMMIT")
+            con.close()
+
+    # ---- writes ----
+    @contextmanager
+    def writer(self, bump=True):
+        """Yield the writer connection inside a BEGIN IMMEDIATE transaction.
+
+        bump=False is for bookkeeping writes (job status) that must not
+        invalidate cached reads of client data.
+        """
+        with self._write_lock:
+            con = self._writer
+            if con is None:
+                raise sqlite3.ProgrammingError("connection manager is closed")
+            if self._depth:
+                # nested use from the same thread joins the open transaction
+                self._depth += 1
+                self._bump = self._bump or bump
+                try:
+                    yield con
+                finally:
+                    self._depth -= 1
+                return
+            self._begin(con)
+            self._depth = 1
+            self._bump = bump
+            try:
+                yield con
+                self._retry(lambda: con.execute("COMMIT"))
+                if self._bump:
+                    self.generation += 1
+            except BaseException:
+                if con.in_transaction:
+                    con.execute("ROLLBACK")
+                raise
+            finally:
+                self._depth = 0
+
+    def _begin(self, con):
+        self._retry(lambda: con.execute("BEGIN IMMEDIATE"))
+
+    def _retry(self, fn):
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                return fn()
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or attempt == self.retries:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    @contextmanager
+    def attached(self, alias, path):
+        """Keep path ATTACHed to the writer as alias while the block runs.
+
+        ATTACH/DETACH cannot run inside a transaction, so they happen under
+        the write lock between write transactions; concurrent users share
+        one attachment.
+        """
+        with self._write_lock:
+            if self._depth:
+                raise sqlite3.ProgrammingError("cannot ATTACH inside a write transaction")
+            if not self._attached.get(alias):
+                attach_to(self._writer, alias, path)
+            self._attached[alias] = self._attached.get(alias, 0) + 1
+        try:
+            yield
+        finally:
+            with self._write_lock:
+                self._attached[alias] -= 1
+                if not self._attached[alias]:
+                    del self._attached[alias]
+                    if self._writer is not None:
+                        self._writer.execute(f"DETACH DATABASE {alias}")
+
+    def execute_write(self, sql, params=()):
+        with self.writer() as con:
+            cur = con.execute(sql, params)
+            return cur.lastrowid
+
+    # ---- cached reads ----
+    def data_version(self):
+        """The writer's PRAGMA data_version, which moves whenever another
+        connection (bulk_import.py, archive.py, backup.py, migrations.py
+        in another process) commits to the database file."""
+        # while a local write holds the lock, its commit bumps the generation anyway
+        if self._write_lock.acquire(blocking=False):
+            try:
+                if self._writer is not None:
+                    self._data_version = self._writer.execute("PRAGMA data_version").fetchone()[0]
+            finally:
+                self._write_lock.release()
+        return self._data_version
+
+    def pin_data_version(self):
+        """Check data_version() once for the calling thread and reuse it in
+        cached() until the next pin. The app pins at the top of every rerun,
+        so a rerun with nothing changed runs no SQL at all; threads that
+        never pin (jobs, CLI) check on every lookup."""
+        self._local.data_version = None
+        self._local.data_version = self.data_version()
+
+    def cached(self, key, compute):
+        """Return compute() for key at the current data generation.
+
+        The generation pairs the count of local writes with data_version(),
+        so commits from other connections and processes invalidate too.
+        """
+        pinned = getattr(self._local, "data_version", None)
+        generation = (self.generation, self.data_version() if pinned is None else pinned)
+        value = self.cache.get(key, generation)
+        if value is None:
+            value = compute()
+            self.cache.put(key, generation, value)
+        return value
+
+    def invalidate(self):
+        with self._write_lock:
+            self.generation += 1
+        self.cache.clear()
+
+    # ---- lifecycle ----
+    def stats(self):
+        with self._readers_lock:
+            self._reap()
+            readers = len(self._readers)
+        return {"path": self.path, "readers": readers, "generation": self.generation,
+                "cache": self.cache.stats()}
+
+    def close(self):
+        self._closed = True
+        with self._readers_lock:
+            for _, con in self._readers.values():
+                con.close()
+            self._readers.clear()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def manager(path=None):
+    """Process-wide ConnectionManager for path (shared across sessions)."""
+    path = path or DB
+    with _managers_lock:
+        m = _managers.get(path)
+        if m is None or m._closed:
+            m = _managers[path] = ConnectionManager(path)
+        return m
+
+
+def attach_to(con, alias, path):
+    """ATTACH path as alias on con unless it already is; returns con."""
+    if alias not in {r[1] for r in con.execute("PRAGMA database_list")}:
+        con.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+    return con
+
+
+def open_connections():
+    with _managers_lock:
+        managers = list(_managers.values())
+    return [con for m in managers for con in m.connections()]
+
+
+def close_all():
+    with _managers_lock:
+        for m in _managers.values():
+            m.close()
+        _managers.clear()
+
+
+# ---------------- Data access ----------------
+def conn_cur():
+    # pooled, per-thread read connection; do not close it
+    c = manager().reader()
+    return c, c.cursor()
+
+def writer(bump=True):
+    return manager().writer(bump)
+
+def init_db():
+    import migrations
+    # numbered migrations; a no-op after the first rerun in this process
+    migrations.ensure_current(DB)
+
+def _cached(fn):
+    # results are shared across sessions until the next write
+    @functools.wraps(fn)
+    def wrapper(*args):
+        val = manager().cached((fn.__name__,) + args, lambda: fn(*args))
+        # callers are free to mutate what they get back
+        if isinstance(val, tuple):
+            return tuple(v.copy() if isinstance(v, pd.DataFrame) else v for v in val)
+        return val.copy() if isinstance(val, pd.DataFrame) else val
+    wrapper.uncached = fn
+    return wrapper
+
+def add_client(name, case_details, contact, agreed_fee, status, commitment_date, first_visit_date):
+    with writer() as con:
+        con.execute("""INSERT INTO clients (name, case_details, contact, agreed_fee, payment_status, commitment_date, first_visit_date)
+                       VALUES (?,?,?,?,?,?,?)""",
+                    (name, case_details, contact, agreed_fee, status, to_days(commitment_date), to_days(first_visit_date)))
+
+def update_client(cid, name, case_details, contact, agreed_fee, status, commitment_date, first_visit_date):
+    with writer() as con:
+        con.execute("""UPDATE clients SET name=?, case_details=?, contact=?, agreed_fee=?, payment_status=?, commitment_date=?, first_visit_date=?
+                       WHERE id=?""",
+                    (name, case_details, contact, agreed_fee, status,
+                     to_days(commitment_date), to_days(first_visit_date), cid))
+
+def delete_client(cid):
+    with writer() as con:
+        con.execute("DELETE FROM clients WHERE id=?", (cid,))
+
+def add_hearing(cid, hearing_date, note):
+    with writer() as con:
+        con.execute("INSERT INTO hearings (client_id, hearing_date, note) VALUES (?,?,?)",
+                    (cid, to_days(hearing_date), note))
+
+def add_payment(cid, pay_date, amount, mode, note):
+    with writer() as con:
+        con.execute("INSERT INTO payments (client_id, pay_date, amount, mode, note) VALUES (?,?,?,?,?)",
+                    (cid, to_days(pay_date), amount, mode, note))
+
+@_cached
+def df_clients():
+    con, cur = conn_cur()
+    return pd.read_sql_query("""SELECT c.*, COALESCE(b.total_paid, 0) AS total_paid,
+                                       COALESCE(b.pending, 0) AS pending,
+                                       b.last_payment_date, COALESCE(b.payment_count, 0) AS payment_count
+                                FROM clients c LEFT JOIN client_balances b ON b.client_id=c.id
+                                ORDER BY c.name COLLATE NOCASE""", con,
+                             parse_dates=_dates("commitment_date", "first_visit_date", "last_payment_date"))
+
+class ClientIndex:
+    """Id-keyed view of df_clients() with a sorted name list for prefix lookups.
+
+    Built once per data generation (see client_index()) and shared by every
+    session, so treat it as read-only.
+    """
+
+    def __init__(self, frame):
+        ids = frame["id"].astype(int).tolist()
+        keys = frame["name"].fillna("").str.strip().str.casefold().tolist()
+        self.rows = dict(zip(ids, frame.to_dict("records")))
+        order = sorted(zip(keys, ids))
+        self._keys = [k for k, _ in order]
+        self._ids = [i for _, i in order]
+        seen = set()
+        self.ambiguous = {k for k in keys if k in seen or seen.add(k)}
+        self.unique = {k: i for k, i in zip(keys, ids) if k not in self.ambiguous}
+        self.nbytes = int(frame.memory_usage(index=True, deep=True).sum()) * 2
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, cid):
+        return cid in self.rows
+
+    def get(self, cid):
+        return self.rows.get(cid)
+
+    def label(self, cid):
+        """Display name; duplicates get their case/contact and id appended."""
+        row = self.rows.get(cid)
+        if row is None:
+            return f"#{cid}"
+        name = row["name"] or ""
+        if name.strip().casefold() not in self.ambiguous:
+            return name
+        extra = row.get("case_details") or row.get("contact")
+        return f"{name} · {extra} (#{cid})" if extra else f"{name} (#{cid})"
+
+    def prefix(self, text, limit=None):
+        """(ids whose name starts with text, total matches), in name order."""
+        key = (text or "").strip().casefold()
+        lo = bisect.bisect_left(self._keys, key)
+        hi = bisect.bisect_left(self._keys, key + "\U0010ffff", lo)
+        end = hi if limit is None else min(hi, lo + limit)
+        return self._ids[lo:end], hi - lo
+
+@_cached
+def client_index():
+    return ClientIndex(df_clients())
+
+@_cached
+def df_hearings():
+    con, cur = conn_cur()
+    return pd.read_sql_query("""SELECT h.id, h.client_id, c.name, h.hearing_date, h.note
+                                FROM hearings h JOIN clients c ON c.id=h.client_id
+                                ORDER BY h.hearing_date ASC, c.name""", con, parse_dates=_dates("hearing_date"))
+
+@_cached
+def df_payments():
+    con, cur = conn_cur()
+    return pd.read_sql_query("""SELECT p.id, p.client_id, c.name, p.pay_date, p.amount, p.mode, p.note
+                                FROM payments p JOIN clients c ON c.id=p.client_id
+                                ORDER BY p.pay_date DESC""", con, parse_dates=_dates("pay_date"))
+
+@_cached
+def total_paid_for(cid):
+    return balance_for(cid)["total_paid"]
+
+
+# ---------------- Paged history ----------------
+# Keyset pagination: a cursor is the (date, id) of the last row on the
+# previous page, so every page is an index range scan no matter how deep.
+# archived=True pages over the hot rows UNION ALL the archive file; ids are
+# kept when rows move, so cursors stay unique.
+HISTORY_COLUMNS = {
+    "hearings": "id, client_id, hearing_date, note",
+    "payments": "id, client_id, pay_date, amount, mode, note",
+}
+
+def _history_where(alias, date_col, client_id, date_from, date_to, mode=None):
+    where, params = [], []
+    if client_id is not None:
+        where.append(f"{alias}.client_id=?"); params.append(int(client_id))
+    if date_from:
+        where.append(f"{alias}.{date_col}>=?"); params.append(to_days(date_from))
+    if date_to:
+        where.append(f"{alias}.{date_col}<=?"); params.append(to_days(date_to))
+    if mode:
+        where.append(f"{alias}.mode=?"); params.append(mode)
+    return where, params
+
+def _history_source(table, alias, archived, with_clients=True):
+    """(connection, FROM clause) for history reads; archived=True also reads
+    the rows moved to the archive file (archive.py), when there is one."""
+    import archive
+    con = archive.reader() if archived else None
+    if con is None:
+        con, src, clients = conn_cur()[0], f"{table} {alias}", "clients c"
+    else:
+        src = f"{archive.union(table, HISTORY_COLUMNS[table])} {alias}"
+        clients = f"{archive.union('clients', 'id, name')} c"
+        # archived rows of a deleted client linger until reconcile(); the
+        # join keeps counts and reports in step with the pages
+        with_clients = True
+    if with_clients:
+        src += f" JOIN {clients} ON c.id={alias}.client_id"
+    return con, src
+
+def _page(con, sql, where, params, alias, date_col, after, descending, limit):
+    if after is not None:
+        op = "<" if descending else ">"
+        where = where + [f"({alias}.{date_col}, {alias}.id) {op} (?, ?)"]
+        params = params + [after[0], int(after[1])]
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    order = "DESC" if descending else "ASC"
+    sql += f" ORDER BY {alias}.{date_col} {order}, {alias}.id {order} LIMIT ?"
+    df = pd.read_sql_query(sql, con, params=params + [limit + 1], parse_dates=_dates(date_col))
+    nxt = None
+    if len(df) > limit:
+        df = df.iloc[:limit]
+        last = df.iloc[-1]
+        nxt = (to_days(last[date_col]), int(last["id"]))
+    return df, nxt
+
+@_cached
+def hearings_page(client_id=None, date_from=None, date_to=None, archived=False, after=None, limit=PAGE_SIZE):
+    """One page of hearings in date order; returns (df, next_cursor or None)."""
+    where, params = _history_where("h", "hearing_date", client_id, date_from, date_to)
+    con, src = _history_source("hearings", "h", archived)
+    sql = f"SELECT h.id, h.client_id, c.name, h.hearing_date, h.note FROM {src}"
+    return _page(con, sql, where, params, "h", "hearing_date", after, False, limit)
+
+@_cached
+def payments_page(client_id=None, date_from=None, date_to=None, mode=None, archived=False, after=None,
+                  limit=PAGE_SIZE):
+    """One page of payments, newest first; returns (df, next_cursor or None)."""
+    where, params = _history_where("p", "pay_date", client_id, date_from, date_to, mode)
+    con, src = _history_source("payments", "p", archived)
+    sql = f"SELECT p.id, p.client_id, c.name, p.pay_date, p.amount, p.mode, p.note FROM {src}"
+    return _page(con, sql, where, params, "p", "pay_date", after, True, limit)
+
+@_cached
+def count_hearings(client_id=None, date_from=None, date_to=None, archived=False):
+    where, params = _history_where("h", "hearing_date", client_id, date_from, date_to)
+    con, src = _history_source("hearings", "h", archived, with_clients=False)
+    sql = f"SELECT COUNT(*) FROM {src}" + (" WHERE " + " AND ".join(where) if where else "")
+    return con.execute(sql, params).fetchone()[0]
+
+@_cached
+def count_payments(client_id=None, date_from=None, date_to=None, mode=None, archived=False):
+    """(row count, amount total) for the filtered payments."""
+    where, params = _history_where("p", "pay_date", client_id, date_from, date_to, mode)
+    con, src = _history_source("payments", "p", archived, with_clients=False)
+    sql = (f"SELECT COUNT(*), COALESCE(SUM(amount),0) FROM {src}"
+           + (" WHERE " + " AND ".join(where) if where else ""))
+    n, total = con.execute(sql, params).fetchone()
+    return n, float(total)
+
+
+# ---------------- Balance ledger ----------------
+# client_balances is maintained by triggers on clients and payments
+# (migration 5); reads are a primary-key lookup, never a SUM. Totals include
+# payments moved to the archive (archived_payment_totals, migration 8).
+BALANCE_FIELDS = ("total_paid", "pending", "last_payment_date", "payment_count")
+
+@_cached
+def balance_for(cid):
+    con, cur = conn_cur()
+    row = cur.execute(f"SELECT {', '.join(BALANCE_FIELDS)} FROM client_balances WHERE client_id=?",
+                      (int(cid),)).fetchone()
+    if row is None:
+        return {"total_paid": 0.0, "pending": 0.0, "last_payment_date": None, "payment_count": 0}
+    return {"total_paid": float(row[0]), "pending": float(row[1]),
+            "last_payment_date": from_days(row[2]), "payment_count": int(row[3])}
+
+@_cached
+def df_outstanding(limit=100):
+    """Clients with dues, largest pending first (walks ix_balances_pending)."""
+    con, cur = conn_cur()
+    return pd.read_sql_query("""SELECT c.id, c.name, c.contact, c.agreed_fee, b.total_paid, b.pending,
+                                       b.last_payment_date, b.payment_count, c.commitment_date
+                                FROM client_balances b JOIN clients c ON c.id=b.client_id
+                                WHERE b.pending > 0
+                                ORDER BY b.pending DESC LIMIT ?""", con, params=(int(limit),),
+                             parse_dates=_dates("last_payment_date", "commitment_date"))
+
+def verify_balances(tolerance=0.005):
+    """Compare the ledger with a fresh aggregate; returns mismatching rows."""
+    import migrations
+    con, cur = conn_cur()
+    fresh = {r[0]: r[1:] for r in cur.execute(migrations.LEDGER_SQL + " GROUP BY c.id")}
+    stored = {r[0]: r[1:] for r in cur.execute("SELECT client_id, " + ", ".join(BALANCE_FIELDS) + " FROM client_balances")}
+    bad = []
+    for cid in fresh.keys() | stored.keys():
+        want, got = fresh.get(cid), stored.get(cid)
+        if (want is None or got is None
+                or abs(want[0] - got[0]) > tolerance or abs(want[1] - got[1]) > tolerance
+                or want[2] != got[2] or want[3] != got[3]):
+            bad.append({"client_id": cid, "expected": want, "stored": got})
+    return bad
+
+def rebuild_balances():
+    """Recompute the whole ledger in one transaction; returns row count."""
+    import migrations
+    with writer() as con:
+        con.execute("DELETE FROM client_balances")
+        return con.execute("INSERT INTO client_balances " + migrations.LEDGER_SQL + " GROUP BY c.id").rowcount
+
+
+# ---------------- Date rejects ----------------
+# Legacy dates migration 7 could not read. A client keeps NULL in place; a
+# hearing or payment is held out of its table (history, reports, ledger and
+# archive) in date_rejects.held_row until it gets a date or is discarded.
+@_cached
+def date_rejects():
+    con, cur = conn_cur()
+    return pd.read_sql_query("""SELECT r.table_name, r.row_id, r.column_name, r.original,
+                                       c.id AS client_id, c.name,
+                                       json_extract(r.held_row, '$.amount') AS amount,
+                                       json_extract(r.held_row, '$.note') AS note
+                                FROM date_rejects r
+                                LEFT JOIN clients c ON c.id = COALESCE(json_extract(r.held_row, '$.client_id'), r.row_id)
+                                ORDER BY r.table_name, r.row_id""", con)
+
+def fix_date_reject(table, row_id, column, day):
+    """Give a rejected date its value; a held row goes back into its table."""
+    days = to_days(day)
+    key = (table, int(row_id), column)
+    with writer() as con:
+        row = con.execute("SELECT held_row FROM date_rejects WHERE table_name=? AND row_id=? AND column_name=?",
+                          key).fetchone()
+        if row is None:
+            raise KeyError(f"no rejected {table}.{column} for row {row_id}")
+        if row[0] is None:
+            con.execute(f"UPDATE {table} SET {column}=? WHERE id=?", (days, int(row_id)))
+        else:
+            held = {**json.loads(row[0]), column: days}
+            if con.execute("SELECT 1 FROM clients WHERE id=?", (held["client_id"],)).fetchone() is None:
+                raise KeyError(f"client {held['client_id']} no longer exists; discard the row instead")
+            con.execute(f"INSERT INTO {table} ({', '.join(held)}) VALUES ({', '.join('?' * len(held))})",
+                        tuple(held.values()))
+        con.execute("DELETE FROM date_rejects WHERE table_name=? AND row_id=? AND column_name=?", key)
+
+def discard_date_reject(table, row_id, column):
+    """Drop a rejected date for good (a held row with it)."""
+    with writer() as con:
+        con.execute("DELETE FROM date_rejects WHERE table_name=? AND row_id=? AND column_name=?",
+                    (table, int(row_id), column))
+
+# ---------------- Upcoming hearings ----------------
+# Range scans on ix_hearings_date_id; callers pass today's date so cached
+# results roll over at midnight.
+UPCOMING_LIMIT = 30
+
+@_cached
+def upcoming_hearings(start, limit=UPCOMING_LIMIT):
+    """The next `limit` hearings on or after start, by date then client name."""
+    con, cur = conn_cur()
+    return pd.read_sql_query("""SELECT h.id, h.client_id, c.name, h.hearing_date, h.note
+                                FROM hearings h JOIN clients c ON c.id=h.client_id
+                                WHERE h.hearing_date >= ?
+                                ORDER BY h.hearing_date, c.name LIMIT ?""",
+                             con, params=(to_days(start), int(limit)), parse_dates=_dates("hearing_date"))
+
+@_cached
+def upcoming_counts(start):
+    """Hearing counts for start (today), the next day and the 7 days from start."""
+    con, cur = conn_cur()
+    start = to_days(start)
+    day1, week_end = start + 1, start + 6
+    today_n, tomorrow_n, week_n, later = cur.execute(
+        """SELECT COALESCE(SUM(hearing_date = ?), 0), COALESCE(SUM(hearing_date = ?), 0),
+                  COUNT(*), EXISTS (SELECT 1 FROM hearings WHERE hearing_date > ?)
+           FROM hearings WHERE hearing_date BETWEEN ? AND ?""",
+        (start, day1, week_end, start, week_end)).fetchone()
+    return {"today": today_n, "tomorrow": tomorrow_n, "week": week_n, "any": bool(week_n or later)}
+
+
+@_cached
+def cause_list(day):
+    """Matters listed on one day, grouped by court/stage note, then client."""
+    con, cur = conn_cur()
+    return pd.read_sql_query("""SELECT h.id, h.client_id, c.name, c.case_details, c.contact, h.note
+                                FROM hearings h JOIN clients c ON c.id=h.client_id
+                                WHERE h.hearing_date = ?
+                                ORDER BY COALESCE(h.note, '') COLLATE NOCASE, c.name COLLATE NOCASE, h.id""",
+                             con, params=(to_days(day),))
+
+# ---------------- Reports ----------------
+# Aggregates and window functions run in SQLite; frames come back
+# Arrow-backed (dtype_backend="pyarrow") with day numbers as date32.
+AGING_BUCKETS = [(0, 30), (31, 60), (61, 90), (91, 180)]   # days past commitment; beyond -> "181+ days"
+AGING_LABELS = (["Not yet due"] + [f"{lo}–{hi} days" for lo, hi in AGING_BUCKETS]
+                + [f"{AGING_BUCKETS[-1][1] + 1}+ days", "No commitment date"])
+_AGING_CASE = (f"CASE WHEN days_overdue IS NULL THEN {len(AGING_LABELS) - 1} WHEN days_overdue < 0 THEN 0 "
+               + " ".join(f"WHEN days_overdue <= {hi} THEN {i}" for i, (lo, hi) in enumerate(AGING_BUCKETS, 1))
+               + f" ELSE {len(AGING_BUCKETS) + 1} END")
+# court = the hearing note up to the first " - " or "," ("JMFC Court - evidence" -> "JMFC Court")
+_NOTE = "REPLACE(TRIM(COALESCE(h.note, '')), ',', ' - ')"
+COURT_SQL = f"COALESCE(NULLIF(TRIM(SUBSTR({_NOTE}, 1, INSTR({_NOTE} || ' - ', ' - ') - 1)), ''), '(no court noted)')"
+
+def _arrow(df, *date_cols):
+    # a day number is exactly Arrow's date32 value
+    for c in date_cols:
+        df[c] = df[c].astype("int32[pyarrow]").astype("date32[pyarrow]")
+    return df
+
+def _labelled(df, col, labels):
+    df.insert(0, "bucket", pd.Series([labels[int(i)] for i in df[col]], dtype="string[pyarrow]", index=df.index))
+    return df.drop(columns=col)
+
+def week_start(day):
+    """Monday of the week containing day."""
+    day = as_date(day)
+    return day - datetime.timedelta(days=day.weekday())
+
+@_cached
+def aging_report(as_of, per_bucket=25):
+    """Receivables aged against commitment_date as of a day.
+
+    Returns (buckets, debtors): one row per AGING_LABELS bucket with client
+    count, pending, share and running total; and the largest per_bucket
+    debtors of each bucket with how long they are overdue.
+    """
+    con, cur = conn_cur()
+    day = to_days(as_of)
+    due = f"""SELECT *, {_AGING_CASE} AS bucket_no FROM (
+                  SELECT c.id, c.name, c.contact, c.agreed_fee, b.total_paid, b.pending, c.commitment_date,
+                         b.last_payment_date, ? - c.commitment_date AS days_overdue,
+                         ? - b.last_payment_date AS days_since_payment
+                  FROM client_balances b JOIN clients c ON c.id = b.client_id
+                  WHERE b.pending > 0)"""
+    params = [day, day]
+    buckets = pd.read_sql_query(f"""WITH due AS ({due})
+        SELECT bucket_no, COUNT(*) AS clients, SUM(pending) AS pending,
+               SUM(pending) / SUM(SUM(pending)) OVER () AS share,
+               SUM(SUM(pending)) OVER (ORDER BY bucket_no) AS cumulative,
+               MAX(CASE WHEN days_overdue >= 0 THEN days_overdue END) AS oldest_days
+        FROM due GROUP BY bucket_no ORDER BY bucket_no""", con, params=params, dtype_backend="pyarrow")
+    # every bucket appears, empty ones with zeros
+    buckets = (buckets.set_index("bucket_no").reindex(range(len(AGING_LABELS)))
+               .fillna({"clients": 0, "pending": 0.0, "share": 0.0}))
+    buckets["cumulative"] = buckets["cumulative"].ffill().fillna(0.0)
+    buckets = _labelled(buckets.reset_index(), "bucket_no", AGING_LABELS)
+    debtors = pd.read_sql_query(f"""WITH due AS ({due})
+        SELECT * FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY bucket_no ORDER BY pending DESC, id) AS rank_in_bucket
+                       FROM due)
+        WHERE rank_in_bucket <= ? ORDER BY bucket_no, pending DESC, id""",
+                                con, params=params + [int(per_bucket)], dtype_backend="pyarrow")
+    debtors = _labelled(_arrow(debtors, "commitment_date", "last_payment_date"), "bucket_no", AGING_LABELS)
+    return buckets, debtors
+
+@_cached
+def collections_report(date_from, date_to, archived=False):
+    """Payments received per month and mode between two days, with each
+    mode's share of the month and its running total over the period."""
+    con, src = _history_source("payments", "p", archived, with_clients=False)
+    return pd.read_sql_query(f"""WITH m AS (
+            SELECT strftime('%Y-%m', p.pay_date + 2440587.5) AS month,
+                   COALESCE(NULLIF(TRIM(p.mode), ''), 'Other') AS mode,
+                   SUM(p.amount) AS amount, COUNT(*) AS payments, COUNT(DISTINCT p.client_id) AS clients
+            FROM {src} WHERE p.pay_date BETWEEN ? AND ?
+            GROUP BY month, mode)
+        SELECT month, mode, amount, payments, clients,
+               SUM(amount) OVER (PARTITION BY month) AS month_total,
+               amount / SUM(amount) OVER (PARTITION BY month) AS share,
+               SUM(amount) OVER (PARTITION BY mode ORDER BY month) AS running_total
+        FROM m ORDER BY month, amount DESC, mode""",
+                             con, params=(to_days(date_from), to_days(date_to)), dtype_backend="pyarrow")
+
+@_cached
+def hearing_load(date_from, date_to, archived=False):
+    """Hearings listed between two days, per week and per court.
+
+    Returns (by_week, by_court). Weeks run Monday to Sunday and include
+    empty ones; by_week carries the busiest day and a 4-week moving
+    average, by_court the share of all hearings and a rank.
+    """
+    con, src = _history_source("hearings", "h", archived, with_clients=False)
+    lo, hi = to_days(date_from), to_days(date_to)
+    first = to_days(week_start(date_from))
+    # day 0 (1970-01-01) was a Thursday: (day + 3) % 7 is the weekday, Monday 0
+    by_week = pd.read_sql_query(f"""WITH RECURSIVE weeks(week) AS (
+                SELECT ? UNION ALL SELECT week + 7 FROM weeks WHERE week + 7 <= ?),
+            daily AS (
+                SELECT h.hearing_date AS day, COUNT(*) AS n, COUNT(DISTINCT {COURT_SQL}) AS courts
+                FROM {src} WHERE h.hearing_date BETWEEN ? AND ? GROUP BY h.hearing_date),
+            weekly AS (
+                SELECT day - (day + 3) % 7 AS week, SUM(n) AS hearings, COUNT(*) AS days_listed,
+                       MAX(n) AS busiest_day, MAX(courts) AS most_courts
+                FROM daily GROUP BY week)
+        SELECT w.week, COALESCE(k.hearings, 0) AS hearings, COALESCE(k.days_listed, 0) AS days_listed,
+               COALESCE(k.busiest_day, 0) AS busiest_day, COALESCE(k.most_courts, 0) AS most_courts_in_a_day,
+               AVG(COALESCE(k.hearings, 0)) OVER (ORDER BY w.week ROWS BETWEEN 3 PRECEDING AND CURRENT ROW) AS avg_4wk
+        FROM weeks w LEFT JOIN weekly k ON k.week = w.week ORDER BY w.week""",
+                                con, params=(first, hi, lo, hi), dtype_backend="pyarrow")
+    by_court = pd.read_sql_query(f"""WITH h AS (
+                SELECT {COURT_SQL} AS court, h.client_id, h.hearing_date
+                FROM {src} WHERE h.hearing_date BETWEEN ? AND ?)
+        SELECT MIN(court) AS court, COUNT(*) AS hearings, COUNT(DISTINCT client_id) AS clients,
+               MIN(hearing_date) AS first_date, MAX(hearing_date) AS last_date,
+               COUNT(*) * 1.0 / SUM(COUNT(*)) OVER () AS share,
+               RANK() OVER (ORDER BY COUNT(*) DESC) AS rank
+        FROM h GROUP BY court COLLATE NOCASE ORDER BY hearings DESC, court COLLATE NOCASE""",
+                                 con, params=(lo, hi), dtype_backend="pyarrow")
+    return _arrow(by_week, "week"), _arrow(by_court, "first_date", "last_date")
+
+# ---------------- Full-text search ----------------
+# search_index is an FTS5 table kept in sync by triggers (migration 006);
+# rank is bm25 weighted name > case details > contact > notes.
+SEARCH_LIMIT = 20
+
+def search_query(text):
+    """Turn free text into an FTS5 query: every word must match as a prefix."""
+    return " ".join(f'"{w}"*' for w in re.findall(r"\w+", text or ""))
+
+@_cached
+def search_clients(text, limit=SEARCH_LIMIT):
+    """Clients matching text, best first, with hit count and a snippet of the best match."""
+    query = search_query(text)
+    cols = ["id", "name", "case_details", "contact", "hits", "match", "kind"]
+    if not query:
+        return pd.DataFrame(columns=cols)
+    con, cur = conn_cur()
+    # rank is evaluated once per matching row; snippets only for the winners
+    best = cur.execute("""SELECT client_id, rowid, MIN(rank), COUNT(*) FROM search_index
+                          WHERE search_index MATCH ? GROUP BY client_id ORDER BY 3, 4 DESC LIMIT ?""",
+                       (query, int(limit))).fetchall()
+    if not best:
+        return pd.DataFrame(columns=cols)
+    marks = ",".join("?" * len(best))
+    snips = {r[0]: r[1:] for r in cur.execute(
+        f"""SELECT rowid, snippet(search_index, -1, '[', ']', '…', 10), kind
+            FROM search_index WHERE search_index MATCH ? AND rowid IN ({marks})""",
+        (query, *[b[1] for b in best]))}
+    info = {r[0]: r[1:] for r in cur.execute(
+        f"SELECT id, name, case_details, contact FROM clients WHERE id IN ({marks})", [b[0] for b in best])}
+    rows = []
+    for cid, rowid, _, hits in best:
+        if cid in info:
+            rows.append((cid, *info[cid], hits, *snips.get(rowid, ("", ""))))
+    return pd.DataFrame(rows, columns=cols)
+
+def rebuild_search():
+    """Re-seed the search index from the base tables; returns row count."""
+    import migrations
+    with writer() as con:
+        con.execute("DELETE FROM search_index")
+        for sql in migrations.SEARCH_SEED:
+            con.execute(sql)
+        con.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+        return con.execute("SELECT COUNT(*) FROM search_index").fetchone()[0]
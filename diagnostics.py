@@ -0,0 +1,260 @@
+"""Query and rerun profiling for the Advocate Client Desk.
+
+enable() attaches a sqlite3 trace callback and progress handler to every
+connection the ConnectionManager opens, and to those already open. The
+trace callback marks the start of each statement. The progress handler
+fires every PROGRESS_OPS virtual-machine steps and stamps the latest
+activity, so a statement's time is last tick - start. Python time spent
+between fetches is included; idle time after the last row is not, and
+statements shorter than PROGRESS_OPS steps count as ~0 ms.
+
+amol.py calls start_rerun() at the top of the main page and section(name)
+before each card; every section reports wall time, SQL time and statement
+count. The slowest statements and reruns are kept in bounded buffers for
+the diagnostics panel, and finished reruns can be appended to a JSON-lines
+log for offline analysis.
+"""
+import datetime
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import db
+
+PROGRESS_OPS = 1000       # VM steps between progress-handler ticks
+SLOW_KEEP = 50            # slowest statements / reruns kept
+RECENT_KEEP = 500         # ring buffer of recent statements
+RECENT_RERUNS = 100
+RUN_TOP = 5               # slowest statements logged with each rerun
+SQL_CHARS = 400
+
+
+def log_path(path=None):
+    return db.sibling_path("_diagnostics.jsonl", path)
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="milliseconds")
+
+
+class _Stmt:
+    __slots__ = ("sql", "start", "last", "ticks")
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.start = self.last = time.perf_counter()
+        self.ticks = 0
+
+
+class Rerun:
+    """Timings of one script run, split into named sections."""
+
+    def __init__(self, session):
+        self.session = session
+        self.started = _now()
+        self.t0 = self.mark = self.last = time.perf_counter()
+        self.sections = {}          # name -> {"ms", "sql_ms", "queries"}
+        self.current = None
+        self.top = []               # heap of this run's slowest statements
+        self.finished = False
+        self.interrupted = False
+
+    def _close_section(self, end):
+        if self.current is not None:
+            s = self.sections[self.current]
+            s["ms"] += (end - self.mark) * 1000
+        self.current = None
+
+    def open(self, name):
+        now = time.perf_counter()
+        self._close_section(now)
+        self.sections.setdefault(name, {"ms": 0.0, "sql_ms": 0.0, "queries": 0})
+        self.current, self.mark, self.last = name, now, now
+
+    def add_query(self, rec):
+        if self.current is not None:
+            s = self.sections[self.current]
+            s["sql_ms"] += rec["ms"]
+            s["queries"] += 1
+        item = (rec["ms"], rec["seq"], rec)
+        (heapq.heappush if len(self.top) < RUN_TOP else heapq.heappushpop)(self.top, item)
+        self.last = time.perf_counter()
+
+    def finish(self, interrupted=False):
+        # an interrupted run (st.rerun()/st.stop()) ends at its last activity
+        end = self.last if interrupted else time.perf_counter()
+        self._close_section(max(end, self.mark))
+        self.finished, self.interrupted = True, interrupted
+        self.total_ms = (max(end, self.mark) - self.t0) * 1000
+
+    def as_dict(self):
+        sections = {k: {"ms": round(v["ms"], 2), "sql_ms": round(v["sql_ms"], 2), "queries": v["queries"],
+                        "other_ms": round(max(0.0, v["ms"] - v["sql_ms"]), 2)}
+                    for k, v in self.sections.items()}
+        return {
+            "session": self.session, "started": self.started, "interrupted": self.interrupted,
+            "total_ms": round(getattr(self, "total_ms", 0.0), 2),
+            "sql_ms": round(sum(v["sql_ms"] for v in self.sections.values()), 2),
+            "queries": sum(v["queries"] for v in self.sections.values()),
+            "sections": sections,
+            "slowest_queries": [{k: r[k] for k in ("ms", "sql", "ops")} for _, _, r in sorted(self.top, reverse=True)],
+        }
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.log_path = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self.recent = deque(maxlen=RECENT_KEEP)
+        self.slow = []              # heap of (ms, seq, record)
+        self.reruns = deque(maxlen=RECENT_RERUNS)
+        self.slow_reruns = []
+        self.statements = 0
+
+    # ---- sqlite callbacks (run on the thread executing the statement) ----
+    def attach(self, con):
+        con.set_trace_callback(self._on_trace)
+        con.set_progress_handler(self._on_progress, PROGRESS_OPS)
+
+    @staticmethod
+    def detach(con):
+        con.set_trace_callback(None)
+        con.set_progress_handler(None, 0)
+
+    def _on_trace(self, sql):
+        if sql.startswith("--"):
+            return      # statements run by a trigger belong to their parent
+        self._end_stmt()
+        self._local.stmt = _Stmt(sql)
+
+    def _on_progress(self):
+        s = getattr(self._local, "stmt", None)
+        if s is not None:
+            s.ticks += 1
+            s.last = time.perf_counter()
+        return 0
+
+    def _end_stmt(self):
+        s = getattr(self._local, "stmt", None)
+        if s is None:
+            return
+        self._local.stmt = None
+        run = getattr(self._local, "run", None)
+        rec = {"ms": round((s.last - s.start) * 1000, 3), "sql": " ".join(s.sql.split())[:SQL_CHARS],
+               "ops": s.ticks * PROGRESS_OPS, "thread": threading.current_thread().name,
+               "section": run.current if run is not None else None, "at": _now(), "seq": next(self._seq)}
+        with self._lock:
+            self.statements += 1
+            self.recent.append(rec)
+            self._keep(self.slow, (rec["ms"], rec["seq"], rec))
+        if run is not None and not run.finished:
+            run.add_query(rec)
+
+    @staticmethod
+    def _keep(heap, item):
+        (heapq.heappush if len(heap) < SLOW_KEEP else heapq.heappushpop)(heap, item)
+
+    # ---- reruns ----
+    def start_rerun(self, state, session=None):
+        """Begin timing a script run; state is the session's state mapping."""
+        prev = state.get("_diag_run")
+        if prev is not None and not prev.finished:
+            self._record(prev, interrupted=True)
+            state["_diag_last"] = prev
+        if not self.enabled:
+            self._local.run = None
+            return None
+        run = Rerun(session)
+        state["_diag_run"] = run
+        self._local.run = run
+        return run
+
+    def section(self, name):
+        self._end_stmt()
+        run = getattr(self._local, "run", None)
+        if run is not None and not run.finished:
+            run.open(name)
+
+    def finish_rerun(self, state):
+        self._end_stmt()
+        run = getattr(self._local, "run", None)
+        self._local.run = None
+        if run is not None and not run.finished:
+            self._record(run)
+            state["_diag_last"] = run
+
+    def _record(self, run, interrupted=False):
+        run.finish(interrupted)
+        rec = run.as_dict()
+        with self._lock:
+            self.reruns.append(rec)
+            self._keep(self.slow_reruns, (rec["total_ms"], next(self._seq), rec))
+        if self.log_path:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec) + "\n")
+
+    # ---- reporting ----
+    def snapshot(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled, "statements": self.statements,
+                "slowest_queries": [r for _, _, r in sorted(self.slow, reverse=True)],
+                "slowest_reruns": [r for _, _, r in sorted(self.slow_reruns, key=lambda x: x[0], reverse=True)],
+                "recent_reruns": list(self.reruns),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.recent.clear()
+            self.slow.clear()
+            self.reruns.clear()
+            self.slow_reruns.clear()
+            self.statements = 0
+
+
+_profiler = Profiler()
+
+def profiler():
+    return _profiler
+
+def enable(log=None):
+    """Profile every current and future connection; log is a JSONL path or None."""
+    p = _profiler
+    p.log_path = log
+    if not p.enabled:
+        p.enabled = True
+        db.CONNECT_HOOKS.append(p.attach)
+        for con in db.open_connections():
+            p.attach(con)
+
+def disable():
+    p = _profiler
+    if p.enabled:
+        p.enabled = False
+        p.log_path = None
+        if p.attach in db.CONNECT_HOOKS:
+            db.CONNECT_HOOKS.remove(p.attach)
+        for con in db.open_connections():
+            p.detach(con)
+
+def enabled():
+    return _profiler.enabled
+
+def start_rerun(state, session=None):
+    return _profiler.start_rerun(state, session)
+
+def section(name):
+    _profiler.section(name)
+
+def finish_rerun(state):
+    _profiler.finish_rerun(state)
+
+
+if os.environ.get("DESK_PROFILE"):
+    enable(os.environ.get("DESK_PROFILE_LOG") or None)
@@ -0,0 +1,245 @@
+"""Background jobs for heavy work (PDF exports, reports).
+
+Jobs live in the jobs table of the client database and run on a
+process-wide thread pool, so they keep going across Streamlit reruns and
+sessions; the UI only stores a job id and polls. Submitting a request that
+is identical to a queued or running job returns that job instead of
+starting another one. Job bookkeeping writes use writer(bump=False) so
+they never invalidate cached client data.
+
+A job function is called as fn(job, **params) and returns the artifact
+path (or None). It reports through job.progress(fraction, message), which
+raises Cancelled once cancel() has been requested; with store=False the
+progress is only kept in memory (get() and recent() still show it), for
+jobs such as backups that must not commit to the database while they run.
+"""
+import datetime
+import json
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import migrations
+
+MAX_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+ARTIFACT_TTL_DAYS = 7
+ACTIVE = ("queued", "running")
+FINISHED = ("done", "failed", "cancelled")
+
+_kinds = {}
+
+
+class Cancelled(Exception):
+    pass
+
+
+def register(kind):
+    """Decorator registering fn as the handler for jobs of this kind."""
+    def deco(fn):
+        _kinds[kind] = fn
+        return fn
+    return deco
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+def artifact_dir(path=None):
+    d = db.sibling_path("_exports", path)
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+class Job:
+    """Handle passed to a running job function."""
+
+    def __init__(self, runner, job_id, cancel_event):
+        self.runner = runner
+        self.id = job_id
+        self._cancel = cancel_event
+        self._last = -1.0
+
+    def artifact_path(self, suffix):
+        return os.path.join(artifact_dir(self.runner.path), f"job-{self.id}{suffix}")
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def progress(self, fraction, message=None, store=True):
+        if self._cancel.is_set():
+            raise Cancelled()
+        fraction = max(0.0, min(1.0, float(fraction)))
+        if not store:
+            self.runner._live[self.id] = {"progress": fraction, **({"message": message} if message else {})}
+        # throttle status writes to whole percents
+        elif fraction - self._last >= 0.01 or message:
+            self._last = fraction
+            self.runner._update(self.id, progress=fraction, message=message)
+
+
+class JobRunner:
+    def __init__(self, path=None, max_workers=MAX_WORKERS):
+        self.path = path or db.DB
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._cancel = {}               # job id -> threading.Event
+        self._live = {}                 # job id -> progress reported with store=False
+        self._lock = threading.Lock()
+        migrations.ensure_current(self.path)
+        self._recover()
+
+    def _mgr(self):
+        return db.manager(self.path)
+
+    def _update(self, job_id, **fields):
+        cols = ", ".join(f"{k}=?" for k in fields)
+        with self._mgr().writer(bump=False) as con:
+            con.execute(f"UPDATE jobs SET {cols} WHERE id=?", (*fields.values(), job_id))
+
+    def _recover(self):
+        # jobs of a previous process cannot be resumed
+        with self._mgr().writer(bump=False) as con:
+            con.execute("""UPDATE jobs SET status='failed', error='interrupted by restart', finished_at=?
+                           WHERE status IN ('queued', 'running')""", (_now(),))
+        self.purge()
+
+    def purge(self, days=ARTIFACT_TTL_DAYS):
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat(timespec="seconds")
+        with self._mgr().writer(bump=False) as con:
+            old = con.execute("SELECT id, artifact FROM jobs WHERE status IN ('done', 'failed', 'cancelled') "
+                              "AND created_at < ?", (cutoff,)).fetchall()
+            con.executemany("DELETE FROM jobs WHERE id=?", [(i,) for i, _ in old])
+        for _, artifact in old:
+            if artifact and os.path.exists(artifact):
+                os.remove(artifact)
+        return len(old)
+
+    # ---- API ----
+    def submit(self, kind, **params):
+        """Queue a job, or return the id of an identical active one."""
+        if kind not in _kinds:
+            raise KeyError(f"unknown job kind {kind!r}")
+        blob = json.dumps(params, sort_keys=True, default=str)
+        key = f"{kind}:{blob}"
+        with self._lock:
+            with self._mgr().writer(bump=False) as con:
+                row = con.execute("SELECT id FROM jobs WHERE dedupe_key=? AND status IN ('queued', 'running')",
+                                  (key,)).fetchone()
+                if row:
+                    return row[0]
+                job_id = con.execute("INSERT INTO jobs (kind, params, dedupe_key, created_at) VALUES (?,?,?,?)",
+                                     (kind, blob, key, _now())).lastrowid
+            self._cancel[job_id] = threading.Event()
+        self._pool.submit(self._run, job_id, kind, params)
+        return job_id
+
+    def get(self, job_id):
+        con = self._mgr().reader()
+        cur = con.execute("SELECT * FROM jobs WHERE id=?", (job_id,))
+        row = cur.fetchone()
+        return self._overlay(dict(zip([d[0] for d in cur.description], row))) if row else None
+
+    def recent(self, limit=20):
+        con = self._mgr().reader()
+        cur = con.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+        cols = [d[0] for d in cur.description]
+        return [self._overlay(dict(zip(cols, r))) for r in cur.fetchall()]
+
+    def _overlay(self, job):
+        live = self._live.get(job["id"])
+        if live and job["status"] == "running":
+            job.update(live)
+        return job
+
+    def cancel(self, job_id):
+        ev = self._cancel.get(job_id)
+        if ev is not None:
+            ev.set()
+        with self._mgr().writer(bump=False) as con:
+            # a queued job never starts; a running one stops at its next progress()
+            con.execute("UPDATE jobs SET status='cancelled', finished_at=? WHERE id=? AND status='queued'",
+                        (_now(), job_id))
+
+    def shutdown(self, wait=True):
+        for ev in self._cancel.values():
+            ev.set()
+        self._pool.shutdown(wait=wait)
+
+    # ---- worker thread ----
+    def _run(self, job_id, kind, params):
+        ev = self._cancel[job_id]
+        try:
+            with self._mgr().writer(bump=False) as con:
+                started = con.execute("UPDATE jobs SET status='running', started_at=? WHERE id=? AND status='queued'",
+                                      (_now(), job_id)).rowcount
+            if not started or ev.is_set():
+                return
+            job = Job(self, job_id, ev)
+            artifact = _kinds[kind](job, **params)
+            self._update(job_id, status="done", progress=1.0, artifact=artifact, finished_at=_now())
+        except Cancelled:
+            self._update(job_id, status="cancelled", finished_at=_now())
+        except Exception as e:
+            self._update(job_id, status="failed", error=f"{e}\n{traceback.format_exc(limit=5)}",
+                         finished_at=_now())
+        finally:
+            self._cancel.pop(job_id, None)
+            self._live.pop(job_id, None)
+
+
+_runners = {}
+_runners_lock = threading.Lock()
+
+def runner(path=None):
+    """Process-wide JobRunner for path (shared across sessions)."""
+    path = path or db.DB
+    with _runners_lock:
+        r = _runners.get(path)
+        if r is None:
+            r = _runners[path] = JobRunner(path)
+        return r
+
+
+# ---------------- Job kinds ----------------
+@register("pdf_export")
+def pdf_export_job(job, workers=1, incremental=False, archived=False):
+    import pdf_export
+
+    target = job.artifact_path(".pdf")
+    cache = pdf_export.SectionCache(pdf_export.section_cache_dir(job.runner.path)) if incremental else None
+    try:
+        pdf_export.build_pdf(target, job.runner.path, workers=workers, cache=cache, archived=archived,
+                             progress=lambda done, total: job.progress(done / total if total else 1.0))
+    except BaseException:
+        if os.path.exists(target):
+            os.remove(target)
+        raise
+    finally:
+        if cache is not None:
+            cache.close()
+    if cache is not None:
+        sc = cache.last
+        job.progress(1.0, f"{sc['rendered']} sections rendered, {sc['reused']} reused")
+    return target
+
+@register("archive")
+def archive_job(job, horizon_days=None):
+    import archive
+
+    moved = archive.run(horizon_days, job.runner.path,
+                        progress=lambda done, total: job.progress(done / total if total else 1.0))
+    job.progress(1.0, f"Archived {moved['clients']} clients, {moved['hearings']} hearings, "
+                      f"{moved['payments']} payments")
+    return None
+
+@register("backup")
+def backup_job(job):
+    import backup
+
+    # a jobs-table commit during the copy would restart SQLite's online backup
+    made = backup.snapshot(job.runner.path,
+                           progress=lambda done, total: job.progress(done / total if total else 1.0, store=False))
+    pruned = backup.prune(job.runner.path)
+    job.progress(1.0, f"Saved {', '.join(m['name'] for m in made)}"
+                      + (f"; pruned {len(pruned)} old snapshot file(s)" if pruned else ""))
+    return None
@@ -0,0 +1,442 @@
+"""Numbered schema migrations keyed on PRAGMA user_version.
+
+Each migration runs exactly once per database, inside the writer
+transaction, and bumps user_version. ensure_current() is cheap to call on
+every Streamlit rerun: after the first successful check in a process it is
+a set lookup.
+
+    python migrations.py [db-path]          # print status
+    python migrations.py [db-path] --check  # exit 1 if migrations are pending
+    python migrations.py [db-path] --apply  # apply pending migrations
+"""
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+import db
+
+
+def table_columns(conn, table):
+    cur = conn.execute(f"PRAGMA table_info({table})")
+    return [r[1] for r in cur.fetchall()]
+
+def safe_alter(conn, table, col, coltype):
+    cols = table_columns(conn, table)
+    if col not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {coltype}")
+
+
+# ---------------- Migrations ----------------
+def m001_base_schema(con):
+    # Databases created before versioning already have (some of) this, so
+    # everything here must be idempotent.
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            case_details TEXT,
+            contact TEXT
+        )
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS hearings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            hearing_date DATE NOT NULL,
+            note TEXT,
+            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
+        )
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            pay_date DATE NOT NULL,
+            amount REAL NOT NULL,
+            mode TEXT,
+            note TEXT,
+            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
+        )
+    """)
+    safe_alter(con, "clients", "agreed_fee", "REAL DEFAULT 0")
+    safe_alter(con, "clients", "payment_status", "TEXT DEFAULT 'Unpaid'")
+    safe_alter(con, "clients", "commitment_date", "DATE")
+    safe_alter(con, "clients", "first_visit_date", "DATE")
+
+def m002_hot_path_indexes(con):
+    # per-client lookups (PDF sections, total_paid_for, cascade deletes)
+    con.execute("CREATE INDEX IF NOT EXISTS ix_hearings_client_date ON hearings(client_id, hearing_date)")
+    con.execute("CREATE INDEX IF NOT EXISTS ix_payments_client_date ON payments(client_id, pay_date, amount)")
+    # date-ordered history views and the upcoming-hearings banner
+    con.execute("CREATE INDEX IF NOT EXISTS ix_hearings_date ON hearings(hearing_date, client_id)")
+    con.execute("CREATE INDEX IF NOT EXISTS ix_payments_date ON payments(pay_date, client_id)")
+    con.execute("CREATE INDEX IF NOT EXISTS ix_clients_name ON clients(name COLLATE NOCASE)")
+    con.execute("ANALYZE")
+
+def m003_keyset_indexes(con):
+    # (date, rowid) order for keyset-paginated history pages; the rowid is
+    # implicit in a single-column index, so "ORDER BY date, id" needs no sort.
+    # Supersedes the (date, client_id) indexes from 002.
+    con.execute("DROP INDEX IF EXISTS ix_hearings_date")
+    con.execute("DROP INDEX IF EXISTS ix_payments_date")
+    con.execute("CREATE INDEX IF NOT EXISTS ix_hearings_date_id ON hearings(hearing_date)")
+    con.execute("CREATE INDEX IF NOT EXISTS ix_payments_date_id ON payments(pay_date)")
+    con.execute("ANALYZE")
+
+def m004_jobs(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL DEFAULT '{}',
+            dedupe_key TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            artifact TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    """)
+    # at most one queued/running job per identical request
+    con.execute("""CREATE UNIQUE INDEX IF NOT EXISTS ux_jobs_active ON jobs(dedupe_key)
+                   WHERE status IN ('queued', 'running')""")
+    con.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs(status, created_at)")
+
+BALANCE_SQL = """
+    SELECT c.id,
+           COALESCE(SUM(p.amount), 0),
+           MAX(0, COALESCE(c.agreed_fee, 0) - COALESCE(SUM(p.amount), 0)),
+           MAX(p.pay_date),
+           COUNT(p.id)
+    FROM clients c LEFT JOIN payments p ON p.client_id = c.id
+"""
+
+# NEW/OLD payment deltas; pending is always recomputed from agreed_fee
+PAY_IN = """
+    UPDATE client_balances SET
+        total_paid = total_paid + NEW.amount,
+        payment_count = payment_count + 1,
+        last_payment_date = CASE WHEN last_payment_date IS NULL OR NEW.pay_date > last_payment_date
+                                 THEN NEW.pay_date ELSE last_payment_date END,
+        pending = MAX(0, COALESCE((SELECT agreed_fee FROM clients WHERE id = NEW.client_id), 0)
+                         - (total_paid + NEW.amount))
+    WHERE client_id = NEW.client_id;
+"""
+
+def m005_client_balances(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS client_balances (
+            client_id INTEGER PRIMARY KEY,
+            total_paid REAL NOT NULL DEFAULT 0,
+            pending REAL NOT NULL DEFAULT 0,
+            last_payment_date DATE,
+            payment_count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS ix_balances_pending ON client_balances(pending DESC)")
+    pay_out = """
+        UPDATE client_balances SET
+            total_paid = total_paid - OLD.amount,
+            payment_count = payment_count - 1,
+            last_payment_date = (SELECT MAX(pay_date) FROM payments WHERE client_id = OLD.client_id),
+            pending = MAX(0, COALESCE((SELECT agreed_fee FROM clients WHERE id = OLD.client_id), 0)
+                             - (total_paid - OLD.amount))
+        WHERE client_id = OLD.client_id;
+    """
+    triggers = [
+        """CREATE TRIGGER IF NOT EXISTS trg_clients_balance_ins AFTER INSERT ON clients BEGIN
+               INSERT OR IGNORE INTO client_balances (client_id, total_paid, pending, payment_count)
+               VALUES (NEW.id, 0, MAX(0, COALESCE(NEW.agreed_fee, 0)), 0);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_clients_balance_fee AFTER UPDATE OF agreed_fee ON clients BEGIN
+               UPDATE client_balances SET pending = MAX(0, COALESCE(NEW.agreed_fee, 0) - total_paid)
+               WHERE client_id = NEW.id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_clients_balance_del AFTER DELETE ON clients BEGIN
+               DELETE FROM client_balances WHERE client_id = OLD.id;
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_payments_balance_ins AFTER INSERT ON payments BEGIN
+               {PAY_IN}
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_payments_balance_del AFTER DELETE ON payments BEGIN
+               {pay_out}
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_payments_balance_upd
+           AFTER UPDATE OF client_id, amount, pay_date ON payments BEGIN
+               {pay_out}
+               {PAY_IN}
+           END""",
+    ]
+    for sql in triggers:
+        con.execute(sql)
+    con.execute("DELETE FROM client_balances")
+    con.execute(f"INSERT INTO client_balances {BALANCE_SQL} GROUP BY c.id")
+
+# One FTS5 row per client (name/case_details/contact) and per non-empty
+# hearing or payment note. rowid = source id * 3 + kind, so triggers can
+# delete/replace a row by rowid instead of scanning the unindexed columns.
+SEARCH_SEED = [
+    """INSERT INTO search_index (rowid, name, case_details, contact, note, client_id, kind)
+       SELECT id * 3, name, case_details, contact, NULL, id, 'client' FROM clients""",
+    """INSERT INTO search_index (rowid, name, case_details, contact, note, client_id, kind)
+       SELECT id * 3 + 1, NULL, NULL, NULL, note, client_id, 'hearing' FROM hearings
+       WHERE COALESCE(note, '') <> ''""",
+    """INSERT INTO search_index (rowid, name, case_details, contact, note, client_id, kind)
+       SELECT id * 3 + 2, NULL, NULL, NULL, note, client_id, 'payment' FROM payments
+       WHERE COALESCE(note, '') <> ''""",
+]
+
+def m006_search_index(con):
+    con.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            name, case_details, contact, note,
+            client_id UNINDEXED, kind UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    # rank = bm25 weighted name > case details > contact > notes
+    con.execute("INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(10.0, 5.0, 3.0, 1.0)')")
+
+    def note_triggers(table, kind):
+        row = f"""INSERT INTO search_index (rowid, note, client_id, kind)
+                  SELECT NEW.id * 3 + {kind}, NEW.note, NEW.client_id, '{table[:-1]}'
+                  WHERE COALESCE(NEW.note, '') <> '';"""
+        drop = f"DELETE FROM search_index WHERE rowid = OLD.id * 3 + {kind};"
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS trg_{table}_search_ins AFTER INSERT ON {table} BEGIN {row} END",
+            f"CREATE TRIGGER IF NOT EXISTS trg_{table}_search_del AFTER DELETE ON {table} BEGIN {drop} END",
+            f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_search_upd
+                AFTER UPDATE OF note, client_id ON {table} BEGIN {drop} {row} END""",
+        ]
+
+    client_row = """INSERT INTO search_index (rowid, name, case_details, contact, client_id, kind)
+                    VALUES (NEW.id * 3, NEW.name, NEW.case_details, NEW.contact, NEW.id, 'client');"""
+    client_drop = "DELETE FROM search_index WHERE rowid = OLD.id * 3;"
+    triggers = [
+        f"CREATE TRIGGER IF NOT EXISTS trg_clients_search_ins AFTER INSERT ON clients BEGIN {client_row} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_clients_search_del AFTER DELETE ON clients BEGIN {client_drop} END",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_clients_search_upd
+            AFTER UPDATE OF name, case_details, contact ON clients BEGIN {client_drop} {client_row} END""",
+        *note_triggers("hearings", 1),
+        *note_triggers("payments", 2),
+    ]
+    for sql in triggers:
+        con.execute(sql)
+    con.execute("DELETE FROM search_index")
+    for sql in SEARCH_SEED:
+        con.execute(sql)
+
+# (table, column, nullable) for every stored date
+DATE_COLUMNS = [
+    ("hearings", "hearing_date", False),
+    ("payments", "pay_date", False),
+    ("clients", "commitment_date", True),
+    ("clients", "first_visit_date", True),
+]
+
+# what a legacy date may look like: ISO (str(date), maybe with a time part)
+# or day-first as typed elsewhere; anything else is rejected, not guessed at
+ISO_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}(?:[T ].*)?")
+DAY_FIRST_RE = re.compile(r"\d{1,2}[-/. ]+(?:\d{1,2}|[A-Za-z]{3,9})[-/., ]+\d{2,4}(?:[T ].*)?")
+
+def _parse_legacy_date(value):
+    # the written date counts; a time part (or zone) never moves it
+    import pandas as pd
+
+    text = str(value).strip()
+    if ISO_DATE_RE.fullmatch(text):
+        try:
+            return db.to_days(text)
+        except ValueError:
+            return None
+    if DAY_FIRST_RE.fullmatch(text):
+        ts = pd.to_datetime(text, dayfirst=True, errors="coerce")
+        return None if pd.isna(ts) else db.to_days(ts)
+    return None
+
+def m007_day_number_dates(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS date_rejects (
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            column_name TEXT NOT NULL,
+            original TEXT,
+            held_row TEXT
+        )
+    """)
+    for table, col, nullable in DATE_COLUMNS:
+        # the bulk -- real ISO dates, maybe with a time part -- converts in SQL;
+        # julianday() alone would also take '2024', 'now' or '2024-02-30', and
+        # date() only rolls a day past the month end over once given a modifier
+        iso = f"""typeof({col}) = 'text' AND {col} GLOB '[0-9][0-9][0-9][0-9]-[01][0-9]-[0-3][0-9]*'
+                  AND date({col}, '+0 days') = substr({col}, 1, 10)"""
+        # everything else is parsed here, numbers included: DATE affinity
+        # stored text like '2024' as an integer, and no writer used day numbers yet;
+        # IS NOT 1 because date() gives NULL for '2024-03-01junk'
+        fixed, rejects = [], []
+        cur = con.execute(f"""SELECT id, {col}, * FROM {table}
+                              WHERE {col} IS NOT NULL AND ({iso}) IS NOT 1""")
+        names = [d[0] for d in cur.description][2:]
+        for row_id, value, *row in cur.fetchall():
+            days = _parse_legacy_date(value)
+            if days is not None:
+                fixed.append((days, row_id))
+            elif nullable:
+                rejects.append((table, row_id, col, str(value), None))
+                fixed.append((None, row_id))
+            else:
+                # a made-up date would put the row in history, reports and the
+                # archive; it waits in date_rejects until db.fix_date_reject()
+                rejects.append((table, row_id, col, str(value), json.dumps(dict(zip(names, row)))))
+        con.execute(f"""UPDATE {table} SET {col} = CAST(julianday(substr({col}, 1, 10)) - 2440587.5 AS INTEGER)
+                        WHERE {iso}""")
+        con.executemany(f"UPDATE {table} SET {col} = ? WHERE id = ?", fixed)
+        con.executemany("INSERT INTO date_rejects VALUES (?,?,?,?,?)", rejects)
+        con.executemany(f"DELETE FROM {table} WHERE id = ?", [(r[1],) for r in rejects if r[4] is not None])
+    # only day numbers (or NULL where allowed) get in from now on
+    for table, col, nullable in DATE_COLUMNS:
+        bad = f"typeof(NEW.{col}) <> 'integer'"
+        if nullable:
+            bad = f"NEW.{col} IS NOT NULL AND {bad}"
+        for event in ("INSERT", f"UPDATE OF {col}"):
+            name = f"trg_{table}_{col}_{event.split()[0].lower()}_chk"
+            con.execute(f"""CREATE TRIGGER IF NOT EXISTS {name} BEFORE {event} ON {table}
+                            WHEN {bad} BEGIN
+                                SELECT RAISE(ABORT, '{table}.{col} must be a day number (see db.to_days)');
+                            END""")
+    # last_payment_date was maintained on the old text values
+    con.execute("DELETE FROM client_balances")
+    con.execute(f"INSERT INTO client_balances {BALANCE_SQL} GROUP BY c.id")
+    con.execute("ANALYZE")
+
+# client_balances from migration 8 on: hot payments plus the totals carried
+# forward for payments moved to the archive file (archive.py)
+LEDGER_SQL = """
+    SELECT c.id,
+           COALESCE(SUM(p.amount), 0) + COALESCE(a.total_paid, 0),
+           MAX(0, COALESCE(c.agreed_fee, 0) - COALESCE(SUM(p.amount), 0) - COALESCE(a.total_paid, 0)),
+           COALESCE(MAX(MAX(p.pay_date), a.last_payment_date), MAX(p.pay_date), a.last_payment_date),
+           COUNT(p.id) + COALESCE(a.payment_count, 0)
+    FROM clients c LEFT JOIN archived_payment_totals a ON a.client_id = c.id
+                   LEFT JOIN payments p ON p.client_id = c.id
+"""
+
+def m008_archived_payment_totals(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS archived_payment_totals (
+            client_id INTEGER PRIMARY KEY,
+            total_paid REAL NOT NULL DEFAULT 0,
+            payment_count INTEGER NOT NULL DEFAULT 0,
+            last_payment_date DATE
+        )
+    """)
+    con.execute("""CREATE TRIGGER IF NOT EXISTS trg_clients_archived_totals_del AFTER DELETE ON clients BEGIN
+                       DELETE FROM archived_payment_totals WHERE client_id = OLD.id;
+                   END""")
+    # removing a hot payment falls back to the archived last payment date
+    pay_out = """
+        UPDATE client_balances SET
+            total_paid = total_paid - OLD.amount,
+            payment_count = payment_count - 1,
+            last_payment_date = (SELECT MAX(d) FROM (
+                SELECT MAX(pay_date) AS d FROM payments WHERE client_id = OLD.client_id
+                UNION ALL
+                SELECT last_payment_date FROM archived_payment_totals WHERE client_id = OLD.client_id)),
+            pending = MAX(0, COALESCE((SELECT agreed_fee FROM clients WHERE id = OLD.client_id), 0)
+                             - (total_paid - OLD.amount))
+        WHERE client_id = OLD.client_id;
+    """
+    con.execute("DROP TRIGGER IF EXISTS trg_payments_balance_del")
+    con.execute("DROP TRIGGER IF EXISTS trg_payments_balance_upd")
+    con.execute(f"""CREATE TRIGGER trg_payments_balance_del AFTER DELETE ON payments BEGIN
+                        {pay_out}
+                    END""")
+    con.execute(f"""CREATE TRIGGER trg_payments_balance_upd
+                    AFTER UPDATE OF client_id, amount, pay_date ON payments BEGIN
+                        {pay_out}
+                        {PAY_IN}
+                    END""")
+
+# (version, description, function) -- append only, never renumber
+MIGRATIONS = [
+    (1, "base schema", m001_base_schema),
+    (2, "indexes on client_id/date for hearings and payments", m002_hot_path_indexes),
+    (3, "date+id indexes for keyset-paginated history", m003_keyset_indexes),
+    (4, "background job table", m004_jobs),
+    (5, "trigger-maintained client_balances ledger", m005_client_balances),
+    (6, "FTS5 search index over clients and notes", m006_search_index),
+    (7, "dates stored as integer day numbers", m007_day_number_dates),
+    (8, "ledger carries totals of archived payments", m008_archived_payment_totals),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+# ---------------- Runner ----------------
+_current = set()
+_lock = threading.Lock()
+
+def user_version(con):
+    return con.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(mgr):
+    """Apply pending migrations through mgr's writer; returns versions applied."""
+    applied = []
+    with mgr.writer() as con:
+        version = user_version(con)
+        for number, _, fn in MIGRATIONS:
+            if number <= version:
+                continue
+            fn(con)
+            con.execute(f"PRAGMA user_version = {number}")
+            applied.append(number)
+    return applied
+
+def ensure_current(path=None):
+    """Migrate path once per process."""
+    path = path or db.DB
+    if path in _current:
+        return
+    with _lock:
+        if path not in _current:
+            migrate(db.manager(path))
+            _current.add(path)
+
+def status(path=None):
+    """Schema status read without writing to (or creating) the database."""
+    path = path or db.DB
+    version = 0
+    if os.path.exists(path):
+        con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            version = user_version(con)
+        finally:
+            con.close()
+    pending = [(n, desc) for n, desc, _ in MIGRATIONS if n > version]
+    return {
+        "path": path,
+        "version": version,
+        "latest": LATEST,
+        "current": not pending,
+        "pending": pending,
+    }
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    path = args[0] if args else db.DB
+    if "--apply" in sys.argv:
+        print("applied:", migrate(db.manager(path)) or "nothing")
+    st = status(path)
+    print(f"{st['path']}: schema v{st['version']} (latest v{st['latest']})")
+    for n, desc in st["pending"]:
+        print(f"  pending {n:03d}: {desc}")
+    if "--check" in sys.argv and not st["current"]:
+        sys.exit(1)
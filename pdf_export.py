@@ -0,0 +1,591 @@
+"""Streaming PDF export of the client database.
+
+Clients, hearings and payments are read with three cursors that share one
+order (client name, then id), so every client's rows arrive together and
+are merge-joined in a single pass -- no per-client queries and no
+clients x hearings scan. Flowables are generated per client section and
+handed to ReportLab through LazyStory, which only keeps a small window of
+them in memory; the PDF is written to a file or a spooled temp file.
+
+With workers > 1 the client sections are split into contiguous shards,
+rendered to separate PDFs in a process pool and merged in name order
+behind the summary. Every client section starts on a new page, so the
+merged document paginates exactly like the serial one.
+
+The same page-merge lets an incremental export reuse rendered client
+sections from an on-disk SectionCache keyed on a hash of each client's
+rows, so only clients whose data changed are rendered again.
+
+ReportLab is imported on first use (see _reportlab()), so importing this
+module from the UI, a job runner or a script costs nothing until a PDF is
+actually rendered.
+"""
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import chain
+from xml.sax.saxutils import escape
+
+import archive
+import db
+
+try:
+    import fcntl
+except ImportError:           # no flock (Windows): only exports in this process see each other
+    fcntl = None
+
+SPOOL_MAX = 8 * 1024 * 1024   # keep PDFs up to 8 MB in memory, then spill to disk
+LOW_WATER = 64                # flowables buffered ahead of the layout engine
+BRIEF_CHUNK = 1000            # summary rows per Table flowable
+SHARD_ROWS = 4000             # clients + hearings + payments per parallel shard
+WORKERS = int(os.environ.get("PDF_WORKERS", "1"))
+SECTION_VERSION = 2           # bump when client_section() output changes
+SECTION_CACHE_MAX = int(os.environ.get("PDF_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+CLIENT_ORDER = "c.name COLLATE NOCASE, c.id"
+CLIENT_FIELDS = ("id", "name", "case_details", "contact", "first_visit_date",
+                 "agreed_fee", "payment_status", "commitment_date", "total_paid", "pending")
+
+BRIEF_HEADER = ["Client","Case","Contact","First Visit","Agreed Fee","Paid","Pending","Status","Commitment"]
+BRIEF_STYLE = DETAIL_STYLE = None   # TableStyles, set by _reportlab()
+
+_styles = None
+
+def _reportlab():
+    """Import ReportLab into this module's namespace on first use."""
+    global A4, PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, BRIEF_STYLE, DETAIL_STYLE
+    if BRIEF_STYLE is not None:
+        return
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    DETAIL_STYLE = TableStyle([
+        ('BACKGROUND',(0,0),(-1,0),colors.lightgrey),
+        ('FONTNAME',(0,0),(-1,0),'Helvetica-Bold'),
+        ('GRID',(0,0),(-1,-1),0.25,colors.grey),
+    ])
+    BRIEF_STYLE = TableStyle([
+        ('BACKGROUND',(0,0),(-1,0),colors.lightblue),
+        ('TEXTCOLOR',(0,0),(-1,0),colors.white),
+        ('FONTNAME',(0,0),(-1,0),'Helvetica-Bold'),
+        ('GRID',(0,0),(-1,-1),0.25,colors.grey),
+        ('ROWBACKGROUNDS',(0,1),(-1,-1),[colors.whitesmoke, colors.lightgrey]),
+    ])
+
+def styles():
+    global _styles
+    if _styles is None:
+        _reportlab()
+        from reportlab.lib.styles import getSampleStyleSheet
+        _styles = getSampleStyleSheet()
+    return _styles
+
+
+# ---------------- Formatting ----------------
+def fmt_date(value):
+    # day numbers straight from the cursor, or a date
+    d = db.as_date(value)
+    return d.strftime("%d-%b-%Y") if d else ""
+
+def iso_date(value):
+    d = db.as_date(value)
+    return d.isoformat() if d else ""
+
+def money(value):
+    return f"₹{float(value or 0):,.0f}"
+
+def _p(text, style):
+    style = styles()[style]     # loads ReportLab before Paragraph is looked up
+    return Paragraph(escape(str(text)), style)
+
+
+# ---------------- Ordered reads ----------------
+# With archived=True the snapshot has the archive file attached (archive.py)
+# and every read is a UNION ALL of hot and archived rows in the same order.
+def client_rows(con, archived=False):
+    # paid/pending come precomputed from the client_balances ledger; archived
+    # clients keep the balance they were moved with
+    cols = ", ".join(f"COALESCE(b.{f}, 0) AS {f}" if f in ("total_paid", "pending") else f"c.{f}"
+                     for f in CLIENT_FIELDS)
+    sql = f"SELECT {cols} FROM clients c LEFT JOIN client_balances b ON b.client_id=c.id"
+    if archived:
+        sql = f"SELECT * FROM ({sql} UNION ALL SELECT {', '.join(CLIENT_FIELDS)} FROM {archive.ALIAS}.clients) c"
+    cur = con.execute(f"{sql} ORDER BY {CLIENT_ORDER}")
+    for row in cur:
+        yield dict(zip(CLIENT_FIELDS, row))
+
+def _sources(table, archived):
+    if not archived:
+        return f"clients c JOIN {table}"
+    return (f"{archive.union('clients', 'id, name')} c "
+            f"JOIN {archive.union(table, db.HISTORY_COLUMNS[table])}")
+
+def _hearing_rows(con, archived=False):
+    return con.execute(f"""SELECT h.client_id, h.hearing_date, h.note
+                           FROM {_sources('hearings', archived)} h ON h.client_id=c.id
+                           ORDER BY {CLIENT_ORDER}, h.hearing_date, h.id""")
+
+def _payment_rows(con, archived=False):
+    return con.execute(f"""SELECT p.client_id, p.pay_date, p.amount, p.mode, p.note
+                           FROM {_sources('payments', archived)} p ON p.client_id=c.id
+                           ORDER BY {CLIENT_ORDER}, p.pay_date DESC, p.id DESC""")
+
+class _Grouper:
+    """Hands out consecutive rows of an ordered cursor, one client at a time."""
+
+    def __init__(self, cursor):
+        self._it = iter(cursor)
+        self._head = next(self._it, None)
+
+    def take(self, cid):
+        rows = []
+        while self._head is not None and self._head[0] == cid:
+            rows.append(self._head[1:])
+            self._head = next(self._it, None)
+        return rows
+
+def iter_clients(con, archived=False):
+    """Yield (client, hearings, payments) per client in name order."""
+    hearings = _Grouper(_hearing_rows(con, archived))
+    payments = _Grouper(_payment_rows(con, archived))
+    for client in client_rows(con, archived):
+        yield client, hearings.take(client["id"]), payments.take(client["id"])
+
+
+# ---------------- Flowables ----------------
+def title_flowables(generated=None):
+    generated = generated or datetime.datetime.now()
+    return [
+        _p("Advocate Client Database", 'Title'),
+        _p(f"Generated: {generated.strftime('%d-%b-%Y %H:%M')}", 'Normal'),
+        Spacer(1, 12),
+    ]
+
+def brief_row(c):
+    return [
+        c["name"] or "",
+        c["case_details"] or "",
+        c["contact"] or "",
+        iso_date(c["first_visit_date"]),
+        money(c["agreed_fee"]),
+        money(c["total_paid"]),
+        money(c["pending"]),
+        c["payment_status"] or "",
+        iso_date(c["commitment_date"]),
+    ]
+
+def brief_flowables(rows):
+    """Summary table over brief_row() rows, in BRIEF_CHUNK-row tables."""
+    chunk = []
+    any_rows = False
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == BRIEF_CHUNK:
+            yield _brief_table(chunk)
+            chunk, any_rows = [], True
+    if chunk:
+        yield _brief_table(chunk)
+        any_rows = True
+    if any_rows:
+        yield PageBreak()
+
+def _brief_table(rows):
+    _reportlab()
+    t = Table([BRIEF_HEADER] + rows, repeatRows=1)
+    t.setStyle(BRIEF_STYLE)
+    return t
+
+def client_section(c, hearings, payments):
+    """Flowables for one client's page(s); hearings/payments are row tuples
+    (date, note) and (date, amount, mode, note)."""
+    out = [
+        _p(f"Client: {c['name'] or ''}", 'Heading2'),
+        _p(f"Case: {c['case_details'] or ''}", 'Normal'),
+        _p(f"Contact: {c['contact'] or ''}", 'Normal'),
+        _p(f"First Visit: {iso_date(c['first_visit_date'])}", 'Normal'),
+        _p(f"Agreed Fee: {money(c['agreed_fee'])} | Paid: {money(c['total_paid'])} | "
+           f"Pending: {money(c['pending'])} | Status: {c['payment_status'] or ''} | "
+           f"Commitment: {iso_date(c['commitment_date'])}", 'Normal'),
+        Spacer(1, 8),
+        _p("Hearings", 'Heading3'),
+    ]
+    if not hearings:
+        out.append(_p("— No hearings recorded —", 'Italic'))
+    else:
+        t = Table([["Date","Note"]] + [[fmt_date(d), n or ""] for d, n in hearings],
+                  repeatRows=1, colWidths=[90, 380])
+        t.setStyle(DETAIL_STYLE)
+        out.append(t)
+    out += [Spacer(1, 8), _p("Payments", 'Heading3')]
+    if not payments:
+        out.append(_p("— No payments recorded —", 'Italic'))
+    else:
+        t = Table([["Date","Amount","Mode","Note"]] +
+                  [[fmt_date(d), money(a), m or "", n or ""] for d, a, m, n in payments],
+                  repeatRows=1, colWidths=[90, 80, 80, 220])
+        t.setStyle(DETAIL_STYLE)
+        out.append(t)
+    out += [Spacer(1, 16), PageBreak()]
+    return out
+
+def story(con, generated=None, progress=None, archived=False):
+    yield from title_flowables(generated)
+    yield from brief_flowables(map(brief_row, client_rows(con, archived)))
+    for c, hs, ps in _reporting(con, iter_clients(con, archived), progress, archived):
+        yield from client_section(c, hs, ps)
+
+def _reporting(con, items, progress, archived=False):
+    # progress(done, total) per client; it may raise to abort the export
+    if progress is None:
+        yield from items
+        return
+    total = con.execute("SELECT COUNT(*) FROM clients").fetchone()[0]
+    if archived:
+        total += con.execute(f"SELECT COUNT(*) FROM {archive.ALIAS}.clients").fetchone()[0]
+    progress(0, total)
+    for n, item in enumerate(items, 1):
+        yield item
+        progress(n, total)
+
+
+# ---------------- Build ----------------
+class LazyStory(list):
+    """A story list that refills itself from a generator.
+
+    SimpleDocTemplate.build() checks len() before consuming each flowable,
+    so topping the buffer up there keeps only ~low_water flowables alive.
+    """
+
+    def __init__(self, source, low_water=LOW_WATER):
+        super().__init__()
+        self._source = iter(source)
+        self._low = low_water
+
+    def __len__(self):
+        n = super().__len__()
+        while n < self._low and self._source is not None:
+            f = next(self._source, None)
+            if f is None:
+                self._source = None
+                break
+            self.append(f)
+            n += 1
+        return n
+
+def new_doc(out):
+    _reportlab()
+    return SimpleDocTemplate(out, pagesize=A4, leftMargin=24, rightMargin=24, topMargin=36, bottomMargin=24)
+
+def build_pdf(out=None, path=None, workers=None, generated=None, cache=None, progress=None, archived=False):
+    """Write the full client database PDF to out (path or binary file).
+
+    Returns out, rewound if it is a file object; by default a spooled temp
+    file that stays in memory up to SPOOL_MAX. workers > 1 renders in a
+    process pool (default: PDF_WORKERS env, 1 = serial); with a
+    SectionCache only changed client sections are rendered. progress is
+    called as progress(clients_done, clients_total). archived=True also
+    exports the clients and history in the archive file.
+
+    Only the default serial path streams in bounded memory. The parallel
+    and incremental paths merge part files with pypdf, which holds the
+    whole merged document in memory before writing it.
+    """
+    workers = WORKERS if workers is None else workers
+    if out is None:
+        out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX)
+    attach = archive.attachments(path) if archived else {}
+    if workers > 1 or cache is not None:
+        _build_parts(out, path, workers, generated, cache, progress, attach)
+    else:
+        with db.manager(path).snapshot(attach) as con:
+            new_doc(out).build(LazyStory(story(con, generated, progress, bool(attach))))
+    if hasattr(out, "seek"):
+        out.seek(0)
+    return out
+
+
+# ---------------- Cause list ----------------
+def build_cause_list(out, day, rows, generated=None):
+    """Cause list for day, one table per court/stage note; rows are db.cause_list() records."""
+    generated = generated or datetime.datetime.now()
+    flow = [_p(f"Cause List — {fmt_date(day)}", 'Title'),
+            _p(f"{len(rows)} matter(s) · generated {generated.strftime('%d-%b-%Y %H:%M')}", 'Normal'),
+            Spacer(1, 12)]
+    if not rows:
+        flow.append(_p("— No matters listed —", 'Italic'))
+    court, table = None, []
+    for r in rows + [None]:
+        key = None if r is None else ((r["note"] or "").strip() or "Unspecified")
+        if table and (r is None or key != court):
+            t = Table([["#", "Client", "Case", "Contact"]] + table, repeatRows=1, colWidths=[24, 150, 220, 90])
+            t.setStyle(DETAIL_STYLE)
+            flow += [_p(court, 'Heading3'), t, Spacer(1, 10)]
+            table = []
+        if r is not None:
+            court = key
+            table.append([str(len(table) + 1), _p(r["name"] or "", 'Normal'),
+                          _p(r["case_details"] or "", 'Normal'), r["contact"] or ""])
+    new_doc(out).build(flow)
+    return out
+
+
+# ---------------- Section cache ----------------
+def section_cache_dir(path=None):
+    return db.sibling_path("_pdf_cache", path)
+
+_holders = {}                 # cache directory -> exports holding it (without fcntl)
+_holders_lock = threading.Lock()
+
+class SectionCache:
+    """Rendered per-client section PDFs on disk, keyed by a content hash.
+
+    The key covers the client row and all of its hearings and payments, so
+    any edit -- including a delete_client cascade -- simply misses. After
+    each export, entries the export did not use are dropped, then the
+    least recently used are evicted down to max_bytes.
+
+    Exports may share the directory (two jobs, or the UI next to a nightly
+    cli.py run): each holds a shared lock from its first get() until
+    finish(), and finish() only prunes when it can take the lock
+    exclusively, so no export loses a file it has yet to merge.
+    """
+
+    def __init__(self, directory=None, max_bytes=SECTION_CACHE_MAX):
+        self.directory = directory or section_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._index = sqlite3.connect(os.path.join(self.directory, "index.db"),
+                                      check_same_thread=False, isolation_level=None)
+        self._index.execute("""CREATE TABLE IF NOT EXISTS sections (
+                                   key TEXT PRIMARY KEY, client_id INTEGER,
+                                   bytes INTEGER, used_at REAL)""")
+        self._lockfile = None
+        self._held = False
+        self.last = {}
+
+    # ---- sharing the directory ----
+    def _hold(self):
+        if self._held:
+            return
+        if fcntl is not None:
+            self._lockfile = open(os.path.join(self.directory, "lock"), "a+")
+            fcntl.flock(self._lockfile, fcntl.LOCK_SH)
+        else:
+            with _holders_lock:
+                _holders[self.directory] = _holders.get(self.directory, 0) + 1
+        self._held = True
+
+    def _alone(self):
+        """True when no other export holds the directory (and, with fcntl, keep it exclusive)."""
+        if fcntl is not None:
+            if self._lockfile is None:
+                self._lockfile = open(os.path.join(self.directory, "lock"), "a+")
+            try:
+                fcntl.flock(self._lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except OSError:
+                return False
+        with _holders_lock:
+            return _holders.get(self.directory, 0) <= int(self._held)
+
+    def _release(self):
+        if self._lockfile is not None:
+            self._lockfile.close()          # drops the flock
+            self._lockfile = None
+        elif self._held:
+            with _holders_lock:
+                _holders[self.directory] -= 1
+        self._held = False
+
+    @staticmethod
+    def key(client, hearings, payments):
+        blob = json.dumps([SECTION_VERSION, client, hearings, payments], default=str, ensure_ascii=False)
+        return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pdf")
+
+    def get(self, key):
+        self._hold()
+        p = self.path(key)
+        return p if os.path.exists(p) else None
+
+    def put(self, key, client_id, rendered):
+        p = self.path(key)
+        shutil.move(rendered, p)
+        self._index.execute("INSERT OR REPLACE INTO sections VALUES (?,?,?,?)",
+                            (key, client_id, os.path.getsize(p), time.time()))
+        return p
+
+    def finish(self, used, rendered):
+        """Record one export's usage; prune unused entries and evict to size.
+
+        Pruning is skipped (left to a later export) while another export
+        still holds the directory.
+        """
+        idx = self._index
+        now = time.time()
+        try:
+            alone = self._alone()
+            idx.execute("BEGIN IMMEDIATE")
+            idx.execute("CREATE TEMP TABLE IF NOT EXISTS used (key TEXT PRIMARY KEY)")
+            idx.execute("DELETE FROM used")
+            idx.executemany("INSERT OR IGNORE INTO used VALUES (?)", ((k,) for k in used))
+            idx.execute("UPDATE sections SET used_at=? WHERE key IN (SELECT key FROM used)", (now,))
+            stale, evict, kept = [], [], 0
+            if alone:
+                stale = [k for (k,) in idx.execute("SELECT key FROM sections WHERE key NOT IN (SELECT key FROM used)")]
+            for k, size in idx.execute("SELECT key, bytes FROM sections WHERE key IN (SELECT key FROM used) "
+                                       "ORDER BY used_at DESC, key"):
+                if kept + size > self.max_bytes and alone:
+                    evict.append(k)
+                else:
+                    kept += size
+            for k in stale + evict:
+                idx.execute("DELETE FROM sections WHERE key=?", (k,))
+                try:
+                    os.remove(self.path(k))
+                except FileNotFoundError:
+                    pass
+            idx.execute("COMMIT")
+        finally:
+            self._release()
+        self.last = {"sections": len(used), "rendered": rendered, "reused": len(used) - rendered,
+                     "pruned": len(stale), "evicted": len(evict), "bytes": kept, "shared": not alone}
+        return self.last
+
+    def clear(self):
+        self.finish([], 0)
+
+    def close(self):
+        self._release()
+        self._index.close()
+
+
+# ---------------- Parts: parallel and incremental ----------------
+def _render_part(target, sections=None, brief=None, generated=None):
+    # runs in a worker process; sections are (client, hearings, payments)
+    if brief is not None:
+        flow = chain(title_flowables(generated), brief_flowables(brief))
+    else:
+        flow = chain.from_iterable(client_section(*s) for s in sections)
+    new_doc(target).build(LazyStory(flow))
+    return target
+
+def _shards(clients, limit=SHARD_ROWS):
+    shard, rows = [], 0
+    for c, hs, ps in clients:
+        shard.append((c, hs, ps))
+        rows += 1 + len(hs) + len(ps)
+        if rows >= limit:
+            yield shard
+            shard, rows = [], 0
+    if shard:
+        yield shard
+
+class _Inline:
+    """Executor stand-in that runs work in the calling thread."""
+
+    def submit(self, fn, *args, **kwargs):
+        f = Future()
+        f.set_result(fn(*args, **kwargs))
+        return f
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def _ready(value):
+    f = Future()
+    f.set_result(value)
+    return f
+
+def _build_parts(out, path, workers, generated, cache, progress=None, attach=None):
+    from pypdf import PdfWriter
+
+    generated = generated or datetime.datetime.now()
+    # spawn, not fork: the Streamlit server process is multi-threaded
+    pool = (ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            if workers > 1 else _Inline())
+    with tempfile.TemporaryDirectory(prefix="pdfparts-") as tmp, pool, \
+         db.manager(path).snapshot(attach) as con:
+        archived = bool(attach)
+        parts = []
+        misses, used = {}, []
+        inflight = deque()
+        clients = _reporting(con, iter_clients(con, archived), progress, archived)
+        if cache is None:
+            units = ((None, shard) for shard in _shards(clients))
+        else:
+            units = ((SectionCache.key(*s), [s]) for s in clients)
+        for n, (key, sections) in enumerate(units):
+            if key is not None:
+                used.append(key)
+                hit = cache.get(key)
+                if hit:
+                    parts.append(_ready(hit))
+                    continue
+            # bound the sections held in memory / queued for pickling
+            while len(inflight) >= 2 * workers:
+                inflight.popleft().result()
+            f = pool.submit(_render_part, os.path.join(tmp, f"p{n:06d}.pdf"), sections=sections)
+            if key is not None:
+                misses[f] = (key, sections[0][0]["id"])
+            parts.append(f)
+            inflight.append(f)
+        # the summary streams from its own cursor while the pool finishes
+        head = _render_part(os.path.join(tmp, "head.pdf"), brief=map(brief_row, client_rows(con, archived)),
+                            generated=generated)
+        files = [head]
+        for f in parts:
+            target = f.result()
+            if f in misses:
+                key, cid = misses[f]
+                target = cache.put(key, cid, target)
+            files.append(target)
+        merged = PdfWriter()
+        for f in files:
+            merged.append(f)
+        merged.write(out)
+    if cache is not None:
+        cache.finish(used, len(misses))
+
+def timing_comparison(workers=None, path=None):
+    """Build the export serially and in parallel; report times and whether
+    the two documents have the same pages and text."""
+    from pypdf import PdfReader
+
+    workers = workers or os.cpu_count() or 2
+    generated = datetime.datetime.now()
+    result = {"workers": workers}
+    with tempfile.TemporaryDirectory() as tmp:
+        docs = {}
+        for label, n in (("serial", 1), ("parallel", workers)):
+            target = os.path.join(tmp, f"{label}.pdf")
+            t0 = time.perf_counter()
+            build_pdf(target, path, workers=n, generated=generated)
+            result[f"{label}_s"] = round(time.perf_counter() - t0, 3)
+            docs[label] = [p.extract_text() for p in PdfReader(target).pages]
+    result["pages"] = len(docs["serial"])
+    result["speedup"] = round(result["serial_s"] / result["parallel_s"], 2) if result["parallel_s"] else None
+    result["identical"] = docs["serial"] == docs["parallel"]
+    return result
+
+
+if __name__ == "__main__":
+    # python pdf_export.py [workers] [db-path] -- serial vs parallel timing
+    import sys
+    args = sys.argv[1:]
+    print(json.dumps(timing_comparison(int(args[0]) if args else None, args[1] if len(args) > 1 else None), indent=2))
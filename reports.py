@@ -0,0 +1,92 @@
+"""Receivables, collections and hearing-load reports.
+
+build() gathers, for one as-of day:
+
+  * aging / debtors -- pending dues bucketed by days past commitment_date
+    (db.aging_report);
+  * collections -- payments per month and mode over the last MONTHS months
+    (db.collections_report);
+  * hearings_by_week / hearings_by_court -- listings from WEEKS_BACK weeks
+    before to WEEKS_AHEAD weeks after the as-of week, court taken from the
+    hearing note (db.hearing_load).
+
+The frames are Arrow-backed and come from the query cache, so the
+dashboard card costs nothing between writes. to_excel() writes one sheet
+per frame, write_csv() one file per frame.
+
+    python cli.py report [--as-of YYYY-MM-DD] [--format xlsx|csv] [--out-dir DIR]
+"""
+import datetime
+import io
+import os
+
+import pandas as pd
+
+import db
+
+MONTHS = int(os.environ.get("REPORT_MONTHS", "12"))
+WEEKS_BACK = int(os.environ.get("REPORT_WEEKS_BACK", "4"))
+WEEKS_AHEAD = int(os.environ.get("REPORT_WEEKS_AHEAD", "8"))
+DEBTORS_PER_BUCKET = 25
+
+SHEETS = {                # frame -> sheet title
+    "aging": "Aging",
+    "debtors": "Debtors",
+    "collections": "Collections",
+    "hearings_by_week": "Hearings per week",
+    "hearings_by_court": "Hearings per court",
+}
+
+
+def collection_period(as_of, months=MONTHS):
+    """First day of the month months-1 back, through as_of."""
+    first = as_of.replace(day=1)
+    for _ in range(months - 1):
+        first = (first - datetime.timedelta(days=1)).replace(day=1)
+    return first, as_of
+
+def hearing_period(as_of, weeks_back=WEEKS_BACK, weeks_ahead=WEEKS_AHEAD):
+    """Monday weeks_back weeks before the as-of week to the Sunday weeks_ahead weeks after it."""
+    monday = db.week_start(as_of)
+    return monday - datetime.timedelta(weeks=weeks_back), monday + datetime.timedelta(weeks=weeks_ahead + 1, days=-1)
+
+def build(as_of=None, months=MONTHS, weeks_back=WEEKS_BACK, weeks_ahead=WEEKS_AHEAD, archived=False):
+    """All report frames for one day, plus the periods they cover."""
+    as_of = as_of or datetime.date.today()
+    pay_from, pay_to = collection_period(as_of, months)
+    hear_from, hear_to = hearing_period(as_of, weeks_back, weeks_ahead)
+    aging, debtors = db.aging_report(as_of, DEBTORS_PER_BUCKET)
+    by_week, by_court = db.hearing_load(hear_from, hear_to, archived)
+    return {
+        "as_of": as_of,
+        "periods": {"collections": (pay_from, pay_to), "hearings": (hear_from, hear_to)},
+        "aging": aging,
+        "debtors": debtors,
+        "collections": db.collections_report(pay_from, pay_to, archived),
+        "hearings_by_week": by_week,
+        "hearings_by_court": by_court,
+    }
+
+def _about(report):
+    rows = [("As of", str(report["as_of"]))]
+    rows += [(name.title(), f"{lo} to {hi}") for name, (lo, hi) in report["periods"].items()]
+    rows.append(("Generated", datetime.datetime.now().isoformat(sep=" ", timespec="seconds")))
+    return pd.DataFrame(rows, columns=["Report", "Value"])
+
+def to_excel(report, target=None):
+    """Write the report as a workbook to target (a path); without one, return the bytes."""
+    out = target or io.BytesIO()
+    with pd.ExcelWriter(out, engine="openpyxl") as xl:
+        _about(report).to_excel(xl, sheet_name="Report", index=False)
+        for key, title in SHEETS.items():
+            report[key].to_excel(xl, sheet_name=title, index=False)
+    return target or out.getvalue()
+
+def write_csv(report, out_dir=None):
+    """One CSV per frame; returns the files written."""
+    written = []
+    for key in SHEETS:
+        target = os.path.join(out_dir or ".", f"{key}_{report['as_of']}.csv")
+        report[key].to_csv(target, index=False)
+        written.append(target)
+    return written
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# the modules live flat in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A fresh, migrated client database made the default for the test."""
+    path = str(tmp_path / "clients.db")
+    monkeypatch.setattr(db, "DB", path)
+    db.init_db()
+    return path
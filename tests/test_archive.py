@@ -0,0 +1,79 @@
+import datetime
+
+import pytest
+
+import archive
+import db
+
+TODAY = datetime.date(2024, 6, 1)
+OLD = datetime.date(2020, 1, 1)
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    path = str(tmp_path / "clients.db")
+    monkeypatch.setattr(db, "DB", path)
+    db.init_db()
+    # 1: closed long ago; 2: active with old history; 3: old but still owes
+    db.add_client("Closed", "", "", 1000, "Paid", OLD, OLD)
+    db.add_hearing(1, datetime.date(2020, 2, 1), "")
+    db.add_payment(1, datetime.date(2020, 3, 1), 1000, "Cash", "")
+    db.add_client("Active", "", "", 2000, "Partial", None, datetime.date(2021, 1, 1))
+    db.add_payment(2, datetime.date(2021, 2, 1), 500, "Cash", "")
+    db.add_hearing(2, datetime.date(2021, 3, 1), "")
+    db.add_hearing(2, datetime.date(2024, 5, 1), "")
+    db.add_payment(2, datetime.date(2024, 5, 2), 500, "Cash", "")
+    db.add_client("Owes", "", "", 500, "Unpaid", OLD, OLD)
+    return path
+
+def hot_ids(path, table="clients"):
+    return {r[0] for r in db.manager(path).reader().execute(f"SELECT id FROM main.{table}")}
+
+def counts(path):
+    con = archive.reader(path)
+    return {t: con.execute(f"SELECT COUNT(*) FROM {archive.union(t, 'id')}").fetchone()[0]
+            for t in ("clients", "hearings", "payments")}
+
+def test_run_moves_closed_clients_and_old_rows(path):
+    assert archive.preview(path=path, today=TODAY) == {"clients": 1, "hearings": 2, "payments": 2}
+    assert archive.run(path=path, today=TODAY) == {"clients": 1, "hearings": 2, "payments": 2}
+    assert hot_ids(path) == {2, 3}
+    assert hot_ids(path, "hearings") == {3}
+    assert hot_ids(path, "payments") == {3}
+    assert counts(path) == {"clients": 3, "hearings": 3, "payments": 3}
+    # the moved payment is carried, so the active client's balance is unchanged
+    assert db.balance_for(2)["total_paid"] == 1000
+    assert db.balance_for(2)["pending"] == 1000
+    assert db.verify_balances() == []
+    assert archive.run(path=path, today=TODAY) == {"clients": 0, "hearings": 0, "payments": 0}
+
+def test_restore_round_trip(path):
+    archive.run(path=path, today=TODAY)
+    assert archive.restore(1, path) == {"clients": 1, "hearings": 1, "payments": 1}
+    assert archive.restore(2, path) == {"clients": 0, "hearings": 1, "payments": 1}
+    assert hot_ids(path) == {1, 2, 3}
+    assert archive.stats(path)["clients"] == archive.stats(path)["payments"] == 0
+    assert counts(path) == {"clients": 3, "hearings": 3, "payments": 3}
+    assert db.balance_for(1) == {"total_paid": 1000, "pending": 0,
+                                 "last_payment_date": datetime.date(2020, 3, 1), "payment_count": 1}
+    assert db.balance_for(2)["total_paid"] == 1000
+    assert db.verify_balances() == []
+    with pytest.raises(KeyError):
+        archive.restore(99, path)
+
+def test_client_edited_during_move_stays_hot(path, monkeypatch):
+    rebalance = archive.rebalance
+
+    def edit_then_rebalance(con, client_ids):
+        # lands after the copy, before the client row is deleted
+        con.execute("UPDATE main.clients SET contact = 'new number' WHERE id = 1")
+        rebalance(con, client_ids)
+
+    monkeypatch.setattr(archive, "rebalance", edit_then_rebalance)
+    assert archive.run(path=path, today=TODAY)["clients"] == 0
+    assert hot_ids(path) == {1, 2, 3}
+    assert db.verify_balances() == []
+
+    monkeypatch.setattr(archive, "rebalance", rebalance)
+    assert archive.run(path=path, today=TODAY)["clients"] == 1
+    assert archive.archived_clients(path=path)["contact"].tolist() == ["new number"]
@@ -0,0 +1,75 @@
+import datetime
+import time
+
+import backup
+import db
+import jobs
+
+
+def add_clients(n, note="x" * 200):
+    with db.writer() as con:
+        con.executemany("INSERT INTO clients (id, name, agreed_fee) VALUES (?, ?, 1000)",
+                        [(i, f"Client {i}") for i in range(1, n + 1)])
+        con.executemany("INSERT INTO hearings (client_id, hearing_date, note) VALUES (?, 19800, ?)",
+                        [(i, note) for i in range(1, n + 1)])
+        con.executemany("INSERT INTO payments (client_id, pay_date, amount) VALUES (?, 19801, 400)",
+                        [(i,) for i in range(1, n + 1)])
+
+def test_snapshot_is_checked_and_readable(database):
+    add_clients(50)
+    [made] = backup.snapshot(database)
+    assert made["integrity"] == "ok"
+    assert made["counts"] == {"clients": 50, "hearings": 50, "payments": 50}
+    assert [s["name"] for s in backup.list_snapshots(database)] == [made["name"]]
+    with backup.opened(made["name"], database) as con:
+        assert con.execute("SELECT SUM(amount) FROM payments").fetchone()[0] == 50 * 400
+    assert backup.inspect(made["name"], database)["deleted_count"] == 0
+
+def test_backup_job_copies_in_small_steps(database, monkeypatch):
+    # job progress must not commit to the database being copied, or every
+    # commit restarts the online backup
+    add_clients(2000)
+    monkeypatch.setattr(backup, "PAGES_PER_STEP", 8)
+    monkeypatch.setattr(backup, "STEP_SLEEP", 0)
+    runner = jobs.JobRunner(database)
+    try:
+        job_id = runner.submit("backup")
+        while runner.get(job_id)["status"] in jobs.ACTIVE:
+            time.sleep(0.01)
+        assert runner.get(job_id)["status"] == "done"
+    finally:
+        runner.shutdown()
+    [made] = backup.list_snapshots(database)
+    assert made["restarts"] == 0
+
+def test_prune_keeps_last_daily_and_weekly(database):
+    add_clients(5)
+    now = datetime.datetime(2024, 6, 15, 12, 0)
+    taken = [now - datetime.timedelta(days=d, hours=h) for d in (0, 1, 2, 10, 40) for h in (0, 1)]
+    for t in taken:
+        backup.snapshot(database, now=t)
+    removed = backup.prune(database, keep_last=3, keep_daily=3, keep_weekly=2, now=now)
+    left = sorted(s["taken"] for s in backup.list_snapshots(database))
+    # the newest three, the newest of each of the last three days and the
+    # newest of this and last ISO week; the 40 day old ones go
+    assert left == sorted(taken[:3] + [taken[4], taken[6]])
+    assert len(removed) == len(taken) - len(left)
+
+def test_recover_client_brings_back_rows_and_ledger(database):
+    add_clients(3)
+    [made] = backup.snapshot(database)
+    db.delete_client(2)
+    assert backup.inspect(made["name"], database)["deleted_clients"]["id"].tolist() == [2]
+    assert backup.recover_client(made["name"], 2, database) == {"clients": 1, "hearings": 1, "payments": 1}
+    assert db.balance_for(2)["total_paid"] == 400
+    assert db.balance_for(2)["pending"] == 600
+    assert db.verify_balances() == []
+
+def test_scheduler_waits_an_interval_before_the_first_snapshot(database):
+    sched = backup.Scheduler(database, interval_min=60)
+    try:
+        assert sched.next_due() >= sched.started + datetime.timedelta(minutes=60)
+        time.sleep(0.2)
+        assert sched.last_run is None and backup.list_snapshots(database) == []
+    finally:
+        sched.stop()
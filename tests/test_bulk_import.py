@@ -0,0 +1,25 @@
+import io
+
+import bulk_import
+import db
+
+
+def test_dates_keep_the_written_day_and_bad_rows_report_their_line(database):
+    db.add_client("Asha", "", "", 0, "Unpaid", None, None)
+    csv = io.StringIO("client,hearing date,note\n"
+                      "Asha,2024-03-01,iso\n"                        # line 2
+                      "Asha,2024-03-01T23:30:00+05:30,offset\n"      # 3
+                      "Asha,2024-03-02 10:00,no offset\n"            # 4
+                      "Asha,not a date,junk\n"                       # 5
+                      "Asha,2024-03-03T01:00:00-08:00,other offset\n"  # 6
+                      "Asha,05/03/2024 10:00 +00:00,day first with offset\n"  # 7
+                      "Asha,2024-02-30,no such day\n"                # 8
+                      "Asha,06-03-2024,day first\n")                 # 9
+    report = bulk_import.import_file("hearings", csv, filename="h.csv")
+    assert [(line, col, msg) for line, col, _, msg in report.errors] == [
+        (5, "hearing_date", "invalid date"), (8, "hearing_date", "invalid date")]
+    assert report.loaded == 6
+    got = db.manager().reader().execute("SELECT note, hearing_date FROM hearings ORDER BY id").fetchall()
+    assert [(note, str(db.from_days(day))) for note, day in got] == [
+        ("iso", "2024-03-01"), ("offset", "2024-03-01"), ("no offset", "2024-03-02"),
+        ("other offset", "2024-03-03"), ("day first with offset", "2024-03-05"), ("day first", "2024-03-06")]
@@ -0,0 +1,37 @@
+import db
+
+
+def add(name, case="", contact=""):
+    db.add_client(name, case, contact, 0, "Unpaid", None, None)
+
+def test_prefix_lookup_in_name_order(database):
+    for name in ["banerjee", "Bakshi", "Ahmed", "  Bal ", "Chitra", "BALA"]:
+        add(name)
+    index = db.client_index()
+    assert len(index) == 6 and 3 in index and 99 not in index
+    ids, total = index.prefix("ba")
+    assert [index.get(i)["name"] for i in ids] == ["Bakshi", "  Bal ", "BALA", "banerjee"] and total == 4
+    assert index.prefix("BA", limit=2) == (ids[:2], 4)
+    assert index.prefix("bal") == ([4, 6], 2)
+    assert index.prefix("z") == ([], 0)
+    assert index.prefix("")[1] == 6
+
+def test_duplicate_names_get_telling_labels(database):
+    add("Ravi Patil", case="Cheque bounce")
+    add("ravi patil ", contact="98200 00000")
+    add("Ravi Patil")
+    add("Sunita")
+    index = db.client_index()
+    assert index.ambiguous == {"ravi patil"}
+    assert index.unique == {"sunita": 4}
+    assert [index.label(i) for i in (1, 2, 3, 4)] == [
+        "Ravi Patil · Cheque bounce (#1)", "ravi patil  · 98200 00000 (#2)", "Ravi Patil (#3)", "Sunita"]
+    assert index.label(42) == "#42"
+
+def test_index_is_rebuilt_after_a_write(database):
+    add("Asha")
+    first = db.client_index()
+    assert db.client_index() is first
+    add("Asha")
+    again = db.client_index()
+    assert again is not first and again.ambiguous == {"asha"}
@@ -0,0 +1,136 @@
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import db
+
+
+@pytest.fixture
+def mgr(tmp_path, monkeypatch):
+    # no driver-level wait, so SQLITE_BUSY reaches the manager's own retry
+    monkeypatch.setitem(db.PRAGMAS, "busy_timeout", 0)
+    m = db.ConnectionManager(str(tmp_path / "t.db"), backoff=0.02)
+    with m.writer() as con:
+        con.execute("CREATE TABLE t (x INTEGER)")
+    yield m
+    m.close()
+
+def count(m):
+    return m.reader().execute("SELECT COUNT(*) FROM t").fetchone()[0]
+
+def hold_write_lock(path, seconds):
+    other = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+
+    def release():
+        time.sleep(seconds)
+        other.execute("COMMIT")
+        other.close()
+
+    t = threading.Thread(target=release)
+    t.start()
+    return t
+
+# ---------------- ConnectionManager ----------------
+def test_writer_retries_while_another_process_writes(mgr):
+    t = hold_write_lock(mgr.path, 0.15)
+    with mgr.writer() as con:
+        con.execute("INSERT INTO t VALUES (1)")
+    t.join()
+    assert count(mgr) == 1
+
+def test_writer_gives_up_after_its_retries(mgr):
+    mgr.retries = 1
+    t = hold_write_lock(mgr.path, 0.5)
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        with mgr.writer() as con:
+            con.execute("INSERT INTO t VALUES (1)")
+    t.join()
+
+def test_nested_writer_joins_the_open_transaction(mgr):
+    before = mgr.generation
+    with pytest.raises(RuntimeError):
+        with mgr.writer() as outer:
+            outer.execute("INSERT INTO t VALUES (1)")
+            with mgr.writer() as inner:
+                assert inner is outer
+                inner.execute("INSERT INTO t VALUES (2)")
+            raise RuntimeError()
+    assert count(mgr) == 0 and mgr.generation == before
+    # one commit, one generation; a nested bump wins over an outer bump=False
+    with mgr.writer(bump=False) as con:
+        con.execute("INSERT INTO t VALUES (1)")
+        with mgr.writer():
+            con.execute("INSERT INTO t VALUES (2)")
+    assert count(mgr) == 2 and mgr.generation == before + 1
+
+def test_readers_of_finished_threads_are_closed(mgr):
+    cons = []
+    threads = [threading.Thread(target=lambda: cons.append(mgr.reader())) for _ in range(3)]
+    for t in threads:
+        t.start()
+        t.join()
+    mgr.reader()
+    assert mgr.stats()["readers"] == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        cons[0].execute("SELECT 1")
+
+def test_cached_reads_follow_local_and_outside_commits(mgr):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return count(mgr)
+
+    assert mgr.cached(("n",), compute) == 0
+    assert mgr.cached(("n",), compute) == 0 and len(calls) == 1
+    with mgr.writer() as con:
+        con.execute("INSERT INTO t VALUES (1)")
+    assert mgr.cached(("n",), compute) == 1 and len(calls) == 2
+    # a commit from another connection (another process) moves data_version
+    other = sqlite3.connect(mgr.path)
+    other.execute("INSERT INTO t VALUES (2)")
+    other.commit()
+    assert mgr.cached(("n",), compute) == 2 and len(calls) == 3
+    # pinned, the thread keeps its version until it pins again
+    mgr.pin_data_version()
+    other.execute("INSERT INTO t VALUES (3)")
+    other.commit()
+    other.close()
+    assert mgr.cached(("n",), compute) == 2
+    mgr.pin_data_version()
+    assert mgr.cached(("n",), compute) == 3 and len(calls) == 4
+
+# ---------------- QueryCache ----------------
+def test_cache_evicts_least_recently_used():
+    cache = db.QueryCache(max_entries=2)
+    cache.put(("a",), 1, "A")
+    cache.put(("b",), 1, "B")
+    assert cache.get(("a",), 1) == "A"
+    cache.put(("c",), 1, "C")
+    assert cache.get(("b",), 1) is None
+    assert cache.get(("a",), 1) == "A" and cache.get(("c",), 1) == "C"
+    assert cache.stats()["evictions"] == 1
+
+def test_cache_bounds_bytes():
+    frame = pd.DataFrame({"x": range(1000)})
+    size = db._sizeof(frame)
+    cache = db.QueryCache(max_bytes=int(size * 2.5))
+    for k in "abc":
+        cache.put((k,), 1, frame)
+    assert cache.stats()["entries"] == 2 and cache.stats()["bytes"] <= cache.max_bytes
+    cache.put(("huge",), 1, pd.concat([frame] * 3))
+    assert cache.get(("huge",), 1) is None
+
+def test_cache_drops_old_generations():
+    cache = db.QueryCache()
+    cache.put(("a",), (1, 0), "old")
+    cache.put(("a",), (2, 0), "new")
+    assert cache.get(("a",), (1, 0)) is None
+    assert cache.get(("a",), (2, 0)) == "new"
+    # a result computed before a concurrent write is not kept
+    cache.put(("b",), (1, 0), "stale")
+    assert cache.get(("b",), (2, 0)) is None and cache.stats()["entries"] == 1
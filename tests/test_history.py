@@ -0,0 +1,69 @@
+import datetime
+
+import pytest
+
+import archive
+import db
+
+DAY = datetime.date(2024, 3, 1)
+
+
+@pytest.fixture
+def hearings(database):
+    # 7 hearings on two days (ties on the date), ids 1..7
+    db.add_client("A", "", "", 0, "Unpaid", None, None)
+    db.add_client("B", "", "", 0, "Unpaid", None, None)
+    for i in range(7):
+        db.add_hearing(1 + i % 2, DAY + datetime.timedelta(days=i // 4), f"h{i + 1}")
+    return database
+
+def pages(fetch):
+    """Walk forward like the pager does; returns the id pages and the cursor stack."""
+    stack, out = [None], []
+    while True:
+        df, nxt = fetch(stack[-1])
+        out.append(df["id"].tolist())
+        if nxt is None:
+            return out, stack
+        stack.append(nxt)
+
+def test_hearing_pages_walk_ties_forward_and_back(hearings):
+    out, stack = pages(lambda after: db.hearings_page(None, None, None, False, after, 3))
+    assert out == [[1, 2, 3], [4, 5, 6], [7]]
+    # back: the previous cursor on the stack gives the previous page again
+    stack.pop()
+    assert db.hearings_page(None, None, None, False, stack[-1], 3)[0]["id"].tolist() == [4, 5, 6]
+    assert db.count_hearings() == 7
+    assert pages(lambda after: db.hearings_page(2, None, None, False, after, 3))[0] == [[2, 4, 6]]
+
+def test_payment_pages_run_newest_first(database):
+    db.add_client("A", "", "", 0, "Unpaid", None, None)
+    for i in range(5):
+        db.add_payment(1, DAY + datetime.timedelta(days=i // 2), 100 + i, "Cash" if i % 2 else "UPI", "")
+    out, _ = pages(lambda after: db.payments_page(None, None, None, None, False, after, 3))
+    assert out == [[5, 4, 3], [2, 1]]
+    assert pages(lambda after: db.payments_page(None, None, None, "Cash", False, after, 3))[0] == [[4, 2]]
+    assert db.count_payments(None, None, None, "Cash") == (2, 101.0 + 103.0)
+
+def test_archived_pages_union_hot_and_archived_rows(hearings):
+    db.add_hearing(1, datetime.date(2024, 6, 1), "recent")
+    archive.run(today=datetime.date(2024, 6, 1), horizon_days=30)
+    assert pages(lambda after: db.hearings_page(None, None, None, False, after, 3))[0] == [[8]]
+    out, _ = pages(lambda after: db.hearings_page(None, None, None, True, after, 3))
+    assert out == [[1, 2, 3], [4, 5, 6], [7, 8]]
+    assert db.count_hearings(None, None, None, True) == 8
+    assert db.hearings_page(None, None, None, True, None, 3)[0]["name"].tolist() == ["A", "B", "A"]
+
+def test_cache_counts_the_frames_inside_a_page(hearings):
+    page = db.hearings_page()
+    assert db._sizeof(page) > db._sizeof(page[0]) > 0
+
+def test_archived_rows_of_a_deleted_client_are_neither_counted_nor_listed(hearings):
+    db.add_hearing(2, datetime.date(2024, 6, 1), "keeps B hot")
+    archive.run(today=datetime.date(2024, 6, 1), horizon_days=30)
+    db.delete_client(2)
+    assert db.count_hearings(None, None, None, True) == 4
+    out, _ = pages(lambda after: db.hearings_page(None, None, None, True, after, 3))
+    assert out == [[1, 3, 5], [7]]
+    assert db.collections_report(DAY, DAY, True).empty
+    assert db.hearing_load(DAY, DAY, True)[1]["hearings"].sum() == 2
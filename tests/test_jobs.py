@@ -0,0 +1,102 @@
+import datetime
+import os
+import threading
+import time
+
+import pytest
+
+import db
+import jobs
+
+release = threading.Event()
+ran = []
+
+
+@jobs.register("test_wait")
+def wait_job(job, tag=None):
+    ran.append(tag)
+    release.wait(5)
+    return None
+
+@jobs.register("test_steps")
+def steps_job(job, steps=1000):
+    for i in range(steps):
+        ran.append(i)
+        job.progress(i / steps)
+        time.sleep(0.001)
+    return None
+
+
+@pytest.fixture
+def runner(database):
+    release.clear()
+    ran.clear()
+    r = jobs.JobRunner(database, max_workers=1)
+    yield r
+    release.set()
+    r.shutdown()
+
+def wait_for(runner, job_id, *statuses):
+    for _ in range(500):
+        job = runner.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} stuck in {job['status']}")
+
+def test_identical_active_submissions_share_a_job(runner):
+    first = runner.submit("test_wait", tag="a")
+    assert runner.submit("test_wait", tag="a") == first
+    other = runner.submit("test_wait", tag="b")
+    assert other != first
+    release.set()
+    wait_for(runner, first, "done")
+    wait_for(runner, other, "done")
+    # once finished, the same request is a new job
+    assert runner.submit("test_wait", tag="a") not in (first, other)
+
+def test_cancel_before_start_never_runs(runner):
+    busy = runner.submit("test_wait", tag="busy")
+    wait_for(runner, busy, "running")
+    queued = runner.submit("test_wait", tag="queued")
+    runner.cancel(queued)
+    assert runner.get(queued)["status"] == "cancelled"
+    release.set()
+    wait_for(runner, busy, "done")
+    runner._pool.submit(lambda: None).result()     # the queued one has had its turn
+    assert ran == ["busy"] and runner.get(queued)["status"] == "cancelled"
+
+def test_cancel_while_running_stops_at_the_next_progress(runner):
+    job_id = runner.submit("test_steps")
+    wait_for(runner, job_id, "running")
+    while not ran:
+        time.sleep(0.001)
+    runner.cancel(job_id)
+    job = wait_for(runner, job_id, "cancelled")
+    assert len(ran) < 1000 and job["finished_at"]
+
+def test_failures_keep_the_error(runner):
+    job_id = runner.submit("test_steps", steps="x")
+    job = wait_for(runner, job_id, "failed")
+    assert "TypeError" in job["error"]
+
+def test_restart_fails_interrupted_jobs_and_purges_old_ones(runner, database):
+    old = (datetime.datetime.now() - datetime.timedelta(days=jobs.ARTIFACT_TTL_DAYS + 1)).isoformat(timespec="seconds")
+    artifact = os.path.join(jobs.artifact_dir(database), "job-old.pdf")
+    open(artifact, "w").close()
+    with db.manager(database).writer(bump=False) as con:
+        con.executemany("INSERT INTO jobs (kind, params, dedupe_key, status, created_at, artifact) VALUES (?,?,?,?,?,?)", [
+            ("test_wait", "{}", "k1", "running", jobs._now(), None),
+            ("test_wait", "{}", "k2", "queued", old, None),
+            ("test_wait", "{}", "k3", "done", old, artifact),
+            ("test_wait", "{}", "k4", "done", jobs._now(), None),
+        ])
+    restarted = jobs.JobRunner(database)
+    try:
+        left = {j["dedupe_key"]: j for j in restarted.recent()}
+    finally:
+        restarted.shutdown()
+    # interrupted jobs fail; old finished ones go with their artifacts
+    assert left["k1"]["status"] == "failed" and left["k1"]["error"] == "interrupted by restart"
+    assert set(left) == {"k1", "k4"}
+    assert not os.path.exists(artifact)
@@ -0,0 +1,52 @@
+import datetime
+
+import db
+
+D = datetime.date(2024, 3, 1)
+
+
+def write(sql, *params):
+    with db.writer() as con:
+        con.execute(sql, params)
+
+def test_ledger_follows_every_kind_of_payment_change(database):
+    db.add_client("A", "", "", 1000, "Unpaid", None, None)
+    db.add_client("B", "", "", 500, "Unpaid", None, None)
+    assert db.balance_for(1) == {"total_paid": 0, "pending": 1000, "last_payment_date": None, "payment_count": 0}
+    db.add_payment(1, D, 300, "Cash", "")
+    db.add_payment(1, D + datetime.timedelta(days=5), 200, "UPI", "")
+    assert db.balance_for(1) == {"total_paid": 500, "pending": 500,
+                          "last_payment_date": D + datetime.timedelta(days=5), "payment_count": 2}
+    write("UPDATE payments SET amount = 900 WHERE id = 1")
+    # overpaid: nothing pending
+    assert db.balance_for(1)["pending"] == 0 and db.balance_for(1)["total_paid"] == 1100
+    # moving the latest payment to another client, and back-dating the other one
+    write("UPDATE payments SET client_id = 2 WHERE id = 2")
+    write("UPDATE payments SET pay_date = ? WHERE id = 1", db.to_days(D - datetime.timedelta(days=1)))
+    assert db.balance_for(1) == {"total_paid": 900, "pending": 100,
+                          "last_payment_date": D - datetime.timedelta(days=1), "payment_count": 1}
+    assert db.balance_for(2)["total_paid"] == 200 and db.balance_for(2)["pending"] == 300
+    write("UPDATE clients SET agreed_fee = 2000 WHERE id = 1")
+    assert db.balance_for(1)["pending"] == 1100
+    write("DELETE FROM payments WHERE id = 1")
+    assert db.balance_for(1) == {"total_paid": 0, "pending": 2000, "last_payment_date": None, "payment_count": 0}
+    assert db.verify_balances() == []
+
+def test_deleting_a_client_drops_its_ledger_row(database):
+    db.add_client("A", "", "", 1000, "Unpaid", None, None)
+    db.add_payment(1, D, 300, "Cash", "")
+    db.delete_client(1)
+    con = db.manager().reader()
+    assert con.execute("SELECT COUNT(*) FROM client_balances").fetchone()[0] == 0
+    assert db.verify_balances() == []
+
+def test_rebuild_matches_the_triggers(database):
+    for i in range(1, 21):
+        db.add_client(f"C{i}", "", "", 100 * i, "Unpaid", None, None)
+        for k in range(i % 4):
+            db.add_payment(i, D + datetime.timedelta(days=k), 25 * (k + 1), "Cash", "")
+    before = db.df_outstanding(50)
+    assert db.rebuild_balances() == 20
+    db.manager().invalidate()
+    assert db.df_outstanding(50).equals(before)
+    assert db.verify_balances() == []
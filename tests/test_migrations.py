@@ -0,0 +1,81 @@
+import datetime
+import sqlite3
+
+import pytest
+
+import db
+import migrations
+
+
+def legacy_db(path):
+    """A version 6 database whose dates are still TEXT."""
+    con = sqlite3.connect(path, isolation_level=None)
+    for number, _, fn in migrations.MIGRATIONS:
+        if number < 7:
+            fn(con)
+            con.execute(f"PRAGMA user_version = {number}")
+    return con
+
+def migrated_with_bad_dates(path):
+    con = legacy_db(path)
+    con.execute("""INSERT INTO clients (id, name, agreed_fee, commitment_date, first_visit_date)
+                   VALUES (1, 'A', 1000, '2024-03-01', '2024-01-15 10:30:00'),
+                          (2, 'B', 500, '05/02/2024', 'now'),
+                          (3, 'C', 0, NULL, '2024-02-30')""")
+    hearings = {1: "2024-03-01", 2: "2024-03-01T23:00:00-05:00", 3: "01-Apr-2024", 4: "2024", 5: "12:30", 6: "2024-03-01junk"}
+    payments = {1: "2024-03-02", 2: "15.03.2024", 3: "45123", 4: "2024-13-01"}
+    con.executemany("INSERT INTO hearings (id, client_id, hearing_date) VALUES (?, 1, ?)", hearings.items())
+    con.executemany("INSERT INTO payments (id, client_id, pay_date, amount) VALUES (?, 1, ?, 100)", payments.items())
+    con.close()
+    assert migrations.migrate(db.manager(path)) == [7, 8]
+
+def test_m007_converts_text_dates_and_records_rejects(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    migrated_with_bad_dates(path)
+    con = sqlite3.connect(path)
+    day = lambda y, m, d: db.to_days(datetime.date(y, m, d))
+    assert con.execute("SELECT id, commitment_date, first_visit_date FROM clients ORDER BY id").fetchall() == [
+        (1, day(2024, 3, 1), day(2024, 1, 15)),
+        (2, day(2024, 2, 5), None),
+        (3, None, None),
+    ]
+    # unreadable hearings and payments are held out of their tables
+    assert dict(con.execute("SELECT id, hearing_date FROM hearings")) == {
+        1: day(2024, 3, 1), 2: day(2024, 3, 1), 3: day(2024, 4, 1)}
+    assert dict(con.execute("SELECT id, pay_date FROM payments")) == {1: day(2024, 3, 2), 2: day(2024, 3, 15)}
+    assert sorted(con.execute("SELECT table_name, row_id, column_name, original FROM date_rejects")) == [
+        ("clients", 2, "first_visit_date", "now"),
+        ("clients", 3, "first_visit_date", "2024-02-30"),
+        ("hearings", 4, "hearing_date", "2024"),
+        ("hearings", 5, "hearing_date", "12:30"),
+        ("hearings", 6, "hearing_date", "2024-03-01junk"),
+        ("payments", 3, "pay_date", "45123"),
+        ("payments", 4, "pay_date", "2024-13-01"),
+    ]
+    # every stored date is a day number now, and the ledger was rebuilt on them
+    for table, col, _ in migrations.DATE_COLUMNS:
+        assert con.execute(f"SELECT COUNT(*) FROM {table} WHERE typeof({col}) NOT IN ('integer', 'null')"
+                           ).fetchone()[0] == 0
+    assert con.execute("SELECT total_paid, last_payment_date FROM client_balances WHERE client_id = 1").fetchone() == (
+        200, day(2024, 3, 15))
+    con.close()
+
+def test_date_rejects_can_be_fixed_or_discarded(tmp_path, monkeypatch):
+    path = str(tmp_path / "legacy.db")
+    migrated_with_bad_dates(path)
+    monkeypatch.setattr(db, "DB", path)
+    assert len(db.date_rejects()) == 7
+    db.fix_date_reject("payments", 3, "pay_date", datetime.date(2023, 7, 15))
+    db.fix_date_reject("clients", 2, "first_visit_date", datetime.date(2024, 2, 1))
+    db.discard_date_reject("hearings", 4, "hearing_date")
+    rejects = db.date_rejects()
+    assert list(zip(rejects["table_name"], rejects["row_id"])) == [
+        ("clients", 3), ("hearings", 5), ("hearings", 6), ("payments", 4)]
+    # the payment is back, with its amount, in the ledger
+    assert db.manager().reader().execute("SELECT amount, pay_date FROM payments WHERE id = 3").fetchone() == (
+        100, db.to_days(datetime.date(2023, 7, 15)))
+    assert db.balance_for(1)["total_paid"] == 300
+    assert db.verify_balances() == []
+    assert db.as_date(db.df_clients().set_index("id").at[2, "first_visit_date"]) == datetime.date(2024, 2, 1)
+    with pytest.raises(KeyError):
+        db.fix_date_reject("hearings", 4, "hearing_date", datetime.date(2024, 1, 1))
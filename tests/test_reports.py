@@ -0,0 +1,57 @@
+import datetime
+
+import db
+
+AS_OF = datetime.date(2024, 6, 30)
+
+
+def client(name, overdue_days, fee=1000):
+    due = None if overdue_days is None else AS_OF - datetime.timedelta(days=overdue_days)
+    db.add_client(name, "", "", fee, "Unpaid", due, None)
+
+def test_aging_buckets_split_on_their_boundaries(database):
+    for days in (-1, 0, 30, 31, 180, 181, None):
+        client(f"due {days}", days)
+    buckets, debtors = db.aging_report(AS_OF)
+    assert db.AGING_LABELS == ["Not yet due", "0–30 days", "31–60 days", "61–90 days", "91–180 days",
+                               "181+ days", "No commitment date"]
+    placed = dict(zip(debtors["name"], debtors["bucket"]))
+    assert placed == {"due -1": "Not yet due", "due 0": "0–30 days", "due 30": "0–30 days",
+                      "due 31": "31–60 days", "due 180": "91–180 days", "due 181": "181+ days",
+                      "due None": "No commitment date"}
+    assert buckets["bucket"].tolist() == db.AGING_LABELS
+    assert buckets["clients"].tolist() == [1, 2, 1, 0, 1, 1, 1]
+    assert buckets["cumulative"].tolist() == [1000, 3000, 4000, 4000, 5000, 6000, 7000]
+
+def test_aging_leaves_out_paid_clients(database):
+    client("paid", 45)
+    db.add_payment(1, AS_OF, 1000, "Cash", "")
+    client("part paid", 45)
+    db.add_payment(2, AS_OF, 400, "Cash", "")
+    buckets, debtors = db.aging_report(AS_OF)
+    assert debtors["name"].tolist() == ["part paid"]
+    assert buckets.set_index("bucket").at["31–60 days", "pending"] == 600
+
+def test_collections_per_month_and_mode(database):
+    client("A", 0, fee=10000)
+    for day, amount, mode in [(datetime.date(2024, 5, 3), 100, "Cash"), (datetime.date(2024, 5, 20), 300, "UPI"),
+                              (datetime.date(2024, 6, 1), 50, "Cash"), (datetime.date(2024, 7, 1), 999, "Cash")]:
+        db.add_payment(1, day, amount, mode, "")
+    got = db.collections_report(datetime.date(2024, 5, 1), AS_OF)
+    assert list(zip(got["month"], got["mode"], got["amount"], got["share"], got["running_total"])) == [
+        ("2024-05", "UPI", 300, 0.75, 300), ("2024-05", "Cash", 100, 0.25, 100), ("2024-06", "Cash", 50, 1.0, 150)]
+
+def test_hearing_load_weeks_and_courts(database):
+    client("A", 0)
+    # 2024-06-03 is a Monday
+    for day, note in [(3, "High Court - bail"), (3, "JMFC, evidence"), (5, "high court"), (17, "")]:
+        db.add_hearing(1, datetime.date(2024, 6, day), note)
+    # the period starts mid-week: the week is shown whole, the 3rd not counted
+    by_week, by_court = db.hearing_load(datetime.date(2024, 6, 4), datetime.date(2024, 6, 23))
+    assert [str(w) for w in by_week["week"]] == ["2024-06-03", "2024-06-10", "2024-06-17"]
+    assert by_week["hearings"].tolist() == [1, 0, 1]
+    by_week, by_court = db.hearing_load(datetime.date(2024, 6, 3), datetime.date(2024, 6, 23))
+    assert by_week["hearings"].tolist() == [3, 0, 1]
+    assert by_week["busiest_day"].tolist() == [2, 0, 1]
+    assert list(zip(by_court["court"], by_court["hearings"])) == [
+        ("High Court", 2), ("(no court noted)", 1), ("JMFC", 1)]
@@ -0,0 +1,44 @@
+import datetime
+
+import db
+
+D = datetime.date(2024, 3, 1)
+
+
+def index_rows():
+    con = db.manager().reader()
+    return {r[0]: r[1:] for r in con.execute("SELECT rowid, kind, client_id, note FROM search_index")}
+
+def found(text):
+    return db.search_clients(text)["name"].tolist()
+
+def test_search_matches_prefixes_across_fields_best_first(database):
+    db.add_client("Rajesh Kulkarni", "Property dispute", "98220 11111", 0, "Unpaid", None, None)
+    db.add_client("Meera Joshi", "Divorce petition", "", 0, "Unpaid", None, None)
+    db.add_hearing(2, D, "Family court, Rajesh appears as witness")
+    db.add_payment(1, D, 100, "Cash", "advance for séance fees")
+    assert found("raj") == ["Rajesh Kulkarni", "Meera Joshi"]     # the name outranks a note
+    assert found("prop disp") == ["Rajesh Kulkarni"]
+    assert found("98220") == ["Rajesh Kulkarni"]
+    assert found("seance") == ["Rajesh Kulkarni"]                 # diacritics removed
+    assert found("family witness") == ["Meera Joshi"]
+    assert db.search_clients("raj").set_index("name").at["Meera Joshi", "kind"] == "hearing"
+    assert found("") == [] and found("!!") == []
+
+def test_triggers_keep_the_index_in_step(database):
+    db.add_client("Asha", "", "", 0, "Unpaid", None, None)
+    db.add_client("Bina", "", "", 0, "Unpaid", None, None)
+    db.add_hearing(1, D, "bail hearing")
+    db.add_payment(1, D, 100, "Cash", "")                         # no note, no row
+    db.add_payment(1, D, 100, "Cash", "cheque bounced")
+    assert index_rows() == {3: ("client", 1, None), 6: ("client", 2, None),
+                            4: ("hearing", 1, "bail hearing"), 8: ("payment", 1, "cheque bounced")}
+    with db.writer() as con:
+        con.execute("UPDATE hearings SET note = 'remand', client_id = 2 WHERE id = 1")
+        con.execute("UPDATE clients SET name = 'Asha Rao' WHERE id = 1")
+    assert index_rows()[4] == ("hearing", 2, "remand")
+    assert found("rao") == ["Asha Rao"] and found("bail") == []
+    # deleting a client cascades to its payments, and their rows go too
+    db.delete_client(1)
+    assert index_rows() == {6: ("client", 2, None), 4: ("hearing", 2, "remand")}
+    assert db.rebuild_search() == 2 and len(index_rows()) == 2